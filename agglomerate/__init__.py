@@ -1,5 +1,5 @@
 # import common classes so we can import them as agglomerate.Class
 from agglomerate.algorithm import Algorithm
 from agglomerate.format import Format
-from agglomerate.items import (Item, Sprite, Group, Parameters)
+from agglomerate.items import (Item, Sprite, PlacedSprite, Group, Parameters)
 from agglomerate.settings import (Settings, SheetSettings)
@@ -20,6 +20,11 @@ class Algorithm:
             ignored if auto_size is False
     - auto_power_of_two_size: if the algorithm supports defining a power-of-two
             sized sheet, ignored if auto_size is False
+
+    - masks: True if the algorithm places the sprites by their masks, so
+            their rectangles can overlap and the formats must support masks
+    - sorts_items: True if the algorithm sorts the items itself, so the
+            order in which they are given doesn't change the layout
     """
     supports = {
                 "rotation": False,
@@ -28,7 +33,10 @@ class Algorithm:
 
                 "auto_size": False,
                 "auto_square_size": False,
-                "auto_power_of_two_size": False
+                "auto_power_of_two_size": False,
+
+                "masks": False,
+                "sorts_items": False,
                }
 
     @abc.abstractmethod
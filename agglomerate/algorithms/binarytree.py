@@ -17,6 +17,8 @@ class BinaryTreeAlgorithm(agglomerate.Algorithm):
                 "auto_size": True,
                 "auto_square_size": False,
                 "auto_power_of_two_size": False,
+
+                "sorts_items": True,
                }
 
     def pack(self, sprites, settings):
@@ -32,8 +34,6 @@ class BinaryTreeAlgorithm(agglomerate.Algorithm):
             free_node = root_node.find_space(sprite.size)
             if free_node:
                 place_sprite(sprite, free_node)
-                print("Placed in")
-                print(sprite.position)
                 return True
             else:
                 return False
@@ -70,25 +70,21 @@ class BinaryTreeAlgorithm(agglomerate.Algorithm):
             if should_extend_below:
                 new_root = extend_below(root_node, sprite.size.y)
                 place_sprite(sprite, new_root.down)
-                print("Extending below")
                 return new_root
 
             elif should_extend_right:
                 new_root = extend_right(root_node, sprite.size.x)
                 place_sprite(sprite, new_root.right)
-                print("Extending right")
                 return new_root
 
             elif can_extend_below:
                 new_root = extend_below(root_node, sprite.size.y)
                 place_sprite(sprite, new_root.down)
-                print("Extending below")
                 return new_root
 
             elif can_extend_right:
                 new_root = extend_right(root_node, sprite.size.x)
                 place_sprite(sprite, new_root.right)
-                print("Extending right")
                 return new_root
 
             else:
@@ -246,10 +242,8 @@ class BinaryTreeAlgorithm(agglomerate.Algorithm):
         root_node = Node(Vector2(0, 0), Vector2(w, h))
 
         for s in sprites:
-            print("Choosing a new sprite")
             # Try to place it in free space, else extend the sheet
             if not place_sprite_in_free_space(s, root_node):
-                print("Cant fit sprite, extending sheet")
                 root_node = place_sprite_extending_sheet(s, root_node)
 
         # Update settings
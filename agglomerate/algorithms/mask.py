@@ -0,0 +1,274 @@
+import agglomerate
+import agglomerate.algorithm
+import agglomerate.compression
+from agglomerate.math import Vector2
+import math
+
+import numpy
+import PIL.Image
+
+
+class MaskAlgorithm(agglomerate.Algorithm):
+    """
+    Packing by the shape of the sprites, for irregular sprites with large
+    transparent areas
+
+    Each sprite is reduced to a mask of cells of "cell" x "cell" pixels, a
+    cell is occupied if any of its pixels has an alpha greater than
+    "threshold". Both are options in settings.algorithm_options, 4 and 0 by
+    default.
+
+    The sprites are placed one by one from the largest, in the first
+    position of the cells grid (from top to bottom and from left to right)
+    where their occupied cells don't collide with the occupied cells of the
+    sheet. The collisions of a sprite with every position of a band of rows
+    are tested at once using the prefix sums of the rows of the grid.
+
+    Since a sprite can be placed in the transparent areas of others, the
+    rectangles of the sprites can overlap. The algorithm sets the mask field
+    of each sprite, and formats must support masks. Groups are packed as
+    full rectangles. The images of the sprites are decoded while packing.
+
+    If the sheet width is "auto", it's chosen so the sheet is close to a
+    square.
+    """
+    supports = {
+                "rotation": False,
+                "cropping": False,
+                "padding": False,
+
+                "auto_size": True,
+                "auto_square_size": False,
+                "auto_power_of_two_size": False,
+
+                "masks": True,
+               }
+
+    def pack(self, items, settings):
+        cell = int(settings.algorithm_options.get("cell", 4))
+        threshold = int(settings.algorithm_options.get("threshold", 0))
+        if cell < 1:
+            raise ValueError("The cell size must be positive")
+
+        # sprites sharing compression blocks would be compressed together
+        if agglomerate.compression.is_block_format(
+                getattr(settings, "output_sheet_format", None)):
+            raise ValueError("Sheets packed by masks can't be block "
+                             "compressed")
+
+        if len(items) == 0:
+            w, h = settings.size.to_tuple()
+            settings.size = Vector2(0 if w == "auto" else w,
+                                    0 if h == "auto" else h)
+            return
+
+        masks = [_get_mask(i, cell, threshold) for i in items]
+
+        w, h = settings.size.to_tuple()
+        if w == "auto":
+            occupied = sum(int(m.sum()) for m in masks)
+            columns = max(max(m.shape[1] for m in masks),
+                          math.ceil(math.sqrt(occupied / _DENSITY)))
+            width = columns * cell
+        else:
+            if any(i.size.x > w for i in items):
+                raise agglomerate.algorithm.AlgorithmOutOfSpaceException(
+                        "Given width it's too small")
+            width = w
+
+        grid = _Grid(math.ceil(width / cell))
+
+        # from the largest, the small ones can fill the holes left
+        order = sorted(range(len(items)),
+                       key=lambda k: (masks[k].size, int(masks[k].sum())),
+                       reverse=True)
+
+        for k in order:
+            i, mask = items[k], masks[k]
+
+            max_x = (width - i.size.x) // cell
+            max_y = None if h == "auto" else (h - i.size.y) // cell
+            position = grid.find(_get_runs(mask), mask.shape[0], max_x,
+                                 max_y)
+            if position is None:
+                raise agglomerate.algorithm.AlgorithmOutOfSpaceException(
+                        "Given height it's too low")
+
+            x, y = position
+            grid.occupy(mask, x, y)
+            i.position = Vector2(x * cell, y * cell)
+            if i.type == "sprite":
+                i.mask = _get_rectangles(mask, cell, i.size)
+
+        if w == "auto":
+            w = max(i.position.x + i.size.x for i in items)
+        if h == "auto":
+            h = max(i.position.y + i.size.y for i in items)
+
+        settings.size = Vector2(w, h)
+
+
+# Expected fraction of the sheet covered by occupied cells, used to choose
+# the width
+_DENSITY = 0.5
+
+
+def _get_mask(item, cell, threshold):
+    """
+    Returns the occupied cells of the item, a bool array of shape (rows,
+    columns). Every cell of groups and opaque sprites is occupied
+    """
+    rows = math.ceil(item.size.y / cell)
+    columns = math.ceil(item.size.x / cell)
+
+    image = getattr(item, "image", None) if item.type == "sprite" else None
+    if image is None or not (image.mode in ("RGBA", "LA", "PA") or
+                             "transparency" in image.info):
+        return numpy.ones((rows, columns), bool)
+
+    if item.rotated:
+        image = image.transpose(PIL.Image.ROTATE_270)
+    if image.mode not in ("RGBA", "LA"):
+        image = image.convert("RGBA")
+
+    # the alpha padded to whole cells, the cells take the maximum alpha
+    alpha = numpy.zeros((rows * cell, columns * cell), numpy.uint8)
+    alpha[:image.height, :image.width] = numpy.asarray(image.getchannel("A"))
+
+    return alpha.reshape(rows, cell, columns, cell).max(axis=(1, 3)) > \
+        threshold
+
+
+def _get_runs(mask):
+    """
+    Returns the horizontal runs of occupied cells of a mask, as (row,
+    start, end) tuples with end exclusive
+    """
+    runs = []
+    for row, cells in enumerate(mask):
+        padded = numpy.concatenate(([False], cells, [False]))
+        edges = numpy.flatnonzero(numpy.diff(padded.astype(numpy.int8)))
+        runs.extend((row, int(a), int(b))
+                    for a, b in zip(edges[::2], edges[1::2]))
+
+    return runs
+
+
+def _get_rectangles(mask, cell, size):
+    """
+    Returns the rectangles covering the occupied cells of a sprite, as
+    (x, y, width, height) tuples in pixels relative to the sprite, clipped
+    to its size. Runs repeated in consecutive rows are joined.
+    """
+    rectangles = []
+    # rectangles still growing down, by their (start, end) cells
+    open_rectangles = {}
+
+    for row in range(mask.shape[0] + 1):
+        runs = set()
+        if row < mask.shape[0]:
+            runs = {(a, b) for __, a, b in _get_runs(mask[row:row + 1])}
+
+        for run in list(open_rectangles):
+            if run not in runs:
+                rectangles.append(open_rectangles.pop(run))
+
+        for a, b in runs:
+            if (a, b) in open_rectangles:
+                x, y, w, __ = open_rectangles[(a, b)]
+                open_rectangles[(a, b)] = \
+                        (x, y, w, min((row + 1) * cell, size.y) - y)
+            else:
+                open_rectangles[(a, b)] = (
+                        a * cell, row * cell,
+                        min(b * cell, size.x) - a * cell,
+                        min((row + 1) * cell, size.y) - row * cell)
+
+    rectangles.sort(key=lambda r: (r[1], r[0]))
+    return rectangles
+
+
+class _Grid:
+    """
+    Occupied cells of the sheet, with the prefix sums of each row so the
+    occupied cells of any range of a row can be counted at once.
+
+    The grid grows down as needed.
+    """
+    # rows tested at a time when searching a position
+    BAND = 64
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.cells = numpy.zeros((0, columns), bool)
+        self.prefix = numpy.zeros((0, columns + 1), numpy.int32)
+        # rows before this one are full
+        self.top = 0
+
+    def find(self, runs, rows, max_x, max_y=None):
+        """
+        Returns the first (x, y) cell where a mask with the given runs
+        doesn't collide with the occupied cells, or None if there is no
+        such position with y <= max_y
+
+        :param list runs: result of _get_runs() of the mask
+        :param int rows: rows of the mask
+        :param int max_x: last column allowed
+        :param int max_y: last row allowed, or None for no limit
+        """
+        if max_x < 0 or max_y is not None and max_y < 0:
+            return None
+
+        y = self.top
+        while max_y is None or y <= max_y:
+            self._reserve(y + self.BAND + rows)
+
+            free = numpy.ones((self.BAND, max_x + 1), bool)
+            for row, start, end in runs:
+                prefix = self.prefix[y + row:y + row + self.BAND]
+                free &= prefix[:, end:end + max_x + 1] == \
+                    prefix[:, start:start + max_x + 1]
+
+            if max_y is not None and max_y - y + 1 < self.BAND:
+                free[max_y - y + 1:] = False
+
+            index = numpy.argmax(free)
+            if free.flat[index]:
+                return (int(index % (max_x + 1)),
+                        int(y + index // (max_x + 1)))
+
+            y += self.BAND
+
+        return None
+
+    def occupy(self, mask, x, y):
+        """
+        Marks the occupied cells of a mask placed in the given cell
+        """
+        rows, columns = mask.shape
+        self._reserve(y + rows)
+
+        self.cells[y:y + rows, x:x + columns] |= mask
+        self.prefix[y:y + rows, 1:] = numpy.cumsum(self.cells[y:y + rows],
+                                                   axis=1)
+
+        while self.top < len(self.cells) and self.cells[self.top].all():
+            self.top += 1
+
+    def _reserve(self, rows):
+        """
+        Makes the grid at least the given amount of rows high
+        """
+        if rows <= len(self.cells):
+            return
+
+        rows = max(rows, 2 * len(self.cells))
+        extra = rows - len(self.cells)
+        self.cells = numpy.concatenate(
+                (self.cells, numpy.zeros((extra, self.columns), bool)))
+        self.prefix = numpy.concatenate(
+                (self.prefix,
+                 numpy.zeros((extra, self.columns + 1), numpy.int32)))
+
+
+algorithm_class = MaskAlgorithm
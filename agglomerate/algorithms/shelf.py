@@ -0,0 +1,266 @@
+import agglomerate
+import agglomerate.algorithm
+from agglomerate.math import Vector2
+import heapq
+import math
+
+
+class ShelfAlgorithm(agglomerate.Algorithm):
+    """
+    Packing in rows (shelves), fast for huge sets of similar sprites
+
+    Sorts the sprites by height, from highest to lowest, and places them one
+    by one from left to right in shelves. Since the sprites are sorted, every
+    shelf already opened is high enough for the next sprite, so only its
+    free width is checked. When no shelf has enough free width, a new shelf
+    is opened below the last one.
+
+    The shelf reuse policy is chosen with the "policy" option in
+    settings.algorithm_options:
+
+    - "first_fit": place in the first shelf with enough free width (default)
+    - "best_fit": place in the shelf with the least free width that is enough
+    - "next_fit": place only in the last shelf opened
+
+    After sorting, placing a sprite takes O(log n) with "first_fit",
+    O(log w) with "best_fit", w being the sheet width, and O(1) with
+    "next_fit".
+
+    If the sheet width is "auto", it's chosen so the sheet is close to a
+    square.
+    """
+    supports = {
+                "rotation": False,
+                "cropping": False,
+                "padding": False,
+
+                "auto_size": True,
+                "auto_square_size": False,
+                "auto_power_of_two_size": False,
+
+                "sorts_items": True,
+               }
+
+    policies = ("first_fit", "best_fit", "next_fit")
+
+    def pack(self, sprites, settings):
+        policy = settings.algorithm_options.get("policy", "first_fit")
+        if policy not in self.policies:
+            raise ValueError("Unknown shelf policy " + str(policy))
+
+        if len(sprites) == 0:
+            w, h = settings.size.to_tuple()
+            settings.size = Vector2(0 if w == "auto" else w,
+                                    0 if h == "auto" else h)
+            return
+
+        # sort from highest to lowest, the widest first if same height
+        sprites.sort(key=lambda s: (s.size.y, s.size.x), reverse=True)
+
+        widest = max(s.size.x for s in sprites)
+        area = sum(s.size.x * s.size.y for s in sprites)
+        w, h = settings.size.to_tuple()
+
+        if w != "auto":
+            if widest > w:
+                raise agglomerate.algorithm.AlgorithmOutOfSpaceException(
+                        "Given width it's too small")
+            height = self._place(sprites, w, policy)
+
+        elif h == "auto":
+            # close to a square
+            w = max(widest, math.ceil(math.sqrt(area)))
+            height = self._place(sprites, w, policy)
+
+        else:
+            # given height, widen the sheet until everything fits
+            w = max(widest, math.ceil(area / h)) if h > 0 else widest
+            height = self._place(sprites, w, policy)
+            while height > h and w < widest * len(sprites):
+                w = min(math.ceil(w * 1.1), widest * len(sprites))
+                height = self._place(sprites, w, policy)
+
+        if h == "auto":
+            h = height
+        elif height > h:
+            raise agglomerate.algorithm.AlgorithmOutOfSpaceException(
+                    "Given height it's too low")
+
+        settings.size = Vector2(w, h)
+
+    def _place(self, sprites, width, policy):
+        """
+        Places the sorted sprites in shelves of the given width and returns
+        the height used
+        """
+        if policy == "first_fit":
+            shelves = _FirstFitShelves(len(sprites))
+        elif policy == "best_fit":
+            shelves = _BestFitShelves(width)
+        else:
+            shelves = _NextFitShelves()
+
+        # y and height of each shelf
+        shelf_y = []
+        # used width of each shelf
+        used = []
+        height = 0
+
+        for s in sprites:
+            shelf = shelves.find(s.size.x)
+
+            if shelf is None:
+                shelf = len(shelf_y)
+                shelf_y.append(height)
+                used.append(0)
+                height += s.size.y
+                shelves.add(shelf, width)
+
+            s.position = Vector2(used[shelf], shelf_y[shelf])
+            used[shelf] += s.size.x
+            shelves.update(shelf, width - used[shelf])
+
+        return height
+
+
+# -----------------------------------------------------------------------------
+# Shelf reuse policies
+# -----------------------------------------------------------------------------
+
+
+class _FirstFitShelves:
+    """
+    Finds the first shelf with enough free width using a max segment tree
+    over the free width of the shelves
+    """
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        # shelves not opened yet have -1 free width so they are never found
+        self.tree = [-1] * (2 * self.size)
+
+    def find(self, width):
+        if self.tree[1] < width:
+            return None
+
+        node = 1
+        while node < self.size:
+            node *= 2
+            if self.tree[node] < width:
+                node += 1
+
+        return node - self.size
+
+    def add(self, shelf, free):
+        self.update(shelf, free)
+
+    def update(self, shelf, free):
+        node = shelf + self.size
+        self.tree[node] = free
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+
+class _BestFitShelves:
+    """
+    Finds the shelf with the least free width that is enough, the first one
+    opened if several have the same free width.
+
+    The shelves are grouped by free width. A segment tree over the free
+    widths counts the shelves of each group, so the smallest free width that
+    is enough is found in O(log w). Each group keeps a heap of its shelves,
+    shelves that left the group are discarded from it when found.
+    """
+    def __init__(self, width):
+        self.size = 1
+        while self.size < width + 1:
+            self.size *= 2
+        # amount of shelves with each free width, and in each subtree
+        self.count = [0] * (2 * self.size)
+        # heaps of the shelves with each free width
+        self.groups = {}
+        self.shelf_free = {}
+
+    def find(self, width):
+        free = self._first_at_least(width)
+        if free is None:
+            return None
+
+        group = self.groups[free]
+        # the free width of a shelf only decreases, shelves with a different
+        # one left the group
+        while self.shelf_free[group[0]] != free:
+            heapq.heappop(group)
+        return group[0]
+
+    def add(self, shelf, free):
+        self.shelf_free[shelf] = free
+        heapq.heappush(self.groups.setdefault(free, []), shelf)
+        self._change_count(free, 1)
+
+    def update(self, shelf, free):
+        old = self.shelf_free[shelf]
+        if old == free:
+            return
+
+        self._change_count(old, -1)
+        self.add(shelf, free)
+
+    def _change_count(self, free, change):
+        node = free + self.size
+        while node:
+            self.count[node] += change
+            node //= 2
+
+    def _first_at_least(self, width):
+        """
+        Returns the smallest free width of a shelf that is at least the
+        given width, or None
+        """
+        if width >= self.size:
+            return None
+
+        node = width + self.size
+        if self.count[node] == 0:
+            # climb until a right sibling has shelves
+            while node > 1 and (node % 2 == 1 or self.count[node + 1] == 0):
+                node //= 2
+            if node == 1:
+                return None
+            node += 1
+
+        # the leftmost leaf of the subtree with shelves
+        while node < self.size:
+            node *= 2
+            if self.count[node] == 0:
+                node += 1
+
+        return node - self.size
+
+
+class _NextFitShelves:
+    """
+    Uses only the last shelf opened
+    """
+    def __init__(self):
+        self.shelf = None
+        self.free = 0
+
+    def find(self, width):
+        if self.shelf is not None and self.free >= width:
+            return self.shelf
+        return None
+
+    def add(self, shelf, free):
+        self.shelf = shelf
+        self.free = free
+
+    def update(self, shelf, free):
+        if shelf == self.shelf:
+            self.free = free
+
+
+algorithm_class = ShelfAlgorithm
@@ -0,0 +1,234 @@
+import io
+import os
+import posixpath
+import tarfile
+import threading
+import zipfile
+
+
+"""
+Sprites stored inside zip and tar archives.
+
+A file inside an archive is given by the path of the archive, "!/" and the
+path of the member, e.g. assets.zip!/ui/button.png. Members are read
+directly from the archive, nothing is extracted to disk.
+
+Each archive is opened once and shared by every sprite, and the list of its
+members is read once and kept as an index, so finding a member or matching
+wildcards doesn't search the archive again.
+
+Members of zip files and uncompressed tar files are read directly at their
+offset. Compressed tar files can't be read at random positions, so they
+are much slower, zip files are recommended for many sprites.
+"""
+
+
+# Separates the archive path and the member path
+SEPARATOR = "!/"
+
+# Extensions of the supported archives
+EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2",
+              ".tar.xz", ".txz")
+
+
+def split_path(path):
+    """
+    Splits the path of a file inside an archive
+
+    :param str path: path, e.g. assets.zip!/ui/button.png
+    :return: tuple (archive path, member path), or None if the path isn't
+            inside an archive
+    """
+    archive, separator, member = path.partition(SEPARATOR)
+    if not separator or not archive.lower().endswith(EXTENSIONS):
+        return None
+
+    return archive, member
+
+
+def join_path(archive, member):
+    """
+    Returns the path of a member of an archive, see split_path()
+    """
+    return archive + SEPARATOR + member
+
+
+def open_file(path):
+    """
+    Opens a file for reading in binary mode, the path can be inside an
+    archive
+
+    :param str path:
+    :return: binary file object
+    """
+    split = split_path(path)
+    if split is None:
+        return open(path, "rb")
+
+    archive, member = split
+    return get_archive(archive).open(member)
+
+
+def get_mtime(path):
+    """
+    Returns the modification time of a file, the one of the archive for
+    files inside archives
+
+    :param str path:
+    :return: seconds since the epoch
+    """
+    split = split_path(path)
+    if split is not None:
+        path = split[0]
+
+    return os.path.getmtime(path)
+
+
+# archives already opened, by real path
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(path):
+    """
+    Returns the shared Archive instance of the archive file, opening it the
+    first time
+
+    :param str path: path to the archive
+    :return: Archive instance
+    """
+    key = os.path.realpath(path)
+
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = Archive(path)
+            _archives[key] = archive
+
+    return archive
+
+
+def close_archives():
+    """
+    Closes every archive opened, they are opened again if needed
+    """
+    with _archives_lock:
+        for archive in _archives.values():
+            archive.close()
+        _archives.clear()
+
+
+class Archive:
+    """
+    An open zip or tar archive and the index of its members.
+
+    Can be used from several threads at the same time.
+
+    Has the list(), find() and is_link() methods of
+    agglomerate.util.DirectoryCache, working on the directories inside the
+    archive, so wildcards can be matched against the members.
+
+    **Fields**
+    path
+        path to the archive
+    members
+        dictionary of the zipfile.ZipInfo or tarfile.TarInfo of each file
+        by its normalized path in the archive, e.g. sprites/a.png
+    """
+    def __init__(self, path):
+        """
+        Opens the archive and reads the list of its members
+
+        :param str path: path to a zip or tar archive
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            self._tar = None
+            self.members = {self._normalize(i.filename): i
+                            for i in self._zip.infolist() if not i.is_dir()}
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path)
+            # tar files usually store paths like ./sprites/a.png
+            self.members = {self._normalize(m.name): m
+                            for m in self._tar.getmembers() if m.isfile()}
+
+        # entries of each directory, by their normalized path
+        self._directories = {}
+        for name in self.members:
+            parts = name.split("/")
+            directory = "."
+            for i, part in enumerate(parts):
+                is_dir = i < len(parts) - 1
+                self._directories.setdefault(directory, {})[part] = is_dir
+                directory = self._normalize(posixpath.join(directory, part))
+
+    def open(self, member):
+        """
+        Opens a member for reading
+
+        :param str member: path of the member in the archive
+        :return: binary file object
+        """
+        info = self.members.get(self._normalize(member))
+        if info is None:
+            raise FileNotFoundError("No member {} in {}".format(member,
+                                                                self.path))
+
+        if self._zip is not None:
+            # zip files can read several members at the same time
+            return self._zip.open(info)
+
+        # tar files are read sequentially, the member is read whole
+        with self._lock:
+            return io.BytesIO(self._tar.extractfile(info).read())
+
+    def list(self, directory):
+        """
+        Returns the entries of a directory of the archive as a list of
+        (name, is_dir) tuples sorted by name
+
+        :param str directory: path inside the archive, "." is the root
+        """
+        entries = self._directories.get(self._normalize(directory), {})
+        return sorted(entries.items())
+
+    def find(self, directory, name):
+        """
+        Looks for an entry of a directory of the archive
+
+        :param str directory: path inside the archive, "." is the root
+        :param str name: name of the entry
+        :return: True if the entry is a directory, False if it's a file, None
+                if it doesn't exist
+        """
+        return self._directories.get(self._normalize(directory), {}) \
+            .get(name)
+
+    def is_link(self, directory, name):
+        """
+        Returns False, links inside archives aren't members
+
+        :param str directory: path inside the archive, "." is the root
+        :param str name: name of the entry
+        """
+        return False
+
+    def close(self):
+        """
+        Closes the archive file
+        """
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    @staticmethod
+    def _normalize(path):
+        """
+        Returns the key of a file or directory in the index
+        """
+        return posixpath.normpath(path.replace(os.sep, "/"))
@@ -0,0 +1,417 @@
+import os
+import struct
+import tempfile
+
+import numpy
+import PIL.Image
+
+
+"""
+Sheets stored in NumPy arrays.
+
+Sprites are drawn copying their pixels into a view of the sheet array by
+slice assignment. Alpha blending with the sheet is only done when it
+changes the result, i.e. when the sprites overlap or when the sheet can't
+hold the sprite transparency (opaque background or mode without alpha).
+
+Sheets larger than the available memory can be stored in a memory mapped
+raw file, so the operating system can move them to disk. The sheet can be
+saved as raw pixels (the mapped file itself) or as an uncompressed TIFF
+written strip by strip.
+"""
+
+
+# Color modes that can be stored in arrays
+ARRAY_MODES = ("RGBA", "RGB", "LA", "L")
+
+# Color modes supported by mapped canvases
+MODES = ("RGBA", "RGB")
+
+
+def prepare(image, mode):
+    """
+    Converts a sprite image to the pixels that will be copied to a sheet.
+
+    Can be called from several threads at the same time, so the conversion
+    of many sprites can be done in bulk.
+
+    :param image: PIL image
+    :param str mode: color mode of the sheet, one of ARRAY_MODES
+    :return: tuple containing an uint8 array of shape (height, width,
+            channels) in the sheet mode, and an uint8 array of shape
+            (height, width, 1) with the image alpha, or None if the image is
+            opaque
+    """
+    alpha = None
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        if image.mode not in ("RGBA", "LA"):
+            image = image.convert("RGBA")
+        alpha = numpy.asarray(image.getchannel("A"))[:, :, None]
+        if alpha.min() == 255:
+            alpha = None
+
+    if image.mode != mode:
+        image = image.convert(mode)
+    pixels = numpy.asarray(image)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+
+    return pixels, alpha
+
+
+def rotate(prepared):
+    """
+    Rotates the result of prepare() 90 degrees clockwise, like the images of
+    rotated sprites. The arrays returned are views, nothing is copied
+
+    :param tuple prepared: result of prepare()
+    :return: tuple like the ones returned by prepare()
+    """
+    pixels, alpha = prepared
+    if alpha is not None:
+        alpha = numpy.rot90(alpha, -1)
+    return numpy.rot90(pixels, -1), alpha
+
+
+def blend(target, source, alpha):
+    """
+    Blends the source pixels over the target pixels using the alpha.
+
+    Sheets without alpha get the same results as PIL.Image.paste() with a
+    mask. In sheets with alpha (the last channel of "RGBA" and "LA" pixels)
+    the source is composited over the target like
+    PIL.Image.alpha_composite(), so semi-transparent pixels drawn on
+    transparent areas keep their alpha.
+
+    :param target: uint8 array, modified in place
+    :param source: uint8 array of the same shape
+    :param alpha: uint8 array of shape (height, width, 1)
+    """
+    if target.shape[2] not in (2, 4):
+        alpha = alpha.astype(numpy.uint16)
+        blended = source * alpha + target * (255 - alpha) + 127
+        target[:] = (blended // 255).astype(numpy.uint8)
+        return
+
+    source_alpha = alpha.astype(numpy.float32) / 255
+    target_alpha = target[:, :, -1:].astype(numpy.float32) / 255
+    # the part of the target seen through the source
+    seen = target_alpha * (1 - source_alpha)
+    out_alpha = source_alpha + seen
+
+    colors = source[:, :, :-1] * source_alpha + target[:, :, :-1] * seen
+    colors = numpy.divide(colors, out_alpha, out=numpy.zeros_like(colors),
+                          where=out_alpha > 0)
+
+    target[:, :, :-1] = numpy.rint(colors)
+    target[:, :, -1:] = numpy.rint(out_alpha * 255)
+
+
+class ArrayCanvas:
+    """
+    Sheet whose pixels are stored in a NumPy array.
+
+    Has the paste(), save() and close() methods, similar to the ones of a
+    PIL image, so the packer can use it in place of one.
+
+    **Fields**
+    size
+        (width, height) tuple
+    mode
+        color mode, one of ARRAY_MODES
+    pixels
+        uint8 array of shape (height, width, channels)
+    overlapping
+        True if the sprites drawn can overlap, so they must be blended
+        instead of copied. False by default
+    """
+    def __init__(self, size, mode, background):
+        """
+        Creates the sheet filled with the background color
+
+        :param tuple size: (width, height) of the sheet
+        :param str mode: one of ARRAY_MODES
+        :param tuple background: RGBA color tuple
+        """
+        self._init_fields(size, mode, background)
+
+        width, height = size
+        self.pixels = numpy.empty((height, width, len(mode)), numpy.uint8)
+        self.pixels[:] = self._background
+
+    def _init_fields(self, size, mode, background):
+        """
+        Sets the fields shared by every canvas type
+        """
+        if mode not in ARRAY_MODES:
+            raise ValueError("Canvases can't use color mode " + mode)
+
+        self.size = size
+        self.mode = mode
+        self.overlapping = False
+
+        # the background color converted to the sheet mode
+        color = PIL.Image.new("RGBA", (1, 1), background).convert(mode)
+        self._background = numpy.asarray(color).reshape(len(mode))
+
+        # transparent pixels of the sprites can be copied as they are, only
+        # if the sheet can store them and there is nothing to see below
+        self._transparent_background = \
+                mode.endswith("A") and background[3] == 0
+
+    def paste(self, image, box, mask=None):
+        """
+        Draws the image in the given position. If mask is given, the image is
+        blended with the sheet using the mask alpha, see draw().
+
+        :param image: PIL image
+        :param tuple box: (x, y) of the top-left corner
+        :param mask: PIL image used as mask, must be the image itself
+        """
+        self.draw(prepare(image, self.mode), box, mask is not None)
+
+    def draw(self, prepared, box, masked=True):
+        """
+        Draws the sprite pixels in the given position.
+
+        The pixels are copied unless masked is True and blending them
+        changes the result: when the sprite has transparent pixels and the
+        sprites overlap or the background can't be replaced by them.
+
+        :param tuple prepared: result of prepare()
+        :param tuple box: (x, y) of the top-left corner
+        :param bool masked: blend using the sprite alpha if needed
+        """
+        source, alpha = prepared
+        x, y = box
+        height, width = source.shape[:2]
+        target = self.pixels[y:y + height, x:x + width]
+
+        if not masked or alpha is None or \
+                (self._transparent_background and not self.overlapping):
+            target[:] = source
+        else:
+            blend(target, source, alpha)
+
+    def to_image(self):
+        """
+        Returns a PIL image sharing the pixels of the canvas if possible
+        """
+        pixels = self.pixels
+        if pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+
+        return PIL.Image.frombuffer(self.mode, self.size,
+                                    numpy.ascontiguousarray(pixels), "raw",
+                                    self.mode, 0, 1)
+
+    def save(self, path, format=None):
+        """
+        Saves the sheet using Pillow
+
+        :param str path: where to save the sheet
+        :param str format: image format, if None it's determined from the
+                path extension
+        """
+        self.to_image().save(path, format)
+
+    def close(self):
+        """
+        Frees the pixels
+        """
+        self.pixels = None
+
+
+class MappedCanvas(ArrayCanvas):
+    """
+    Sheet whose pixels are stored in a memory mapped file.
+
+    pixels is a numpy.memmap of shape (height, width, channels), only
+    "RGBA" and "RGB" modes are supported.
+    """
+    def __init__(self, size, mode, background, path=None):
+        """
+        Creates the mapped file and fills it with the background color.
+
+        :param tuple size: (width, height) of the sheet
+        :param str mode: "RGBA" or "RGB"
+        :param tuple background: RGBA color tuple
+        :param str path: file to map, if None a temporary file is used and
+                deleted when closing the canvas
+        """
+        if mode not in MODES:
+            raise ValueError("Memory mapped sheets can't use color mode " +
+                             mode)
+
+        self._init_fields(size, mode, background)
+        self._temporary = path is None
+
+        if self._temporary:
+            descriptor, path = tempfile.mkstemp(suffix=".raw")
+            os.close(descriptor)
+        self.path = path
+
+        width, height = size
+        self.pixels = numpy.memmap(path, numpy.uint8, "w+",
+                                   shape=(height, width, len(mode)))
+
+        # fill row by row to avoid touching the whole file at once
+        for y in range(height):
+            self.pixels[y] = self._background
+
+    def save(self, path, format=None):
+        """
+        Saves the sheet.
+
+        Raw and TIFF sheets are written without loading the sheet in memory,
+        other formats are given to Pillow, which reads the mapped pixels.
+
+        :param str path: where to save the sheet
+        :param str format: image format, if None it's determined from the
+                path extension
+        """
+        if format is None:
+            format = os.path.splitext(path)[1][1:]
+        format = format.lower()
+
+        self.pixels.flush()
+
+        if format == "raw":
+            if os.path.abspath(path) != os.path.abspath(self.path):
+                _copy_rows(self.pixels, path)
+        elif format in ("tiff", "tif"):
+            write_tiff(self.pixels, path, self.mode)
+        else:
+            super().save(path, format)
+
+    def close(self):
+        """
+        Unmaps the file, and deletes it if it was temporary
+        """
+        if self.pixels is None:
+            return
+
+        # the file is unmapped when the memmap is garbage collected
+        self.pixels.flush()
+        self.pixels = None
+
+        if self._temporary:
+            os.remove(self.path)
+
+
+def _copy_rows(pixels, path, rows_per_copy=256):
+    """
+    Writes the pixels to a file a few rows at a time
+    """
+    with open(path, "wb") as f:
+        for y in range(0, len(pixels), rows_per_copy):
+            f.write(pixels[y:y + rows_per_copy].tobytes())
+
+
+# -----------------------------------------------------------------------------
+# TIFF output
+# -----------------------------------------------------------------------------
+
+
+# TIFF field types
+_SHORT = 3
+_LONG = 4
+_LONG8 = 16
+
+
+def write_tiff(pixels, path, mode, rows_per_strip=64):
+    """
+    Writes an uncompressed TIFF file strip by strip, so the pixels are never
+    loaded in memory at once.
+
+    BigTIFF is used when the file would be larger than 4 GiB.
+
+    :param pixels: uint8 array of shape (height, width, channels), usually a
+            memory map
+    :param str path: where to save the file
+    :param str mode: "RGBA" or "RGB"
+    :param int rows_per_strip: amount of rows in each strip
+    """
+    height, width, channels = pixels.shape
+    strips = range(0, height, rows_per_strip)
+    big = pixels.nbytes + 4096 + 16 * len(strips) >= 2 ** 32
+
+    offset_type = _LONG8 if big else _LONG
+    entries = [
+        (256, _LONG, [width]),
+        (257, _LONG, [height]),
+        (258, _SHORT, [8] * channels),
+        (259, _SHORT, [1]),
+        (262, _SHORT, [2]),
+        (273, offset_type, []),
+        (277, _SHORT, [channels]),
+        (278, _LONG, [rows_per_strip]),
+        (279, offset_type, []),
+        (284, _SHORT, [1]),
+    ]
+    if mode == "RGBA":
+        # unassociated alpha
+        entries.append((338, _SHORT, [2]))
+
+    with open(path, "wb") as f:
+        # header, the IFD offset is written at the end
+        if big:
+            f.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+        else:
+            f.write(b"II" + struct.pack("<HI", 42, 0))
+
+        offsets = []
+        byte_counts = []
+        for y in strips:
+            strip = pixels[y:y + rows_per_strip].tobytes()
+            offsets.append(f.tell())
+            byte_counts.append(len(strip))
+            f.write(strip)
+
+        entries[5] = (273, offset_type, offsets)
+        entries[8] = (279, offset_type, byte_counts)
+
+        ifd_offset = _write_ifd(f, entries, big)
+
+        f.seek(8 if big else 4)
+        f.write(struct.pack("<Q" if big else "<I", ifd_offset))
+
+
+def _write_ifd(f, entries, big):
+    """
+    Writes the values that don't fit in the IFD entries and then the IFD,
+    returns the IFD offset
+    """
+    type_formats = {_SHORT: "H", _LONG: "I", _LONG8: "Q"}
+    inline_size = 8 if big else 4
+
+    packed_entries = []
+    for tag, field_type, values in entries:
+        data = struct.pack("<" + type_formats[field_type] * len(values),
+                           *values)
+        if len(data) <= inline_size:
+            value = data.ljust(inline_size, b"\0")
+        else:
+            # word aligned offset to the values
+            if f.tell() % 2:
+                f.write(b"\0")
+            value = struct.pack("<Q" if big else "<I", f.tell())
+            f.write(data)
+        packed_entries.append((tag, field_type, len(values), value))
+
+    if f.tell() % 2:
+        f.write(b"\0")
+    ifd_offset = f.tell()
+
+    if big:
+        f.write(struct.pack("<Q", len(packed_entries)))
+        for tag, field_type, count, value in packed_entries:
+            f.write(struct.pack("<HHQ", tag, field_type, count) + value)
+        f.write(struct.pack("<Q", 0))
+    else:
+        f.write(struct.pack("<H", len(packed_entries)))
+        for tag, field_type, count, value in packed_entries:
+            f.write(struct.pack("<HHI", tag, field_type, count) + value)
+        f.write(struct.pack("<I", 0))
+
+    return ifd_offset
@@ -0,0 +1,307 @@
+import concurrent.futures
+import os
+import struct
+
+import numpy
+
+
+"""
+Block compressed texture output.
+
+Encodes sheets to BC1 (DXT1) and BC3 (DXT5) and saves them inside a DDS file,
+so they can be uploaded to the GPU without decompressing and compressing them
+again at runtime.
+
+The encoder works on every 4x4 block at the same time using NumPy, the sheet
+is split in bands of blocks that are encoded in parallel.
+"""
+
+
+# Side of the blocks used by the block compression formats
+BLOCK_SIZE = 4
+
+# Supported formats, the values are the FourCC code of the DDS file and the
+# amount of bytes of each compressed block
+BLOCK_FORMATS = {
+    "bc1": (b"DXT1", 8),
+    "bc3": (b"DXT5", 16),
+}
+
+# Suggested extension for block compressed sheets
+suggested_extension = "dds"
+
+
+def is_block_format(name):
+    """
+    Returns True if the given output sheet format is a block compressed format
+
+    :param str name: output sheet format name, can be None
+    """
+    return name is not None and name.lower() in BLOCK_FORMATS
+
+
+def align(value):
+    """
+    Returns the value rounded up to the next multiple of the block size
+    """
+    return -(-value // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def save_dds(image, path, name):
+    """
+    Compresses the image and saves it as a DDS file.
+
+    :param image: PIL image, is converted to RGBA if necessary
+    :param str path: where to save the file
+    :param str name: block format name, e.g. "bc1"
+    """
+    with open(path, "wb") as f:
+        f.write(encode_dds(image, name))
+
+
+def encode_dds(image, name):
+    """
+    Compresses the image and returns the contents of a DDS file.
+
+    :param image: PIL image, is converted to RGBA if necessary
+    :param str name: block format name, e.g. "bc1"
+    :return: bytes of the DDS file
+    """
+    fourcc, __ = BLOCK_FORMATS[name.lower()]
+    pixels = numpy.asarray(image.convert("RGBA"))
+    height, width = pixels.shape[:2]
+
+    data = encode(pixels, name)
+
+    return _dds_header(width, height, fourcc, len(data)) + data
+
+
+def encode(pixels, name):
+    """
+    Compresses an RGBA array to the given block format.
+
+    The array is padded with transparent pixels if its dimensions are not
+    multiples of 4. Bands of blocks are encoded in parallel.
+
+    :param pixels: uint8 array with shape (height, width, 4)
+    :param str name: block format name, e.g. "bc1"
+    :return: bytes of the compressed blocks, in row-major order
+    """
+    name = name.lower()
+    height, width = pixels.shape[:2]
+    padded_height, padded_width = align(height), align(width)
+
+    if (padded_height, padded_width) != (height, width):
+        padded = numpy.zeros((padded_height, padded_width, 4), numpy.uint8)
+        padded[:height, :width] = pixels
+        pixels = padded
+
+    # split the image in rows of blocks, and divide the rows between workers
+    block_rows = padded_height // BLOCK_SIZE
+    workers = min(os.cpu_count() or 1, block_rows) or 1
+    bounds = numpy.linspace(0, block_rows, workers + 1).astype(int)
+
+    def encode_band(start, stop):
+        band = pixels[start * BLOCK_SIZE:stop * BLOCK_SIZE]
+        return _encode_blocks(_split_blocks(band), name)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        bands = executor.map(encode_band, bounds[:-1], bounds[1:])
+        return b"".join(bands)
+
+
+# -----------------------------------------------------------------------------
+# Block encoding
+# -----------------------------------------------------------------------------
+
+
+def _split_blocks(pixels):
+    """
+    Returns an array of shape (blocks, 16, 4) from an RGBA array whose
+    dimensions are multiples of 4, blocks are in row-major order
+    """
+    height, width = pixels.shape[:2]
+    blocks = pixels.reshape(height // BLOCK_SIZE, BLOCK_SIZE,
+                            width // BLOCK_SIZE, BLOCK_SIZE, 4)
+    return blocks.transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+
+
+def _encode_blocks(blocks, name):
+    """
+    Encodes an array of shape (blocks, 16, 4) and returns the bytes
+    """
+    if name == "bc1":
+        # pixels with alpha lower than 128 are transparent in BC1
+        transparent = blocks[:, :, 3] < 128
+        color = _encode_color(blocks[:, :, :3], transparent)
+        return color.tobytes()
+
+    # fully transparent pixels are invisible whatever their color, they are
+    # left out of the endpoints fit but the 4 color mode is still used
+    color = _encode_color(blocks[:, :, :3], None, blocks[:, :, 3] == 0)
+    alpha = _encode_alpha(blocks[:, :, 3])
+    return numpy.concatenate([alpha, color], axis=1).tobytes()
+
+
+def _encode_color(colors, transparent, ignored=None):
+    """
+    Encodes the color part of the blocks.
+
+    Endpoints are chosen along the principal axis of each block colors. If
+    transparent is given, blocks containing transparent pixels are encoded
+    in the 3 color mode, where index 3 means transparent black.
+
+    :param colors: uint8 array of shape (blocks, 16, 3)
+    :param transparent: bool array of shape (blocks, 16) or None
+    :param ignored: bool array of shape (blocks, 16) of the pixels whose
+            color doesn't matter, left out when choosing the endpoints, or
+            None
+    :return: uint8 array of shape (blocks, 8)
+    """
+    colors = colors.astype(numpy.float32)
+    count = colors.shape[0]
+
+    if transparent is None:
+        transparent = numpy.zeros(colors.shape[:2], bool)
+    has_transparency = transparent.any(axis=1)
+
+    # transparent and ignored pixels shouldn't affect the chosen endpoints,
+    # replace them with the block mean of the other pixels
+    excluded = transparent if ignored is None else transparent | ignored
+    weights = (~excluded)[:, :, None].astype(numpy.float32)
+    opaque_count = numpy.maximum(weights.sum(axis=1), 1)
+    mean = (colors * weights).sum(axis=1) / opaque_count
+    colors_fit = numpy.where(excluded[:, :, None], mean[:, None], colors)
+
+    # principal axis by power iteration over the covariance matrices
+    centered = colors_fit - mean[:, None]
+    covariance = numpy.einsum("bij,bik->bjk", centered, centered)
+    axis = numpy.ones((count, 3), numpy.float32)
+    for __ in range(8):
+        axis = numpy.einsum("bjk,bk->bj", covariance, axis)
+        norm = numpy.linalg.norm(axis, axis=1, keepdims=True)
+        axis = numpy.where(norm > 0, axis / numpy.maximum(norm, 1e-12), 0)
+
+    projection = numpy.einsum("bij,bj->bi", centered, axis)
+    low = mean + projection.min(axis=1)[:, None] * axis
+    high = mean + projection.max(axis=1)[:, None] * axis
+
+    endpoint0 = _to_565(high)
+    endpoint1 = _to_565(low)
+
+    # 4 color mode needs endpoint0 > endpoint1, 3 color mode the opposite
+    swap = numpy.where(has_transparency,
+                       endpoint0 > endpoint1, endpoint0 < endpoint1)
+    endpoint0, endpoint1 = (numpy.where(swap, endpoint1, endpoint0),
+                            numpy.where(swap, endpoint0, endpoint1))
+
+    # build the palette of each block as the decoder will do
+    c0 = _from_565(endpoint0)
+    c1 = _from_565(endpoint1)
+    palette = numpy.empty((count, 4, 3), numpy.float32)
+    palette[:, 0] = c0
+    palette[:, 1] = c1
+    palette[:, 2] = numpy.where(has_transparency[:, None],
+                                (c0 + c1) / 2, (2 * c0 + c1) / 3)
+    palette[:, 3] = numpy.where(has_transparency[:, None],
+                                numpy.inf, (c0 + 2 * c1) / 3)
+
+    distances = ((colors[:, :, None] - palette[:, None]) ** 2).sum(axis=3)
+    indices = distances.argmin(axis=2)
+    indices = numpy.where(transparent, 3, indices)
+
+    # blocks with a single color in 4 color mode must use index 0 only,
+    # otherwise the decoder would use the 3 color mode
+    indices = numpy.where((endpoint0 == endpoint1)[:, None] &
+                          ~has_transparency[:, None], 0, indices)
+
+    packed = numpy.zeros(count, numpy.uint32)
+    for i in range(16):
+        packed |= indices[:, i].astype(numpy.uint32) << numpy.uint32(2 * i)
+
+    result = numpy.empty((count, 8), numpy.uint8)
+    result[:, 0:2] = endpoint0.astype("<u2").view(numpy.uint8) \
+        .reshape(count, 2)
+    result[:, 2:4] = endpoint1.astype("<u2").view(numpy.uint8) \
+        .reshape(count, 2)
+    result[:, 4:8] = packed.astype("<u4").view(numpy.uint8).reshape(count, 4)
+    return result
+
+
+def _encode_alpha(alpha):
+    """
+    Encodes the alpha part of BC3 blocks using the 8 alpha values mode.
+
+    :param alpha: uint8 array of shape (blocks, 16)
+    :return: uint8 array of shape (blocks, 8)
+    """
+    count = alpha.shape[0]
+    alpha0 = alpha.max(axis=1).astype(numpy.int32)
+    alpha1 = alpha.min(axis=1).astype(numpy.int32)
+
+    # palette of the 8 values mode, index 0 is alpha0 and index 1 is alpha1
+    weights0 = numpy.array([7, 0, 6, 5, 4, 3, 2, 1], numpy.float32)
+    palette = (weights0 * alpha0[:, None] +
+               (7 - weights0) * alpha1[:, None]) / 7
+
+    distances = numpy.abs(alpha[:, :, None].astype(numpy.float32) -
+                          palette[:, None])
+    indices = distances.argmin(axis=2).astype(numpy.uint64)
+    indices = numpy.where((alpha0 == alpha1)[:, None], 0, indices)
+
+    packed = numpy.zeros(count, numpy.uint64)
+    for i in range(16):
+        packed |= indices[:, i] << numpy.uint64(3 * i)
+
+    result = numpy.empty((count, 8), numpy.uint8)
+    result[:, 0] = alpha0
+    result[:, 1] = alpha1
+    result[:, 2:8] = packed.astype("<u8").view(numpy.uint8) \
+        .reshape(count, 8)[:, :6]
+    return result
+
+
+def _to_565(colors):
+    """
+    Converts a float array of shape (n, 3) to packed RGB565 values
+    """
+    colors = numpy.clip(numpy.rint(colors), 0, 255)
+    r = numpy.rint(colors[:, 0] * 31 / 255).astype(numpy.uint16)
+    g = numpy.rint(colors[:, 1] * 63 / 255).astype(numpy.uint16)
+    b = numpy.rint(colors[:, 2] * 31 / 255).astype(numpy.uint16)
+    return (r << 11) | (g << 5) | b
+
+
+def _from_565(values):
+    """
+    Converts packed RGB565 values to a float array of shape (n, 3)
+    """
+    r = (values >> 11) & 31
+    g = (values >> 5) & 63
+    b = values & 31
+    return numpy.stack([r * 255 / 31, g * 255 / 63, b * 255 / 31],
+                       axis=1).astype(numpy.float32)
+
+
+# -----------------------------------------------------------------------------
+# DDS file
+# -----------------------------------------------------------------------------
+
+
+def _dds_header(width, height, fourcc, linear_size):
+    """
+    Returns the magic number and header of a DDS file with a single
+    compressed surface
+    """
+    # DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT |
+    # DDSD_LINEARSIZE
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000
+    # DDPF_FOURCC
+    pixel_format = struct.pack("<II4s5I", 32, 0x4, fourcc, 0, 0, 0, 0, 0)
+    # DDSCAPS_TEXTURE
+    caps = struct.pack("<5I", 0x1000, 0, 0, 0, 0)
+
+    header = struct.pack("<7I", 124, flags, height, width, linear_size, 0, 0)
+    header += b"\0" * 44 + pixel_format + caps
+
+    return b"DDS " + header
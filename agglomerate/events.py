@@ -0,0 +1,139 @@
+import contextlib
+import time
+
+
+"""
+Progress events and cancellation of packs.
+
+An Observer given to agglomerate.packer.pack() receives an Event each time
+something happens: a phase starts or finishes, sprites are placed by the
+algorithms, decoded or drawn, or bytes are written. Events can come from
+several threads at the same time.
+
+A pack can be cancelled by calling Observer.cancel() from any thread, the
+packer stops at the next event raising PackCancelledException.
+"""
+
+
+# Event types
+PHASE_STARTED = "phase_started"
+PHASE_FINISHED = "phase_finished"
+SPRITES_PLACED = "sprites_placed"
+SPRITES_LOADED = "sprites_loaded"
+SPRITES_DRAWN = "sprites_drawn"
+BYTES_ENCODED = "bytes_encoded"
+
+# Phases
+PACKING = "packing"
+DRAWING = "drawing"
+ENCODING = "encoding"
+COORDINATES = "coordinates"
+
+
+class Event:
+    """
+    Something that happened while packing
+
+    **Fields**
+    type
+        one of the event types, e.g. PHASE_STARTED
+    phase
+        phase where the event happened, e.g. PACKING
+    count
+        amount of sprites placed, decoded or drawn, or amount of bytes
+        written, depending on the type. 0 for phase events
+    target
+        path of the file being generated, None while packing
+    elapsed
+        seconds spent in the phase, only for PHASE_FINISHED events
+    time
+        time.monotonic() when the event happened
+    """
+    def __init__(self, type, phase, count=0, target=None, elapsed=None):
+        self.type = type
+        self.phase = phase
+        self.count = count
+        self.target = target
+        self.elapsed = elapsed
+        self.time = time.monotonic()
+
+    def __repr__(self):
+        return "Event({}, {}, {}, {})".format(self.type, self.phase,
+                                              self.count, self.target)
+
+
+class Observer:
+    """
+    Base class for objects that follow the progress of a pack.
+
+    Subclasses override notify(), which must be thread safe and fast since
+    it's called while packing.
+    """
+    def notify(self, event):
+        """
+        Called for each event, does nothing by default
+
+        :param event: Event instance
+        """
+
+    def cancel(self):
+        """
+        Asks the packer to stop, can be called from any thread
+        """
+        self._cancel_requested = True
+
+    @property
+    def cancelled(self):
+        """
+        True if cancel() was called
+        """
+        return getattr(self, "_cancel_requested", False)
+
+
+class PackCancelledException(Exception):
+    """
+    Raised by the packer when the observer was cancelled
+    """
+    def __init__(self):
+        super().__init__("The pack was cancelled")
+
+
+def notify(observer, type, phase, count=0, target=None, elapsed=None):
+    """
+    Gives an event to the observer and raises PackCancelledException if it
+    was cancelled. Does nothing if the observer is None
+
+    :param observer: Observer instance or None
+    """
+    if observer is None:
+        return
+
+    observer.notify(Event(type, phase, count, target, elapsed))
+    check_cancelled(observer)
+
+
+def check_cancelled(observer):
+    """
+    Raises PackCancelledException if the observer was cancelled
+
+    :param observer: Observer instance or None
+    """
+    if observer is not None and observer.cancelled:
+        raise PackCancelledException()
+
+
+@contextlib.contextmanager
+def phase(observer, name, target=None):
+    """
+    Context manager that notifies the start and the end of a phase, the end
+    is notified only if the phase finished without errors
+
+    :param observer: Observer instance or None
+    :param str name: phase name
+    :param str target: path of the file being generated
+    """
+    start = time.monotonic()
+    notify(observer, PHASE_STARTED, name, target=target)
+    yield
+    notify(observer, PHASE_FINISHED, name, target=target,
+           elapsed=time.monotonic() - start)
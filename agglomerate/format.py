@@ -1,3 +1,5 @@
+import agglomerate.algorithm
+
 import abc
 import importlib
 
@@ -12,10 +14,13 @@ class Format:
     **Supports dictionary**
     - rotation: whether the format supports rotation of sprites
     - cropping: True if the format supports sprite cropping
+    - masks: True if the format writes the mask of each sprite, needed by
+      algorithms that pack sprites by their masks
     """
     supports = {
                 "rotation": False,
                 "cropping": False,
+                "masks": False,
                }
     suggested_extension = "txt"
 
@@ -29,6 +34,22 @@ class Format:
         :return: string to be saved to a file
         """
 
+    def parse(self, string):
+        """
+        Reads the sprites placement from a string created by generate(), so
+        sheets can be updated or repacked, see agglomerate.update and
+        agglomerate.regions.
+
+        Optional, formats that can't be read raise NotImplementedError
+
+        :param str string: coordinates file contents
+        :return: list with a dictionary for each sprite, containing its
+                "name", "x", "y", "w" and "h" in the sheet (rotated if the
+                sprite was rotated), if it was "rotated" and its "mask" if
+                any, see Sprite.mask
+        """
+        raise NotImplementedError("The format can't be read")
+
 
 # -----------------------------------------------------------------------------
 # Registration of formats
@@ -68,9 +89,12 @@ class IncompatibilityReason:
 
     - ROTATION_REQUIRED: settings allow rotation of sprites but format does
       not define rotated sprites
+    - MASKS_REQUIRED: the algorithm packs sprites by their masks but the
+      format doesn't write them
     """
     (ROTATION_ALLOWED,
-    CROPPING_ALLOWED) = range(2)
+    CROPPING_ALLOWED,
+    MASKS_REQUIRED) = range(3)
 
 
 class WarningReason:
@@ -104,4 +128,12 @@ def check_compatibility(format, settings):
         compatible = False
         incompatibilities.append(IncompatibilityReason.CROPPING_ALLOWED)
 
+    # the rectangles of sprites packed by masks can overlap
+    if settings.algorithm is not None and \
+            not format.supports.get("masks", False) and \
+            agglomerate.algorithm.get_algorithm(settings.algorithm) \
+            .supports.get("masks", False):
+        compatible = False
+        incompatibilities.append(IncompatibilityReason.MASKS_REQUIRED)
+
     return (compatible, incompatibilities, warnings)
@@ -9,6 +9,7 @@ class SimpleJSON(agglomerate.Format):
     supports = {
                 "rotation": True,
                 "cropping": False,
+                "masks": True,
                }
     suggested_extension = "json"
 
@@ -26,10 +27,23 @@ class SimpleJSON(agglomerate.Format):
                 "h": s.size.y,
                 "rotated": s.rotated
             }
+            # rectangles covering the visible pixels, if packed by masks
+            if s.mask is not None:
+                sprite_object["mask"] = [list(r) for r in s.mask]
             sprite_array.append(sprite_object)
 
         # Dump the array into a json string, indented by 4 spaces
         return json.dumps(sprite_array, indent=4)
 
+    def parse(self, string):
+        return [{"name": o["name"],
+                 "x": o["x"],
+                 "y": o["y"],
+                 "w": o["w"],
+                 "h": o["h"],
+                 "rotated": o.get("rotated", False),
+                 "mask": o.get("mask")}
+                for o in json.loads(string)]
+
 
 format_class = SimpleJSON
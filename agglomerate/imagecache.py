@@ -0,0 +1,153 @@
+import collections
+import contextlib
+import threading
+
+
+"""
+Bounded memory for decoded sprite images.
+
+Normally each sprite keeps its image once decoded. While a memory budget is
+active for a set of sprites (see budget()), their decoded images are kept
+in a cache instead, and the least recently used ones are discarded when the
+budget is exceeded. A discarded image is decoded again from its file the
+next time it's used.
+
+Each budget has its own cache, given to the sprites it covers, so several
+packs can run at the same time in different threads, each one with its own
+budget.
+
+The amount of files open at the same time while decoding is also limited,
+so many threads decoding sprites don't run out of file handles.
+"""
+
+
+# protects the caches of the sprites while budgets start and finish
+_sprites_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def budget(max_bytes, sprites, max_open_files=64):
+    """
+    Context manager that limits the memory used by the decoded images of
+    the given sprites while inside it. Does nothing if max_bytes is None.
+
+    A sprite can only be in one budget at a time, so the same sprites can't
+    be packed with a budget by several threads at the same time.
+
+    :param int max_bytes: maximum size in bytes of the decoded images kept
+    :param list sprites: agglomerate.items.Sprite instances whose images are
+            limited
+    :param int max_open_files: maximum amount of image files open at the
+            same time
+    :return: the ImageCache, or None if max_bytes is None
+    """
+    if max_bytes is None:
+        yield None
+        return
+
+    cache = ImageCache(max_bytes, max_open_files)
+    sprites = list(sprites)
+
+    with _sprites_lock:
+        if any(s.image_cache not in (None, cache) for s in sprites):
+            raise RuntimeError("A memory budget is already active for the "
+                               "sprites")
+        for s in sprites:
+            s.image_cache = cache
+
+    try:
+        yield cache
+    finally:
+        with _sprites_lock:
+            for s in sprites:
+                s.image_cache = None
+
+
+class ImageCache:
+    """
+    Least recently used cache of decoded sprite images, with a size limit
+    in bytes.
+
+    The most recently used image is always kept, even if it's larger than
+    the limit. Images being used by someone else when discarded stay in
+    memory until they aren't used anymore.
+
+    **Fields**
+    max_bytes
+        maximum size of the images kept
+    size
+        size of the images kept
+    """
+    def __init__(self, max_bytes, max_open_files=64):
+        """
+        Creates an empty cache
+
+        :param int max_bytes: maximum size in bytes of the images kept
+        :param int max_open_files: maximum amount of files open at the same
+                time while decoding
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # (image, size) tuples by sprite, from least to most recently used
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._files = threading.BoundedSemaphore(max_open_files)
+
+        # locks used while decoding, chosen by the sprite id, so each image
+        # is decoded once even if several threads want it
+        self._decoding_locks = [threading.Lock() for __ in range(64)]
+
+    def get(self, sprite):
+        """
+        Returns the decoded image of the sprite, decoding it if it isn't in
+        the cache
+
+        :param sprite: agglomerate.items.Sprite instance
+        :return: PIL image
+        """
+        image = self._find(sprite)
+        if image is not None:
+            return image
+
+        lock = self._decoding_locks[id(sprite) % len(self._decoding_locks)]
+        with lock:
+            # another thread could have decoded it while waiting
+            image = self._find(sprite)
+            if image is not None:
+                return image
+
+            with self._files:
+                image = sprite.load_image()
+
+            self._add(sprite, image)
+
+        return image
+
+    def _find(self, sprite):
+        """
+        Returns the image of the sprite if it's cached, marking it as the most
+        recently used, or None
+        """
+        with self._lock:
+            entry = self._images.get(sprite)
+            if entry is None:
+                return None
+
+            self._images.move_to_end(sprite)
+            return entry[0]
+
+    def _add(self, sprite, image):
+        """
+        Adds an image and discards the least recently used ones until the
+        images fit in the limit
+        """
+        size = image.width * image.height * len(image.getbands())
+
+        with self._lock:
+            self._images[sprite] = (image, size)
+            self.size += size
+
+            while self.size > self.max_bytes and len(self._images) > 1:
+                __, (__, discarded) = self._images.popitem(last=False)
+                self.size -= discarded
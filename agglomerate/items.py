@@ -1,5 +1,9 @@
 import PIL.Image
+import io
 import os
+import threading
+import agglomerate.archives
+import agglomerate.canvas
 import agglomerate.math
 
 class Item:
@@ -37,15 +41,33 @@ class Item:
 
 
 
+# locks used while decoding the sprites images, chosen by the sprite id
+_image_locks = [threading.Lock() for __ in range(64)]
+
+
 class Sprite(Item):
     """
     Item that contains a Pillow image and it's metadata.
 
     Sprites can be cropped analysing first the images.
 
+    Only the image header is read when creating the sprite, the image is
+    opened again the first time it's used, so many sprites can be created
+    without keeping their files open. While a memory budget is active the
+    decoded image can be discarded and decoded again when needed, see
+    agglomerate.imagecache.
+
     **Fields**
     image
-        PIL image
+        PIL image, opened and decoded when first used
+    path
+        path to the image file, None if the sprite was created from memory
+    data
+        contents of the image file if the sprite was created with
+        from_bytes(), None otherwise
+    image_cache
+        agglomerate.imagecache.ImageCache keeping the image while a memory
+        budget is active for the sprite, None otherwise
     name
         name string to be used when creating the coordinates file
 
@@ -71,23 +93,85 @@ class Sprite(Item):
         Amount of pixels cropped in the right
     crop_b
         Amount of pixels cropped in the bottom
+
+    mask
+        list of (x, y, width, height) rectangles relative to the position
+        covering the visible pixels, set by algorithms that pack sprites by
+        their masks, None otherwise
     """
 
     def __init__(self, path):
         """
         Opens the image in the specified file and processes it
 
-        :param str path: path to image file
+        :param str path: path to image file, can be inside an archive, see
+                agglomerate.archives
         """
-        self.image = PIL.Image.open(path)
-        self.name = self.get_name_from_path(path)
+        # read only the header to know the size
+        with agglomerate.archives.open_file(path) as f, \
+                PIL.Image.open(f) as image:
+            size = image.size
+
+        self._init_fields(path, self.get_name_from_path(path), size)
+
+    @classmethod
+    def from_image(cls, image, name):
+        """
+        Creates a sprite from an image in memory. The sprite keeps the image,
+        it's never discarded by memory budgets
+
+        :param image: PIL image
+        :param str name: name to be used when creating the coordinates file
+        :return: Sprite instance
+        """
+        sprite = cls.__new__(cls)
+        sprite._init_fields(None, name, image.size)
+        sprite._image = image
+
+        return sprite
+
+    @classmethod
+    def from_bytes(cls, data, name):
+        """
+        Creates a sprite from the contents of an image file in memory, e.g.
+        an upload. The image is decoded when first used, like the images of
+        sprites created from files
+
+        :param bytes data: contents of an image file in any format supported
+                by Pillow
+        :param str name: name to be used when creating the coordinates file
+        :return: Sprite instance
+        """
+        with PIL.Image.open(io.BytesIO(data)) as image:
+            size = image.size
+
+        sprite = cls.__new__(cls)
+        sprite._init_fields(None, name, size)
+        sprite.data = data
+
+        return sprite
+
+    def _init_fields(self, path, name, size):
+        """
+        Sets the fields of a new sprite
+
+        :param str path: path to the image file, None if the sprite wasn't
+                created from a file
+        :param str name:
+        :param tuple size: (width, height) of the image
+        """
+        self.path = path
+        self.data = None
+        self._image = None
+        self.image_cache = None
+        self.name = name
 
         self.rotated = False
         self.cropped = False
 
         self.position = None
 
-        self.size = agglomerate.math.Vector2.from_tuple(self.image.size)
+        self.size = agglomerate.math.Vector2.from_tuple(size)
         self.original_size = self.size
 
         self.crop_l = 0
@@ -95,8 +179,56 @@ class Sprite(Item):
         self.crop_r = 0
         self.crop_d = 0
 
+        self.mask = None
+
         self.type = "sprite"
 
+    @property
+    def image(self):
+        # while a memory budget is active the images are kept in a cache
+        # that can discard them, see agglomerate.imagecache
+        cache = self.image_cache
+        if self._image is None and cache is not None:
+            return cache.get(self)
+
+        # the image is decoded once even if several threads use it at the
+        # same time, e.g. to draw several scale variants
+        if self._image is None:
+            with _image_locks[id(self) % len(_image_locks)]:
+                if self._image is None:
+                    self._image = self.load_image()
+        return self._image
+
+    @image.setter
+    def image(self, value):
+        self._image = value
+
+    def load_image(self):
+        """
+        Opens and decodes the image file (or the image file contents in
+        memory), the file is closed after decoding
+
+        :return: PIL image
+        """
+        if self.data is not None:
+            f = io.BytesIO(self.data)
+        else:
+            f = agglomerate.archives.open_file(self.path)
+
+        with f:
+            image = PIL.Image.open(f)
+            image.load()
+        return image
+
+    def prepare(self, mode):
+        """
+        Returns the pixels of the image, not rotated, to be copied to a sheet
+        stored in an array, see agglomerate.canvas.prepare()
+
+        :param str mode: color mode of the sheet
+        """
+        return agglomerate.canvas.prepare(self.image, mode)
+
     def get_name_from_path(self, path):
         """
         Generates a name from the file name
@@ -110,11 +242,40 @@ class Sprite(Item):
         return os.path.basename(path)
 
 
+class PlacedSprite:
+    """
+    A sprite placed absolutely in the sheet, an entry of the table returned
+    by agglomerate.packer.flatten().
+
+    The sprite isn't modified when flattening, so the tree can be packed
+    again. Every field other than position is read from the sprite, so
+    placed sprites can be given to formats in place of sprites.
+
+    **Fields**
+    sprite
+        the Sprite instance
+    position
+        Vector2 position in the sheet in pixels, top-left corner regardless
+        of rotation
+    """
+    __slots__ = ("sprite", "position")
+
+    def __init__(self, sprite, position):
+        self.sprite = sprite
+        self.position = position
+
+    def __getattr__(self, name):
+        return getattr(self.sprite, name)
+
+
 class Group(Item):
     """
     Has a list of items, a settings instance, and the inherited attributes
     from Item.
 
+    The items can also be given as an iterable, e.g. a generator, which the
+    packer reads into a list when packing starts.
+
     Having a settings instance results in a duplicate size property:
     settings.size and the size property inherited from Item. Both point to the
     same Vector2 instance.
@@ -0,0 +1,177 @@
+import agglomerate.algorithm
+import agglomerate.settings
+from agglomerate.math import Vector2
+
+import collections
+import hashlib
+import json
+import os
+
+
+class LayoutCache:
+    """
+    Remembers the layouts calculated by the algorithms, so packing again
+    items with the same sizes doesn't need to run the algorithm.
+
+    The layout an algorithm gives depends only on the items sizes, their
+    order and the settings, so those are used as the key. The pixels of the
+    sprites can change without invalidating the cached layouts.
+
+    Groups are cached by subtree, so when a sprite changes only the groups
+    containing it are packed again, other groups are restored as they were.
+
+    The cache can be saved to a JSON file and loaded again in later runs.
+
+    **Fields**
+    path
+        file where the cache is saved, None if the cache is only kept in
+        memory
+    max_entries
+        amount of layouts to keep, the least recently used layouts are
+        discarded first
+    """
+    def __init__(self, path=None, max_entries=4096):
+        """
+        Creates a cache, loading the layouts saved in the given file if it
+        exists
+
+        :param str path: JSON file where the cache is saved, optional
+        :param int max_entries: amount of layouts to keep
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._layouts = collections.OrderedDict()
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self._layouts.update(json.load(f))
+
+    @staticmethod
+    def get_key(items, settings, keys=None):
+        """
+        Returns the key of the layout of the given items, must be called
+        before running the algorithm because it can modify the settings.
+
+        :param list items: items in the order given to the algorithm
+        :param settings: Settings or SheetSettings instance
+        :param dict keys: keys of the child groups by id(), if given they
+                are used in place of the groups sizes, see get_tree_keys()
+        :return: key string
+        """
+        data = {
+            # only the settings used by the algorithms, not the output ones
+            "settings": agglomerate.settings.Settings.to_dict(settings),
+            "items": [keys[id(i)] if keys is not None and i.type == "group"
+                      else (i.type, i.size.x, i.size.y, i.rotated)
+                      for i in items],
+        }
+        string = json.dumps(data, sort_keys=True)
+
+        return hashlib.sha256(string.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_tree_keys(cls, group):
+        """
+        Returns the keys of the group and every child group, must be called
+        before packing the group.
+
+        The key of a group depends on its settings, the sizes of its sprites
+        and the keys of its child groups, so it changes only if something
+        changed in the subtree. A group whose key is cached can be restored
+        with all its child groups without running any algorithm.
+
+        :param group: Group or Parameters instance
+        :return: dictionary of keys by id() of each group, None for groups
+                that can't be cached
+        """
+        keys = {}
+
+        # groups in depth-first order, reversed so the children are before
+        # their parents
+        groups = []
+        pending = [group]
+        while pending:
+            g = pending.pop()
+            groups.append(g)
+            pending.extend(i for i in g.items if i.type == "group")
+
+        for g in reversed(groups):
+            # layouts of algorithms that look at the pixels of the sprites
+            # can't be cached, nor the ones of the groups containing them
+            if agglomerate.algorithm.get_algorithm(g.settings.algorithm) \
+                    .supports.get("masks", False) or \
+                    any(keys[id(i)] is None
+                        for i in g.items if i.type == "group"):
+                keys[id(g)] = None
+            else:
+                keys[id(g)] = cls.get_key(g.items, g.settings, keys)
+
+        return keys
+
+    def restore(self, key, items, settings):
+        """
+        Applies a cached layout to the items and settings, like the algorithm
+        would do.
+
+        :param str key: key from get_key()
+        :param list items: items to place, reordered in place if the
+                algorithm had reordered them
+        :param settings: Settings instance where the size is set
+        :return: True if the layout was cached, False otherwise
+        """
+        layout = self._layouts.get(key)
+        if layout is None:
+            return False
+
+        self._layouts.move_to_end(key)
+
+        original = list(items)
+        items[:] = [original[i] for i in layout["order"]]
+
+        for i, position, size, rotated in zip(
+                items, layout["positions"], layout["sizes"],
+                layout["rotated"]):
+            i.position = Vector2(*position)
+            i.rotated = rotated
+            if i.type == "sprite":
+                i.size = Vector2(*size)
+                # layouts of algorithms packing by masks aren't cached
+                i.mask = None
+
+        settings.size = Vector2(*layout["size"])
+
+        return True
+
+    def store(self, key, original, items, settings):
+        """
+        Saves the layout given by the algorithm.
+
+        :param str key: key from get_key(), calculated before running the
+                algorithm
+        :param list original: items in the order given to the algorithm
+        :param list items: items after running the algorithm
+        :param settings: Settings instance after running the algorithm
+        """
+        indices = {id(i): n for n, i in enumerate(original)}
+
+        self._layouts[key] = {
+            "order": [indices[id(i)] for i in items],
+            "positions": [i.position.to_tuple() for i in items],
+            "sizes": [i.size.to_tuple() for i in items],
+            "rotated": [i.rotated for i in items],
+            "size": settings.size.to_tuple(),
+        }
+        self._layouts.move_to_end(key)
+
+        while len(self._layouts) > self.max_entries:
+            self._layouts.popitem(last=False)
+
+    def save(self):
+        """
+        Saves the cache to its file, does nothing if the cache has no path
+        """
+        if self.path is None:
+            return
+
+        with open(self.path, "w") as f:
+            json.dump(self._layouts, f)
@@ -0,0 +1,221 @@
+import agglomerate.algorithm
+import agglomerate.items
+import agglomerate.settings
+from agglomerate.math import Vector2
+
+import concurrent.futures
+import os
+import random
+import time
+
+
+"""
+Time budgeted search of better layouts.
+
+Any algorithm is used as a placement function: the search changes the order
+in which the items are given to the algorithm and, if the settings allow
+rotation, the orientation of the sprites, keeping the changes that give a
+smaller sheet. Algorithms that sort the items themselves (see the
+"sorts_items" entry of Algorithm.supports) ignore the order, so only the
+orientation is searched for them.
+
+Candidates are evaluated in parallel by several processes using items that
+only have sizes. The search stops when the time budget is spent or when the
+sheet area equals the sum of the items areas, and the best layout found is
+then applied to the real items.
+"""
+
+
+def optimize(algorithm, items, settings, time_budget=None, workers=None,
+             callback=None, observer=None):
+    """
+    Searches the order and orientation of the items that gives the smallest
+    sheet, and packs the items with them.
+
+    Like Algorithm.pack(), sets the items positions and the settings size,
+    the items list is reordered in place.
+
+    :param algorithm: algorithm instance used to pack the items
+    :param list items: items to pack
+    :param settings: Settings instance, settings.algorithm must be the name
+            of the given algorithm
+    :param float time_budget: seconds to spend searching, uses
+            settings.optimize_time if None
+    :param int workers: amount of processes, os.cpu_count() by default
+    :param callback: function called with the best score found so far each
+            time it improves, the score is a tuple (area, longest side)
+    :param observer: agglomerate.events.Observer instance, the search stops
+            early if it's cancelled, and the best layout found so far is
+            applied
+    """
+    if time_budget is None:
+        time_budget = settings.optimize_time
+    deadline = time.monotonic() + time_budget
+
+    # sprites rotated by a previous pack are rotated back, so the candidates
+    # rotate them from the same orientation when evaluated and when applied
+    for i in items:
+        if i.type == "sprite" and i.rotated:
+            i.rotated = False
+            i.size = Vector2(i.size.y, i.size.x)
+
+    # the settings as given, before any algorithm changes the size
+    settings_dict = agglomerate.settings.Settings.to_dict(settings)
+    sizes = [(i.type, i.size.x, i.size.y) for i in items]
+    can_reorder = not algorithm.supports.get("sorts_items", False)
+    can_rotate = settings.allow["rotation"] and \
+        any(t == "sprite" for t, __, __ in sizes)
+
+    best = Candidate(list(range(len(items))), [False] * len(items))
+    best_score = _evaluate(settings_dict, sizes, best)
+    bound = _get_lower_bound(settings, sizes)
+
+    if callback is not None:
+        callback(best_score)
+
+    rng = random.Random(0)
+    workers = workers or os.cpu_count() or 1
+
+    # without the with statement, so leaving doesn't wait for the
+    # evaluations still running when the time is over
+    executor = None
+    if can_reorder or can_rotate:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+
+    try:
+        while executor is not None and best_score[0] > bound and \
+                time.monotonic() < deadline and \
+                not (observer is not None and observer.cancelled):
+            candidates = [best.mutate(rng, can_reorder, can_rotate, sizes)
+                          for __ in range(workers)]
+            futures = {executor.submit(_evaluate, settings_dict, sizes, c): c
+                       for c in candidates}
+
+            done, not_done = concurrent.futures.wait(
+                    futures, timeout=max(0, deadline - time.monotonic()))
+
+            for f in done:
+                score = f.result()
+                # equal scores are accepted too, so the search can move
+                # through layouts of the same size
+                if score <= best_score:
+                    if score < best_score and callback is not None:
+                        callback(score)
+                    best, best_score = futures[f], score
+
+            if not_done:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    best.apply(items)
+    algorithm.pack(items, settings)
+
+
+class Candidate:
+    """
+    Order and orientation of the items given to the algorithm
+
+    **Fields**
+    order
+        list of indices of the items in the original list
+    rotated
+        list of booleans, True if the item at the same index of the original
+        list is rotated. The items must be unrotated when the candidate is
+        applied
+    """
+    def __init__(self, order, rotated):
+        self.order = order
+        self.rotated = rotated
+
+    def mutate(self, rng, can_reorder, can_rotate, sizes):
+        """
+        Returns a new candidate with a random change: two items swapped, an
+        item moved or a range of items reversed if can_reorder is True, or a
+        sprite rotated if can_rotate is True
+        """
+        order = list(self.order)
+        rotated = list(self.rotated)
+        n = len(order)
+
+        sprites = [i for i, s in enumerate(sizes) if s[0] == "sprite"]
+        changes = []
+        if can_reorder and n >= 2:
+            changes.extend((0, 1, 2))
+        if can_rotate and sprites:
+            changes.append(3)
+
+        if not changes:
+            return Candidate(order, rotated)
+        change = rng.choice(changes)
+
+        if change == 0:
+            a, b = rng.sample(range(n), 2)
+            order[a], order[b] = order[b], order[a]
+        elif change == 1:
+            order.insert(rng.randrange(n), order.pop(rng.randrange(n)))
+        elif change == 2:
+            a, b = sorted(rng.sample(range(n + 1), 2))
+            order[a:b] = reversed(order[a:b])
+        else:
+            i = rng.choice(sprites)
+            rotated[i] = not rotated[i]
+
+        return Candidate(order, rotated)
+
+    def apply(self, items):
+        """
+        Reorders the items list in place and rotates the sprites 90 degrees
+        clockwise as the candidate says, the items must be unrotated
+        """
+        original = list(items)
+
+        for i, rotated in zip(original, self.rotated):
+            if rotated:
+                i.rotated = True
+                i.size = Vector2(i.size.y, i.size.x)
+
+        items[:] = [original[i] for i in self.order]
+
+
+def _get_lower_bound(settings, sizes):
+    """
+    Returns the smallest sheet area possible: the sum of the items areas, or
+    the area of the sheet if its size was given
+    """
+    w, h = settings.size.to_tuple()
+    if w != "auto" and h != "auto":
+        return w * h
+
+    return sum(w * h for __, w, h in sizes)
+
+
+def _evaluate(settings_dict, sizes, candidate):
+    """
+    Packs items with the given sizes in the candidate order and orientation,
+    and returns the score (area, longest side) of the resulting sheet, lower
+    is better. Runs in the worker processes.
+
+    :param dict settings_dict: result of Settings.to_dict()
+    :param list sizes: (type, width, height) of each item
+    :param candidate: Candidate instance
+    """
+    settings = agglomerate.settings.Settings.from_dict(settings_dict)
+    algorithm = agglomerate.algorithm.get_algorithm(settings.algorithm)
+
+    items = []
+    for item_type, w, h in sizes:
+        item = agglomerate.items.Item(Vector2(0, 0), Vector2(w, h))
+        item.type = item_type
+        items.append(item)
+
+    candidate.apply(items)
+
+    try:
+        algorithm.pack(items, settings)
+    except agglomerate.algorithm.AlgorithmOutOfSpaceException:
+        return (float("inf"), float("inf"))
+
+    w, h = settings.size.to_tuple()
+    return (w * h, max(w, h))
@@ -1,10 +1,27 @@
 import agglomerate.algorithm
+import agglomerate.canvas
+import agglomerate.compression
+import agglomerate.events
 import agglomerate.format
+import agglomerate.imagecache
+import agglomerate.items
+import agglomerate.math
+import agglomerate.optimize
+import agglomerate.palette
+import agglomerate.pipeline
+import agglomerate.scaling
+import agglomerate.validation
 
+import contextlib
+import copy
+import concurrent.futures
+import io
+import os
 import PIL
 
 
-def pack(params):
+def pack(params, pipelined=False, layout_only=False, layout_cache=None,
+         observer=None):
     """
     Packs the sprites.
 
@@ -19,33 +36,455 @@ def pack(params):
     output_coordinates_path doesn't have extension, the packer will use
     a default one based on the format chosen
 
+    If several formats are given, the sheet is packed and generated only once
+    and every coordinates file is generated from the same list of sprites.
+
+    If the settings have output_scales, the layout is calculated once and a
+    sheet and coordinates files are saved for each scale, see
+    agglomerate.scaling.
+
+    If pipelined is True, the sprites images are decoded while the
+    algorithms run, and the sheet is drawn and encoded while the sprites
+    are being decoded, see agglomerate.pipeline.
+
+    The items of the parameters and the groups can be given as iterables,
+    e.g. generators creating the sprites while a list of files is read. They
+    are read one item at a time when packing starts, and if pipelined is
+    True each sprite starts being decoded as soon as it's read, while the
+    next ones are read. The algorithms need the size of every sprite, so
+    the items are kept in lists once read.
+
+    If layout_only is True, only the coordinates files are saved. The sheet
+    isn't generated, so the images are never decoded, only their headers
+    are read to know their sizes.
+
+    If a layout cache is given, the algorithms aren't run for groups whose
+    subtree has the same sizes and settings as in a previous pack, see
+    agglomerate.layoutcache. The cache is saved after packing if it has a
+    path.
+
+    If the settings have a memory_budget, decoded images are discarded when
+    the budget is exceeded and decoded again if needed, see
+    agglomerate.imagecache.
+
+    The parameters aren't modified, except for the positions of the items
+    given by the algorithms. The sizes of the sheet and the groups are set
+    while packing and restored to the given ones (e.g. "auto") after that,
+    so the same parameters can be packed again.
+
+    If an observer is given, it's notified of the progress and can cancel
+    the pack, see agglomerate.events. When cancelled, the packer stops as
+    soon as possible raising agglomerate.events.PackCancelledException,
+    and the output files can be incomplete.
+
     :param params: parameters object
+    :param bool pipelined: overlap the decoding, drawing and encoding
+    :param bool layout_only: save only the coordinates files
+    :param layout_cache: agglomerate.layoutcache.LayoutCache instance
+    :param observer: agglomerate.events.Observer instance that receives the
+            progress events, and can cancel the pack
     """
-    # get an instance of the format named in the settings
-    format = agglomerate.format.get_format(params.settings.format)
+    pipeline = None
+    if pipelined and not layout_only:
+        pipeline = agglomerate.pipeline.Pipeline(params.settings,
+                                                 observer=observer)
 
-    # check if the chosen output format is compatible with the specified
-    # sheet settings
-    compatible, __, __ = agglomerate.format. \
-            check_compatibility(format, params.settings)
+    # with a memory budget only a few sprites are decoded ahead of the
+    # drawing, so the sprites aren't decoded while they are read
+    on_sprite = None
+    if pipeline is not None and params.settings.memory_budget is None:
+        on_sprite = lambda s: pipeline.start_decoding([s])
 
-    if not compatible:
-        raise IncompatibleFormatException(params.settings.format)
+    try:
+        _read_items(params, on_sprite)
+        with _keeping_sizes(params), _budget(params):
+            _pack(params, pipeline, layout_only, layout_cache, observer)
+    except:
+        # stop decoding if something failed
+        if pipeline is not None:
+            pipeline.close()
+        raise
+
+
+def pack_to_memory(params, layout_cache=None, observer=None):
+    """
+    Packs the sprites without writing any file, and returns the encoded
+    sheet and the coordinates.
+
+    The sprites can be created from images or file contents in memory with
+    agglomerate.items.Sprite.from_image() and Sprite.from_bytes(), so
+    nothing is read from disk either. Sprites created from files work too.
+
+    Works like pack(), but the output paths of the settings are ignored. The
+    sheet is encoded in settings.output_sheet_format, or in PNG if it's
+    None. Memory mapped sheets aren't supported.
+
+    :param params: parameters object
+    :param layout_cache: agglomerate.layoutcache.LayoutCache instance
+    :param observer: agglomerate.events.Observer instance that receives the
+            progress events, and can cancel the pack
+    :return: PackResult instance
+    """
+    _read_items(params)
+    with _keeping_sizes(params), _budget(params):
+        return _pack_to_memory(params, layout_cache, observer)
+
+
+class PackResult:
+    """
+    Sheet and coordinates generated by pack_to_memory()
+
+    **Fields**
+    sheet
+        bytes of the encoded sheet
+    sheet_format
+        lowercase image format of the sheet, e.g. "png"
+    size
+        Vector2 size of the sheet
+    coordinates
+        dictionary with the generated coordinates file string of each format
+        name in the settings
+    layout
+        list with a dictionary for each sprite, with its "name", its "x",
+        "y", "width" and "height" in the sheet and if it was "rotated"
+    sprites
+        list of agglomerate.items.PlacedSprite, the sprites as given to the
+        formats
+    variants
+        dictionary with a PackResult for each scale in
+        settings.output_scales, see agglomerate.scaling
+    """
+    def __init__(self, sheet, sheet_format, size, coordinates, sprites):
+        self.sheet = sheet
+        self.sheet_format = sheet_format
+        self.size = size
+        self.coordinates = coordinates
+        self.sprites = sprites
+        self.layout = [{"name": s.name,
+                        "x": s.position.x,
+                        "y": s.position.y,
+                        "width": s.size.x,
+                        "height": s.size.y,
+                        "rotated": s.rotated}
+                       for s in sprites]
+        self.variants = {}
+
+
+@contextlib.contextmanager
+def _keeping_sizes(params):
+    """
+    Context manager that restores the sizes of the sheet and the groups when
+    leaving it. The algorithms set the sizes of the groups, so the given ones
+    (e.g. "auto") are kept to pack the same parameters again
+    """
+    given_sizes = [(g.settings, copy.copy(g.settings.size))
+                   for g in _find_groups(params)]
+
+    try:
+        yield
+    finally:
+        for settings, size in given_sizes:
+            settings.size = size
+
+
+def _budget(params):
+    """
+    Returns the context manager of the memory budget of the settings for
+    the sprites of the parameters, see agglomerate.imagecache.budget()
+    """
+    return agglomerate.imagecache.budget(params.settings.memory_budget,
+                                         _find_sprites(params))
+
+
+def _pack(params, pipeline, layout_only, layout_cache, observer):
+    """
+    Packs the sprites and saves the results, see pack()
+
+    :param pipeline: agglomerate.pipeline.Pipeline instance used to generate
+            the sheet, or None
+    """
+    # get an instance of each format named in the settings, paired with the
+    # path where its coordinates file will be saved
+    formats = _get_formats(params.settings)
+    _check_formats(formats, params.settings)
+
+    # memory mapped sheets are drawn directly in RGB or RGBA
+    if params.settings.output_sheet_memory_map and (
+            params.settings.output_sheet_color_mode not in
+            agglomerate.canvas.MODES or
+            agglomerate.compression.is_block_format(
+                params.settings.output_sheet_format)):
+        raise ValueError("Memory mapped sheets must be RGB or RGBA and can't "
+                         "be block compressed")
+
+    # scales of the variants of the sheet, checked before packing
+    scales = _get_scales(params.settings)
+
+    # start decoding the images while the algorithms run, the ones already
+    # started while reading the items aren't decoded again
+    if pipeline is not None and params.settings.memory_budget is None:
+        pipeline.start_decoding(_find_sprites(params))
+
+    _place_items(params, layout_cache, observer)
+
+    # get all the sprites in the params group placed absolutely, the items
+    # aren't modified
+    sprites = flatten(params)
+
+    # the same layout scaled for each variant, see agglomerate.scaling
+    variants = [(scale,
+                 agglomerate.scaling.scale_sprites(sprites, scale),
+                 agglomerate.scaling.scale_settings(params.settings, scale))
+                for scale in scales]
+
+    if layout_only:
+        with agglomerate.events.phase(observer,
+                                      agglomerate.events.COORDINATES):
+            for __, format, path in formats:
+                _save_coordinates(format.generate(sprites, params.settings),
+                                  path, observer)
+            for scale, scaled, settings in variants:
+                for __, format, path in formats:
+                    _save_coordinates(
+                            format.generate(scaled, settings),
+                            agglomerate.scaling.get_variant_path(path, scale),
+                            observer)
+        return
+
+    # indexed color sheets use a palette built from all the sprites
+    palette = None
+    if params.settings.output_sheet_color_mode == "P":
+        palette = _get_palette(sprites, params.settings)
+
+    # formats only read the sprites placement, so the sheets and every
+    # coordinates file can be generated at the same time
+    with concurrent.futures.ThreadPoolExecutor(
+            (len(formats) + 1) * (len(variants) + 1)) as executor:
+        # join together the sprites and save the image
+        if pipeline is not None:
+            sheet_futures = [executor.submit(pipeline.generate_sheet,
+                                             sprites, palette)]
+        else:
+            sheet_futures = [executor.submit(_generate_sheet, sprites,
+                                             params.settings, palette,
+                                             observer)]
+        # generate the coordinates file strings
+        coordinates_futures = [
+                (executor.submit(format.generate, sprites, params.settings),
+                 path)
+                for __, format, path in formats]
+
+        # the variants are resampled and drawn at the same time, sprites
+        # too small to be seen after scaling are only in the coordinates
+        for scale, scaled, settings in variants:
+            visible = [s for s in scaled if s.size.x > 0 and s.size.y > 0]
+            sheet_futures.append(executor.submit(
+                    _generate_sheet, visible, settings, palette, observer))
+            coordinates_futures.extend(
+                    (executor.submit(format.generate, scaled, settings),
+                     agglomerate.scaling.get_variant_path(path, scale))
+                    for __, format, path in formats)
+
+        # save the coordinates files
+        with agglomerate.events.phase(observer,
+                                      agglomerate.events.COORDINATES):
+            for future, path in coordinates_futures:
+                _save_coordinates(future.result(), path, observer)
+
+        # raise exceptions that happened while generating the sheets
+        for future in sheet_futures:
+            future.result()
+
+
+def _pack_to_memory(params, layout_cache, observer):
+    """
+    Packs the sprites and returns the results, see pack_to_memory()
+    """
+    formats = _get_formats_in_memory(params.settings)
+    _check_formats(formats, params.settings)
+
+    if params.settings.output_sheet_memory_map:
+        raise ValueError("Memory mapped sheets can't be packed in memory")
+
+    scales = _get_scales(params.settings)
+
+    _place_items(params, layout_cache, observer)
+
+    sprites = flatten(params)
+
+    # the sheet is encoded in memory, so the format can't be guessed from
+    # the path
+    settings = copy.copy(params.settings)
+    if settings.output_sheet_format is None:
+        settings.output_sheet_format = "png"
+
+    palette = None
+    if settings.output_sheet_color_mode == "P":
+        palette = _get_palette(sprites, settings)
+
+    result = _generate_in_memory(sprites, settings, formats, palette,
+                                 observer)
 
-    # pack everything recusively!
-    _pack_group(params)
-    # get all the sprites in the params group and get absolute values of the
-    # positions and rotation
-    sprites = _get_sprites(params)
-    # join together the sprites and save the image
-    _generate_sheet(sprites, params.settings)
-    # generate the coordinates file string
-    coordinates = format.generate(sprites, params.settings)
-    # save the coordinates file
-    _save_coordinates(coordinates, params.settings)
+    for scale in scales:
+        scaled = agglomerate.scaling.scale_sprites(sprites, scale)
+        result.variants[scale] = _generate_in_memory(
+                scaled, agglomerate.scaling.scale_settings(settings, scale),
+                formats, palette, observer)
 
+    return result
 
-def _pack_group(group):
+
+def _generate_in_memory(sprites, settings, formats, palette, observer):
+    """
+    Draws and encodes a sheet in memory while its coordinates are generated
+
+    :param list sprites: placed sprites of the sheet
+    :param settings: SheetSettings object with output_sheet_format
+    :param list formats: result of _get_formats_in_memory()
+    :return: PackResult instance
+    """
+    # sprites too small to be seen after scaling are only in the coordinates
+    visible = [s for s in sprites if s.size.x > 0 and s.size.y > 0]
+
+    with concurrent.futures.ThreadPoolExecutor(len(formats) + 1) as executor:
+        sheet_future = executor.submit(_generate_sheet_bytes, visible,
+                                       settings, palette, observer)
+        coordinates_futures = [
+                (name, executor.submit(format.generate, sprites, settings))
+                for name, format, __ in formats]
+
+        with agglomerate.events.phase(observer,
+                                      agglomerate.events.COORDINATES):
+            coordinates = {name: future.result()
+                           for name, future in coordinates_futures}
+
+        sheet = sheet_future.result()
+
+    return PackResult(sheet, settings.output_sheet_format.lower(),
+                      settings.size, coordinates, sprites)
+
+
+def _generate_sheet_bytes(sprites, settings, palette=None, observer=None):
+    """
+    Draws the sheet and returns it encoded, see _generate_sheet()
+
+    :return: bytes of the encoded sheet
+    """
+    output = io.BytesIO()
+    _save_sheet(_draw_sheet(sprites, settings, observer), settings, palette,
+                observer, output)
+
+    return output.getvalue()
+
+
+def _check_formats(formats, settings):
+    """
+    Checks if the chosen output formats are compatible with the specified
+    sheet settings
+
+    :param list formats: list of (name, format, path) tuples
+    :param settings: SheetSettings object
+    """
+    for name, format, __ in formats:
+        compatible, __, __ = agglomerate.format. \
+                check_compatibility(format, settings)
+
+        if not compatible:
+            raise IncompatibleFormatException(name)
+
+
+def _place_items(params, layout_cache, observer):
+    """
+    Runs the algorithms of every group and saves the layout cache if it has
+    a path
+    """
+    # pack everything recusively! block compressed sheets need the sprites
+    # aligned to the compression blocks, so two sprites never share a block
+    with agglomerate.events.phase(observer, agglomerate.events.PACKING):
+        if agglomerate.compression.is_block_format(
+                params.settings.output_sheet_format):
+            _pack_group_aligned(params, layout_cache, observer)
+        else:
+            _pack_group(params, layout_cache, observer=observer)
+
+    if layout_cache is not None:
+        layout_cache.save()
+
+
+def _get_scales(settings):
+    """
+    Returns the scales of the variants of the sheet, without the base scale.
+
+    Block compressed sheets can only be scaled by integers, so the sprites
+    stay aligned to the compression blocks.
+
+    :param settings: SheetSettings object
+    :return: list of scales
+    """
+    scales = [s for s in dict.fromkeys(settings.output_scales) if s != 1]
+
+    for s in scales:
+        if s <= 0:
+            raise ValueError("Scales must be positive")
+        if agglomerate.compression.is_block_format(
+                settings.output_sheet_format) and s != int(s):
+            raise ValueError("Block compressed sheets can only be scaled by "
+                             "integers")
+
+    return scales
+
+
+def _get_formats(settings):
+    """
+    Returns a list of (name, format, path) tuples, one for each format
+    named in the settings.
+
+    settings.format can be a format name or a list of names. In the same way
+    output_coordinates_path can be a path or a list of paths, one for each
+    format. If only one path is given for several formats, the suggested
+    extension of each format is appended to the path (replacing the existing
+    one if any)
+
+    :param settings: SheetSettings object
+    :return: list of (format name, format instance, coordinates path) tuples
+    """
+    names = settings.format
+    paths = settings.output_coordinates_path
+
+    if isinstance(names, str):
+        names = [names]
+
+    formats = [agglomerate.format.get_format(n) for n in names]
+
+    if isinstance(paths, str):
+        if len(formats) == 1:
+            paths = [paths]
+        else:
+            root = os.path.splitext(paths)[0]
+            paths = [root + "." + f.suggested_extension for f in formats]
+
+    if len(paths) != len(formats):
+        raise ValueError("A coordinates path is needed for each format")
+
+    return list(zip(names, formats, paths))
+
+
+def _get_formats_in_memory(settings):
+    """
+    Returns a list of (name, format, None) tuples, one for each format
+    named in the settings, like _get_formats() but without paths
+
+    :param settings: SheetSettings object
+    :return: list of (format name, format instance, None) tuples
+    """
+    names = settings.format
+    if isinstance(names, str):
+        names = [names]
+
+    return [(n, agglomerate.format.get_format(n), None) for n in names]
+
+
+def _pack_group(group, layout_cache=None, keys=None, observer=None):
     """
     Packs a group of items recursively.
 
@@ -54,7 +493,16 @@ def _pack_group(group):
     compatibility before calling this function so you can print more
     warnings and more information to the user.
 
+    If a layout cache is given, groups whose subtree didn't change since
+    they were cached are restored with all their child groups without
+    running the algorithms, and new layouts are stored in the cache.
+
     :param group: group to pack
+    :param layout_cache: agglomerate.layoutcache.LayoutCache instance
+    :param dict keys: result of LayoutCache.get_tree_keys() for the root
+            group, calculated if not given
+    :param observer: agglomerate.events.Observer instance notified of the
+            sprites placed in each group
     """
     # Get an instance of the algorithm and format named in the settings
     a = agglomerate.algorithm.get_algorithm(group.settings.algorithm)
@@ -67,72 +515,477 @@ def _pack_group(group):
     if not compatible:
         raise IncompatibleAlgorithmException(settings.algorithm)
 
+    # The keys must be calculated before packing anything because the
+    # algorithms change the settings
+    if layout_cache is not None:
+        if keys is None:
+            keys = layout_cache.get_tree_keys(group)
+        if keys[id(group)] is not None and \
+                _restore_group(group, layout_cache, keys, observer):
+            return
+
     # Check all items and pack the groups
     for i in group.items:
         # check if item.type = "parameters" is not neccesary because only the
         # root can be "parameters"
         if i.type == "group":
-            _pack_group(i)
+            _pack_group(i, layout_cache, keys, observer)
 
     # Run the algorithm
-    a.pack(group.items, group.settings)
+    original = list(group.items)
+    _run_algorithm(a, group, observer)
 
+    if layout_cache is not None and keys[id(group)] is not None:
+        layout_cache.store(keys[id(group)], original, group.items,
+                           group.settings)
 
+    _notify_placed(group, observer)
 
-def _get_sprites(group):
+
+def _notify_placed(group, observer):
     """
-    Extracts all the sprites from the group and returns a list of sprites
-    placed absolutely (not relative to their original groups), also calls this
-    function recursively on child groups
+    Notifies the observer of the sprites placed directly in the group
     """
-    sprites = []
+    agglomerate.events.notify(
+            observer, agglomerate.events.SPRITES_PLACED,
+            agglomerate.events.PACKING,
+            sum(1 for i in group.items if i.type == "sprite"))
+
+
+def _restore_group(group, layout_cache, keys, observer=None):
+    """
+    Restores the cached layout of a group and its child groups. Child groups
+    missing from the cache are packed.
+
+    :param group: group to restore
+    :param layout_cache: agglomerate.layoutcache.LayoutCache instance
+    :param dict keys: result of LayoutCache.get_tree_keys()
+    :param observer: agglomerate.events.Observer instance
+    :return: True if the group layout was cached, False otherwise
+    """
+    if not layout_cache.restore(keys[id(group)], group.items, group.settings):
+        return False
 
     for i in group.items:
-        i.position += group.position
-        # TODO see what to do with rotations
-        if i.type == "sprite":
-            sprites.append(i)
+        if i.type == "group" and \
+                not _restore_group(i, layout_cache, keys, observer):
+            _pack_group(i, layout_cache, keys, observer)
+
+    _notify_placed(group, observer)
+
+    return True
+
+
+def _run_algorithm(algorithm, group, observer=None):
+    """
+    Runs the algorithm on the group items. If the group settings have an
+    optimize_time, the algorithm is run through agglomerate.optimize
+
+    The layout given by the algorithm is validated, raising
+    agglomerate.validation.InvalidLayoutException if it's invalid, see
+    agglomerate.validation.
+
+    :param algorithm: algorithm instance
+    :param group: group to pack
+    :param observer: agglomerate.events.Observer instance that can cancel
+            the search of agglomerate.optimize
+    """
+    # the sprites can keep the masks of a previous pack, only the algorithms
+    # that pack by masks set them again
+    if not algorithm.supports.get("masks", False):
+        for i in group.items:
+            if i.type == "sprite":
+                i.mask = None
+
+    if group.settings.optimize_time:
+        agglomerate.optimize.optimize(algorithm, group.items, group.settings,
+                                      observer=observer)
+    else:
+        algorithm.pack(group.items, group.settings)
+
+    agglomerate.validation.validate(
+            group.items, group.settings,
+            algorithm.supports.get("masks", False))
+
+
+def _pack_group_aligned(group, layout_cache=None, observer=None):
+    """
+    Packs a group of items recursively, placing the sprites in positions
+    multiple of the compression block size.
+
+    The sprites sizes are rounded up to multiples of the block size while
+    the algorithms run, so every position calculated from them is aligned
+    too. The original sizes are restored after packing.
+
+    :param group: group to pack
+    :param layout_cache: agglomerate.layoutcache.LayoutCache instance
+    :param observer: agglomerate.events.Observer instance
+    """
+    original_sizes = []
+
+    for s in _find_sprites(group):
+        original_sizes.append((s, s.size))
+        s.size = agglomerate.math.Vector2(
+                agglomerate.compression.align(s.size.x),
+                agglomerate.compression.align(s.size.y))
+
+    try:
+        _pack_group(group, layout_cache, observer=observer)
+    finally:
+        for sprite, size in original_sizes:
+            sprite.size = size
+
+
+def _find_groups(group):
+    """
+    Returns a list with the group and all its child groups
+
+    :param group: group to search
+    :return: list of groups
+    """
+    groups = []
+    pending = [group]
+
+    while pending:
+        g = pending.pop()
+        groups.append(g)
+        pending.extend(i for i in g.items if i.type == "group")
+
+    return groups
+
+
+def _read_items(group, on_sprite=None):
+    """
+    Replaces the items of the group and its child groups given as iterables
+    by lists, reading them one item at a time
+
+    :param group: group or parameters
+    :param on_sprite: function called with each sprite as soon as it's read,
+            optional
+    """
+    pending = [group]
+
+    while pending:
+        g = pending.pop()
+        items = []
+        for i in g.items:
+            if i.type == "group":
+                pending.append(i)
+            elif i.type == "sprite" and on_sprite is not None:
+                on_sprite(i)
+            items.append(i)
+        g.items = items
+
+
+def _find_sprites(group):
+    """
+    Returns a list of all the sprites in the group and its child groups,
+    without modifying them
+
+    :param group: group to search
+    :return: list of sprites
+    """
+    sprites = []
+    pending = [group]
+
+    while pending:
+        g = pending.pop()
+        for i in g.items:
+            if i.type == "sprite":
+                sprites.append(i)
+            elif i.type == "group":
+                pending.append(i)
+
+    return sprites
+
+
+def flatten(group):
+    """
+    Returns the table of every sprite in the group and its child groups
+    placed absolutely (not relative to their original groups).
+
+    The tree is walked once without recursion and without modifying it, so
+    the same group can be packed and flattened again.
+
+    :param group: packed group or parameters
+    :return: list of agglomerate.items.PlacedSprite, in the order of the
+            items in the tree
+    """
+    sprites = []
+    # iterators over the items of the groups being walked, with the absolute
+    # position of the group
+    pending = [(iter(group.items), group.position.x, group.position.y)]
+
+    while pending:
+        items, x, y = pending[-1]
+        i = next(items, None)
+
+        if i is None:
+            pending.pop()
+        elif i.type == "sprite":
+            sprites.append(agglomerate.items.PlacedSprite(
+                    i, agglomerate.math.Vector2(i.position.x + x,
+                                                i.position.y + y)))
         elif i.type == "group":
-            sprites.extend(_get_sprites(i))
+            # TODO see what to do with rotations
+            pending.append((iter(i.items), i.position.x + x,
+                            i.position.y + y))
         else:
-            sys.exit("An item has no type, abort!")
+            raise ValueError("An item has no type")
 
     return sprites
 
 
-def _generate_sheet(sprites, settings):
+def _get_palette(sprites, settings):
+    """
+    Returns the palette used by indexed color sheets, containing the colors
+    of every sprite and the background color.
+
+    :param list sprites: list of sprites
+    :param settings: SheetSettings object
+    :return: palette array, see agglomerate.palette.build_palette()
+    """
+    # a generator, so the images can be discarded if there is a memory
+    # budget
+    return agglomerate.palette.build_palette(
+            (s.image for s in sprites),
+            [settings.background_color.to_tuple()])
+
+
+def _generate_sheet(sprites, settings, palette=None, observer=None):
     """
     Creates the sheet drawing the sprites in the locations given by the
     algorithm and then saves the image.
+
+    See _draw_sheet() and _save_sheet()
+    """
+    _save_sheet(_draw_sheet(sprites, settings, observer), settings, palette,
+                observer)
+
+
+def _draw_sheet(sprites, settings, observer=None):
+    """
+    Creates the sheet drawing the sprites in the locations given by the
+    algorithm.
+
+    Indexed color sheets ("P" color mode) are drawn in RGBA and then
+    converted using the given palette.
+
+    If the sheet is stored in an array, the sprites images are converted to
+    the sheet mode in bulk by several threads and then copied to the sheet,
+    see agglomerate.canvas.
+
+    :return: sheet, a PIL image or an agglomerate.canvas canvas
+    """
+    path = settings.output_sheet_path
+    sheet = _new_sheet(settings)
+
+    try:
+        with agglomerate.events.phase(observer, agglomerate.events.DRAWING,
+                                      path):
+            if isinstance(sheet, agglomerate.canvas.ArrayCanvas):
+                sheet.overlapping = _has_overlaps(sprites)
+                _draw_batches(sheet, sprites, path, observer)
+            else:
+                for s in sprites:
+                    _paste_sprite(sheet, s)
+                    agglomerate.events.notify(
+                            observer, agglomerate.events.SPRITES_DRAWN,
+                            agglomerate.events.DRAWING, 1, path)
+    except:
+        sheet.close()
+        raise
+
+    return sheet
+
+
+def _draw_batches(sheet, sprites, path, observer):
+    """
+    Draws the sprites in an array sheet, converting a batch of sprites at a
+    time in several threads so only a few converted images are kept in
+    memory
     """
-    sheet = PIL.Image.new(settings.output_sheet_color_mode,
-                          settings.size.to_tuple(),
-                          settings.background_color.to_tuple())
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for i in range(0, len(sprites), _BATCH_SIZE):
+            batch = sprites[i:i + _BATCH_SIZE]
+            prepared = list(executor.map(_prepare_sprite, batch,
+                                         [sheet.mode] * len(batch)))
+            agglomerate.events.notify(
+                    observer, agglomerate.events.SPRITES_LOADED,
+                    agglomerate.events.DRAWING, len(batch), path)
+
+            for s, p in zip(batch, prepared):
+                _draw_sprite(sheet, s, p)
+            agglomerate.events.notify(
+                    observer, agglomerate.events.SPRITES_DRAWN,
+                    agglomerate.events.DRAWING, len(batch), path)
+
+
+# Amount of sprites converted at the same time by _generate_sheet()
+_BATCH_SIZE = 256
+
 
-    for s in sprites:
-        sheet.paste(s.image, s.position.to_tuple(), s.image)
-        print("Placed in")
-        print(s.position)
+def _get_drawing_mode(settings):
+    """
+    Returns the color mode used for drawing the sprites, indexed color sheets
+    are drawn in RGBA
+    """
+    if settings.output_sheet_color_mode == "P":
+        return "RGBA"
+    return settings.output_sheet_color_mode
+
+
+def _new_sheet(settings):
+    """
+    Returns an empty sheet filled with the background color, in the mode used
+    for drawing the sprites.
+
+    Returns a agglomerate.canvas.ArrayCanvas if the mode can be stored in an
+    array, else a PIL image. If settings.output_sheet_memory_map is True,
+    returns a agglomerate.canvas.MappedCanvas, raw sheets are mapped
+    directly to the output file.
+    """
+    mode = _get_drawing_mode(settings)
+    size = settings.size.to_tuple()
+    background = settings.background_color.to_tuple()
+
+    if settings.output_sheet_memory_map:
+        path = None
+        if _get_sheet_format(settings) == "raw":
+            path = settings.output_sheet_path
+
+        return agglomerate.canvas.MappedCanvas(size, mode, background, path)
+
+    if mode in agglomerate.canvas.ARRAY_MODES:
+        return agglomerate.canvas.ArrayCanvas(size, mode, background)
+
+    return PIL.Image.new(mode, size, background)
+
+
+def _get_sheet_format(settings):
+    """
+    Returns the lowercase image format of the sheet, taken from the output
+    sheet path extension if output_sheet_format is None
+    """
+    image_format = settings.output_sheet_format
+    if image_format is None:
+        image_format = os.path.splitext(settings.output_sheet_path)[1][1:]
 
+    return image_format.lower()
+
+
+def _has_overlaps(sprites):
+    """
+    Returns True if any two sprites overlap, see
+    agglomerate.validation.find_overlap()
+    """
+    return agglomerate.validation.find_overlap(
+            [(s.position.x, s.position.y,
+              s.position.x + s.size.x, s.position.y + s.size.y)
+             for s in sprites]) is not None
+
+
+def _get_image(sprite):
+    """
+    Returns the sprite image as it must be drawn in the sheet, i.e. rotated
+    90 degrees clockwise if the sprite was rotated
+    """
+    if sprite.rotated:
+        return sprite.image.transpose(PIL.Image.ROTATE_270)
+    return sprite.image
+
+
+def _prepare_sprite(sprite, mode):
+    """
+    Converts the sprite image to the given mode, rotated if the sprite was
+    rotated, see agglomerate.canvas.prepare()
+    """
+    prepared = sprite.prepare(mode)
+    if sprite.rotated:
+        prepared = agglomerate.canvas.rotate(prepared)
+    return prepared
+
+
+def _draw_sprite(sheet, sprite, prepared):
+    """
+    Draws the prepared sprite pixels in an array sheet, in the position given
+    by the algorithm
+    """
+    sheet.draw(prepared, sprite.position.to_tuple())
+
+
+def _paste_sprite(sheet, sprite):
+    """
+    Draws the sprite in the sheet, in the position given by the algorithm
+    """
+    image = _get_image(sprite)
+    sheet.paste(image, sprite.position.to_tuple(), image)
+
+
+def _save_sheet(sheet, settings, palette=None, observer=None, output=None):
+    """
+    Saves the sheet according to settings, converting it to indexed colors
+    or compressing it if necessary. The sheet is closed after saving.
+
+    :param output: binary file object where the sheet is written instead of
+            settings.output_sheet_path, settings.output_sheet_format must be
+            given
+    """
     # Now in Python3 this is not needed?
     # if output_sheet_format is an unicode string, pillow has problems
     # if isinstance(settings.output_sheet_format, unicode):
     #     settings.output_sheet_format = \
     #             settings.output_sheet_format.encode("ascii", "ignore")
 
-    sheet.save(settings.output_sheet_path, settings.output_sheet_format)
+    path = settings.output_sheet_path
+    target = path if output is None else output
+
+    try:
+        with agglomerate.events.phase(observer, agglomerate.events.ENCODING,
+                                      path):
+            image = sheet
+            if isinstance(sheet, agglomerate.canvas.ArrayCanvas):
+                image = sheet.to_image()
+
+            if settings.output_sheet_color_mode == "P":
+                agglomerate.palette.quantize(image, palette).save(
+                        target, settings.output_sheet_format)
+            elif agglomerate.compression.is_block_format(
+                    settings.output_sheet_format):
+                if output is None:
+                    agglomerate.compression.save_dds(
+                            image, path, settings.output_sheet_format)
+                else:
+                    output.write(agglomerate.compression.encode_dds(
+                            image, settings.output_sheet_format))
+            else:
+                sheet.save(target, settings.output_sheet_format)
 
+            size = os.path.getsize(path) if output is None else output.tell()
+            agglomerate.events.notify(
+                    observer, agglomerate.events.BYTES_ENCODED,
+                    agglomerate.events.ENCODING, size, path)
+    finally:
+        sheet.close()
 
-def _save_coordinates(coordinates, settings):
+
+def _save_coordinates(coordinates, path, observer=None):
     """
     Saves the generated string into a file.
 
-    The output file is defined in the settings, if the path given doesn't have
-    extension, the format's default extension will be used
+    :param str coordinates: string generated by a format
+    :param str path: where to save the coordinates file
+    :param observer: agglomerate.events.Observer instance notified of the
+            bytes written
     """
-    with open(settings.output_coordinates_path, "w") as f:
+    with open(path, "w") as f:
         f.write(coordinates)
 
+    agglomerate.events.notify(
+            observer, agglomerate.events.BYTES_ENCODED,
+            agglomerate.events.COORDINATES, len(coordinates.encode("utf-8")),
+            path)
+
 
 # -----------------------------------------------------------------------------
 # Exceptions
@@ -162,10 +1015,10 @@ class IncompatibleFormatException(Exception):
     :param str algorithm_name:
     :param str reason: why the algorithm is incompatible, optional
     """
-    def __init__(self, format_name, reason):
+    def __init__(self, format_name, reason=""):
         self.format_name = format_name
 
         # Set the message by calling parent's constructor
         message = "Format {} is incompatible with the given settings, {}" \
             .format(format_name, reason)
-        super(IncompatibleAlgorithmException, self).__init__(message)
+        super(IncompatibleFormatException, self).__init__(message)
@@ -0,0 +1,166 @@
+import numpy
+import PIL.Image
+
+
+"""
+Indexed color ("P" mode) output.
+
+Builds a palette of RGBA colors from a list of images and converts sheets to
+indexed color images using it. If the images use 256 colors or less the
+palette contains exactly those colors, otherwise the colors are reduced with
+a median cut over the unique colors of the images.
+
+The same palette can be used for every sheet generated from the same sprites.
+"""
+
+
+# Maximum amount of colors that a "P" mode image can have
+MAX_COLORS = 256
+
+
+def build_palette(images, extra_colors=(), max_colors=MAX_COLORS):
+    """
+    Returns a palette containing the colors used by the given images.
+
+    Only the unique colors of each image are kept, so the images can be
+    given by a generator and never be in memory at the same time.
+
+    :param images: iterable of PIL images, converted to RGBA if necessary
+    :param list extra_colors: RGBA tuples to add to the palette, e.g. the
+            background color
+    :param int max_colors: maximum amount of colors in the palette
+    :return: uint8 array of shape (colors, 4)
+    """
+    unique = [numpy.unique(_pack(numpy.asarray(i.convert("RGBA"))
+                                 .reshape(-1, 4)), return_counts=True)
+              for i in images]
+    unique.append(numpy.unique(_pack(numpy.array(extra_colors, numpy.uint8)
+                                     .reshape(-1, 4)), return_counts=True))
+
+    # merge the colors of every image adding their counts
+    colors, inverse = numpy.unique(
+            numpy.concatenate([c for c, __ in unique]), return_inverse=True)
+    counts = numpy.bincount(inverse.reshape(-1),
+                            numpy.concatenate([n for __, n in unique])) \
+        .astype(numpy.int64)
+
+    if len(colors) <= max_colors:
+        # exact palette, every color is in the palette
+        return _unpack(colors)
+
+    return _median_cut(_unpack(colors).astype(numpy.float64), counts,
+                       max_colors)
+
+
+def quantize(image, palette):
+    """
+    Converts the image to a "P" mode image using the given palette.
+
+    Each color is replaced by the nearest color in the palette, colors present
+    in the palette are kept exactly. The alpha values of the palette are
+    saved as the image transparency.
+
+    :param image: PIL image, converted to RGBA if necessary
+    :param palette: uint8 array of shape (colors, 4) from build_palette()
+    :return: PIL image in "P" mode
+    """
+    pixels = numpy.asarray(image.convert("RGBA"))
+    height, width = pixels.shape[:2]
+
+    # find the nearest palette entry only once for each unique color
+    colors, inverse = numpy.unique(_pack(pixels.reshape(-1, 4)),
+                                   return_inverse=True)
+    indices = _nearest(_unpack(colors), palette)[inverse.reshape(-1)]
+
+    result = PIL.Image.fromarray(
+            indices.astype(numpy.uint8).reshape(height, width), "P")
+    result.putpalette(palette.tobytes(), "RGBA")
+
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+
+
+def _pack(colors):
+    """
+    Packs an uint8 array of shape (n, 4) into an uint32 array of shape (n)
+    """
+    colors = numpy.ascontiguousarray(colors, numpy.uint8)
+    return colors.view(">u4").reshape(-1)
+
+
+def _unpack(packed):
+    """
+    Unpacks an uint32 array of shape (n) into an uint8 array of shape (n, 4)
+    """
+    return packed.astype(">u4").view(numpy.uint8).reshape(-1, 4)
+
+
+def _nearest(colors, palette, chunk_size=16384):
+    """
+    Returns the index of the nearest palette color for each color.
+
+    :param colors: uint8 array of shape (n, 4)
+    :param palette: uint8 array of shape (colors, 4)
+    :return: int array of shape (n)
+    """
+    palette = palette.astype(numpy.float32)
+    palette_norms = (palette ** 2).sum(axis=1)
+    indices = numpy.empty(len(colors), numpy.intp)
+
+    # |c - p|^2 = |c|^2 - 2 c.p + |p|^2, and |c|^2 doesn't change the nearest
+    # color. Computed in chunks to keep memory usage bounded
+    for start in range(0, len(colors), chunk_size):
+        chunk = colors[start:start + chunk_size].astype(numpy.float32)
+        distances = palette_norms[None] - 2 * (chunk @ palette.T)
+        indices[start:start + chunk_size] = distances.argmin(axis=1)
+
+    return indices
+
+
+def _median_cut(colors, counts, max_colors):
+    """
+    Reduces the colors with the median cut algorithm.
+
+    Repeatedly splits the box with the widest channel range at the weighted
+    median of that channel, each box becomes the weighted mean of its colors.
+
+    :param colors: float array of shape (n, 4) with unique colors
+    :param counts: int array of shape (n), amount of pixels of each color
+    :param int max_colors: amount of colors to return at most
+    :return: uint8 array of shape (colors, 4)
+    """
+    def channel_ranges(box):
+        if len(box) > 1:
+            return numpy.ptp(colors[box], axis=0)
+        return numpy.zeros(4)
+
+    boxes = [numpy.arange(len(colors))]
+    ranges = [channel_ranges(boxes[0])]
+
+    while len(boxes) < max_colors:
+        # find the box with the widest channel range
+        widest = max(range(len(boxes)), key=lambda i: ranges[i].max())
+        if ranges[widest].max() == 0:
+            break
+
+        box = boxes.pop(widest)
+        channel = ranges.pop(widest).argmax()
+
+        # split at the weighted median
+        order = box[numpy.argsort(colors[box, channel], kind="stable")]
+        cumulative = numpy.cumsum(counts[order])
+        split = numpy.searchsorted(cumulative, cumulative[-1] / 2)
+        split = min(max(split, 1), len(order) - 1)
+
+        for b in (order[:split], order[split:]):
+            boxes.append(b)
+            ranges.append(channel_ranges(b))
+
+    palette = [numpy.average(colors[b], axis=0, weights=counts[b])
+               for b in boxes]
+
+    return numpy.rint(palette).astype(numpy.uint8)
@@ -0,0 +1,402 @@
+import agglomerate.canvas
+import agglomerate.events
+import agglomerate.items
+import agglomerate.packer
+
+import concurrent.futures
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy
+
+
+"""
+Pipelined generation of sheets.
+
+Instead of running each phase after the previous one finishes, the sprites
+are decoded in background threads while the algorithms place them, each
+sprite is drawn as soon as it's decoded and its position is final, and
+bands of rows are compressed and written as soon as every sprite covering
+them was drawn.
+
+Only PNG sheets can be written band by band, other sheets are saved after
+drawing every sprite as usual.
+
+If the settings have a memory budget, the sprites aren't decoded while the
+algorithms run, and only a few sprites are decoded ahead of the drawing.
+"""
+
+
+# PNG color types of the color modes that can be written band by band
+_PNG_COLOR_TYPES = {
+    "L": 0,
+    "RGB": 2,
+    "LA": 4,
+    "RGBA": 6,
+}
+
+
+class Pipeline:
+    """
+    Runs the decoding, drawing and encoding of a sheet at the same time.
+
+    Usage: call start_decoding() before packing the sprites, and then
+    generate_sheet() with the sprites placed absolutely.
+    """
+    def __init__(self, settings, band_height=64, workers=None,
+                 observer=None):
+        """
+        Creates a pipeline
+
+        :param settings: SheetSettings object
+        :param int band_height: amount of rows encoded together
+        :param int workers: amount of threads used for decoding sprites,
+                os.cpu_count() by default
+        :param observer: agglomerate.events.Observer instance notified of
+                the progress
+        """
+        self.settings = settings
+        self.observer = observer
+        self.band_height = band_height
+        self.workers = workers or os.cpu_count() or 1
+
+        # amount of sprites decoded ahead of the drawing, None means every
+        # sprite is decoded as soon as possible
+        self._window = None
+        if settings.memory_budget is not None:
+            self._window = 2 * self.workers
+
+        self._executor = None
+        self._decoded = {}
+
+    def start_decoding(self, sprites):
+        """
+        Starts decoding the images of the given sprites in background threads
+
+        :param list sprites: list of sprites or placed sprites
+        """
+        if self._executor is None:
+            self._executor = \
+                    concurrent.futures.ThreadPoolExecutor(self.workers)
+
+        for s in sprites:
+            key = _get_key(s)
+            if key not in self._decoded:
+                self._decoded[key] = self._executor.submit(self._decode, s)
+
+    def generate_sheet(self, sprites, palette=None):
+        """
+        Draws the sprites in the sheet as soon as they are decoded and saves
+        the sheet. If possible, bands of rows are encoded as soon as they are
+        finished.
+
+        :param list sprites: list of agglomerate.items.PlacedSprite
+        :param palette: palette used for indexed color sheets
+        """
+        try:
+            if self._can_stream():
+                self._generate_streaming(sprites)
+            else:
+                sheet = self._new_sheet(sprites)
+                try:
+                    with agglomerate.events.phase(
+                            self.observer, agglomerate.events.DRAWING,
+                            self.settings.output_sheet_path):
+                        for s in self._decode_ahead(sprites):
+                            self._draw(sheet, s)
+                except:
+                    sheet.close()
+                    raise
+
+                agglomerate.packer._save_sheet(sheet, self.settings, palette,
+                                               self.observer)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the decoding threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _decode_ahead(self, sprites):
+        """
+        Generator that yields the sprites in order, while the next ones are
+        being decoded
+        """
+        if self._window is None:
+            self.start_decoding(sprites)
+            yield from sprites
+            return
+
+        for i, s in enumerate(sprites):
+            self.start_decoding(sprites[i:i + self._window])
+            yield s
+
+    def _decode(self, sprite):
+        """
+        Decodes the sprite image, and converts it to the sheet mode if the
+        sheet is stored in an array.
+
+        The algorithms can still be running, so the image isn't rotated
+        yet, see _draw()
+        """
+        # stop decoding if the pack was cancelled
+        agglomerate.events.check_cancelled(self.observer)
+
+        mode = agglomerate.packer._get_drawing_mode(self.settings)
+        if mode in agglomerate.canvas.ARRAY_MODES:
+            prepared = sprite.prepare(mode)
+        else:
+            prepared = None
+            sprite.image.load()
+
+        agglomerate.events.notify(
+                self.observer, agglomerate.events.SPRITES_LOADED,
+                agglomerate.events.DRAWING, 1,
+                self.settings.output_sheet_path)
+        return prepared
+
+    def _new_sheet(self, sprites):
+        """
+        Creates the sheet where the given sprites will be drawn
+        """
+        sheet = agglomerate.packer._new_sheet(self.settings)
+        if isinstance(sheet, agglomerate.canvas.ArrayCanvas):
+            sheet.overlapping = agglomerate.packer._has_overlaps(sprites)
+
+        return sheet
+
+    def _draw(self, sheet, sprite):
+        """
+        Waits until the image of the sprite is decoded and draws it, raising
+        the exception that happened while decoding if any. The position and
+        rotation of the sprite are final here
+        """
+        prepared = self._decoded.pop(_get_key(sprite)).result()
+
+        if isinstance(sheet, agglomerate.canvas.ArrayCanvas):
+            if sprite.rotated:
+                prepared = agglomerate.canvas.rotate(prepared)
+            agglomerate.packer._draw_sprite(sheet, sprite, prepared)
+        else:
+            agglomerate.packer._paste_sprite(sheet, sprite)
+
+        agglomerate.events.notify(
+                self.observer, agglomerate.events.SPRITES_DRAWN,
+                agglomerate.events.DRAWING, 1,
+                self.settings.output_sheet_path)
+
+    def _can_stream(self):
+        """
+        Returns True if the sheet can be written band by band
+        """
+        settings = self.settings
+        image_format = agglomerate.packer._get_sheet_format(settings)
+
+        return (image_format == "png" and
+                not settings.output_sheet_memory_map and
+                settings.output_sheet_color_mode in _PNG_COLOR_TYPES)
+
+    def _generate_streaming(self, sprites):
+        """
+        Draws the sprites from top to bottom, and encodes the bands of rows
+        in another thread as soon as every sprite covering them was drawn.
+
+        The observer gets the same phases as when the sheet is saved after
+        drawing it: the encoding phase starts when the drawing finishes, and
+        covers encoding the last bands. Then the size of the file is
+        notified
+        """
+        path = self.settings.output_sheet_path
+        sheet = self._new_sheet(sprites)
+        height = sheet.size[1]
+        finished_rows = queue.Queue()
+        errors = []
+        # size of the file, once written
+        written = []
+
+        def encode():
+            try:
+                with PNGStreamWriter(path, sheet.size, sheet.mode) as writer:
+                    done = 0
+                    while done < height:
+                        rows = finished_rows.get()
+                        if rows is None:
+                            return
+
+                        # encode finished rows in bands, the last band can
+                        # be shorter
+                        while rows - done >= self.band_height or \
+                                (rows == height and done < height):
+                            stop = min(done + self.band_height, height)
+                            writer.write(sheet.pixels[done:stop])
+                            done = stop
+                written.append(writer.size)
+            except Exception as e:
+                errors.append(e)
+
+        encoder = threading.Thread(target=encode)
+        encoder.start()
+
+        try:
+            with agglomerate.events.phase(self.observer,
+                                          agglomerate.events.DRAWING, path):
+                # rows above the top of the next sprite won't change anymore
+                for s in self._decode_ahead(
+                        sorted(sprites, key=lambda s: s.position.y)):
+                    finished_rows.put(max(0, min(s.position.y, height)))
+                    self._draw(sheet, s)
+                    if errors:
+                        raise errors[0]
+
+                finished_rows.put(height)
+
+            with agglomerate.events.phase(self.observer,
+                                          agglomerate.events.ENCODING, path):
+                encoder.join()
+                if errors:
+                    raise errors[0]
+
+                agglomerate.events.notify(
+                        self.observer, agglomerate.events.BYTES_ENCODED,
+                        agglomerate.events.ENCODING, written[0], path)
+        finally:
+            # stops the encoder if the drawing failed before finishing
+            finished_rows.put(None)
+            encoder.join()
+
+
+def _get_key(sprite):
+    """
+    Returns the key of the decoded image of a sprite or placed sprite, the
+    same for both
+    """
+    if isinstance(sprite, agglomerate.items.PlacedSprite):
+        sprite = sprite.sprite
+    return id(sprite)
+
+
+class PNGStreamWriter:
+    """
+    Writes a PNG file band by band, so the encoding can start before the
+    whole image is finished.
+
+    Each row is filtered with the filter that gives the smallest sum of
+    absolute values, like most PNG encoders do, and the filtered rows are
+    compressed with zlib as they arrive.
+
+    **Fields**
+    size
+        amount of bytes written to the file so far
+    """
+    def __init__(self, path, size, mode, compress_level=6):
+        """
+        Opens the file and writes the PNG header
+
+        :param str path: where to save the image
+        :param tuple size: (width, height) of the image
+        :param str mode: "L", "RGB", "LA" or "RGBA"
+        :param int compress_level: zlib compression level
+        """
+        self.width, self.height = size
+        self.channels = len(mode)
+        self.size = 0
+        self._file = open(path, "wb")
+        self._compressor = zlib.compressobj(compress_level)
+        self._previous = numpy.zeros(self.width * self.channels, numpy.uint8)
+
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self.size += 8
+        self._write_chunk(b"IHDR", struct.pack(
+                ">IIBBBBB", self.width, self.height, 8,
+                _PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+    def write(self, rows):
+        """
+        Filters, compresses and writes the given rows
+
+        :param rows: uint8 array of shape (rows, width, channels) or
+                (rows, width)
+        """
+        rows = rows.reshape(len(rows), -1)
+        data = self._compressor.compress(self._filter(rows).tobytes())
+        if data:
+            self._write_chunk(b"IDAT", data)
+        self._previous = rows[-1]
+
+    def close(self):
+        """
+        Flushes the compressed data and closes the file
+        """
+        if self._file.closed:
+            return
+
+        self._write_chunk(b"IDAT", self._compressor.flush())
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _filter(self, rows):
+        """
+        Returns the filtered rows, each one starting with its filter type
+        """
+        bpp = self.channels
+        current = rows.astype(numpy.int16)
+        up = numpy.vstack([self._previous[None], rows[:-1]]) \
+            .astype(numpy.int16)
+
+        left = numpy.zeros_like(current)
+        left[:, bpp:] = current[:, :-bpp]
+        up_left = numpy.zeros_like(current)
+        up_left[:, bpp:] = up[:, :-bpp]
+
+        # paeth predictor
+        estimate = left + up - up_left
+        distance_left = numpy.abs(estimate - left)
+        distance_up = numpy.abs(estimate - up)
+        distance_up_left = numpy.abs(estimate - up_left)
+        paeth = numpy.where(
+                (distance_left <= distance_up) &
+                (distance_left <= distance_up_left), left,
+                numpy.where(distance_up <= distance_up_left, up, up_left))
+
+        # none, sub, up, average and paeth filters
+        candidates = numpy.stack([
+                current,
+                current - left,
+                current - up,
+                current - (left + up) // 2,
+                current - paeth]).astype(numpy.uint8)
+
+        # choose the filter with the smallest sum of absolute values when the
+        # bytes are seen as signed
+        scores = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32)) \
+            .sum(axis=2)
+        chosen = scores.argmin(axis=0)
+
+        result = numpy.empty((len(rows), rows.shape[1] + 1), numpy.uint8)
+        result[:, 0] = chosen
+        result[:, 1:] = candidates[chosen, numpy.arange(len(rows))]
+        return result
+
+    def _write_chunk(self, chunk_type, data):
+        """
+        Writes a PNG chunk with its length and CRC
+        """
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack(">I",
+                                     zlib.crc32(chunk_type + data)))
+        self.size += len(data) + 12
@@ -0,0 +1,172 @@
+import agglomerate.archives
+import agglomerate.format
+import agglomerate.items
+
+import threading
+
+import numpy
+import PIL.Image
+
+
+"""
+Sprites taken from the regions of existing sheets, to merge and repack
+sheets made before or by other tools.
+
+The sheet is read with its coordinates file, which must be in a format that
+implements Format.parse(), e.g. simplejson. The sheet is decoded only once,
+to an RGBA array shared by all its regions, instead of reading a file for
+each sprite.
+
+When the sprites are drawn in an RGBA sheet, their pixels are views of
+that array, nothing is copied. Their image field (used e.g. by palettes,
+scale variants and the mask algorithm) is a PIL image copied from the
+region, so like the images of other sprites it can be discarded by memory
+budgets. The decoded sheet itself is kept while its sprites exist and
+isn't counted in memory budgets, see agglomerate.imagecache.
+
+Sprites that were rotated in the sheet are rotated back, and the pixels
+outside the mask of sprites packed by their masks are cleared, so the other
+sprites in their transparent areas aren't copied. Masked regions are always
+copied.
+"""
+
+
+def load_regions(sheet_path, coordinates_path, format_name="simplejson"):
+    """
+    Creates a sprite for each region of a sheet
+
+    :param str sheet_path: path to the sheet image, can be inside an archive,
+            see agglomerate.archives
+    :param str coordinates_path: path to the coordinates file of the sheet
+    :param str format_name: format of the coordinates file
+    :return: list of RegionSprite, in the order of the coordinates file
+    """
+    with open(coordinates_path) as f:
+        regions = agglomerate.format.get_format(format_name).parse(f.read())
+
+    sheet = SourceSheet(sheet_path)
+    return [RegionSprite(sheet, r) for r in regions]
+
+
+class SourceSheet:
+    """
+    A sheet whose regions are used as sprites, decoded when first used and
+    kept while its sprites exist.
+
+    **Fields**
+    path
+        path to the sheet image
+    size
+        (width, height) of the sheet
+    """
+    def __init__(self, path):
+        """
+        Reads the size of the sheet, it isn't decoded yet
+
+        :param str path: path to the sheet image
+        """
+        self.path = path
+        self._pixels = None
+        self._lock = threading.Lock()
+
+        with agglomerate.archives.open_file(path) as f, \
+                PIL.Image.open(f) as image:
+            self.size = image.size
+
+    @property
+    def pixels(self):
+        """
+        The RGBA pixels of the sheet, an uint8 array of shape (height,
+        width, 4). Decoded once even if several threads use it at the same
+        time, must not be modified
+        """
+        if self._pixels is None:
+            with self._lock:
+                if self._pixels is None:
+                    with agglomerate.archives.open_file(self.path) as f, \
+                            PIL.Image.open(f) as image:
+                        pixels = numpy.asarray(image.convert("RGBA"))
+                    pixels.setflags(write=False)
+                    self._pixels = pixels
+        return self._pixels
+
+
+class RegionSprite(agglomerate.items.Sprite):
+    """
+    A sprite taken from a region of a sheet.
+
+    **Fields**
+    sheet
+        the SourceSheet instance
+    region
+        (x, y, width, height) of the sprite in the sheet, rotated if the
+        sprite was rotated in the sheet
+    region_rotated
+        True if the sprite was rotated 90 degrees clockwise in the sheet
+    region_mask
+        mask of the sprite in the sheet, see Sprite.mask, or None
+
+    Also has the fields of agglomerate.items.Sprite, path is None
+    """
+    def __init__(self, sheet, region):
+        """
+        Creates the sprite of a region of the sheet
+
+        :param sheet: SourceSheet instance
+        :param dict region: region as returned by Format.parse()
+        """
+        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+        if x < 0 or y < 0 or x + w > sheet.size[0] or \
+                y + h > sheet.size[1]:
+            raise ValueError("The region of {} is out of the sheet {}"
+                             .format(region["name"], sheet.path))
+
+        self.sheet = sheet
+        self.region = (x, y, w, h)
+        self.region_rotated = region["rotated"]
+        self.region_mask = region.get("mask")
+
+        size = (h, w) if self.region_rotated else (w, h)
+        self._init_fields(None, region["name"], size)
+
+    def load_image(self):
+        """
+        Copies the region of the sheet to a new image
+
+        :return: PIL image
+        """
+        return PIL.Image.fromarray(
+                numpy.ascontiguousarray(self._get_pixels()), "RGBA")
+
+    def prepare(self, mode):
+        """
+        Returns the pixels of the region as views of the sheet pixels if the
+        mode is "RGBA", see Sprite.prepare()
+        """
+        if mode != "RGBA" or self._image is not None:
+            return super().prepare(mode)
+
+        pixels = self._get_pixels()
+        alpha = pixels[:, :, 3:]
+        if alpha.size == 0 or alpha.min() == 255:
+            alpha = None
+        return pixels, alpha
+
+    def _get_pixels(self):
+        """
+        Returns the RGBA pixels of the sprite, a view of the sheet pixels
+        unless the region has a mask
+        """
+        x, y, w, h = self.region
+        pixels = self.sheet.pixels[y:y + h, x:x + w]
+
+        if self.region_mask is not None:
+            visible = numpy.zeros((h, w), bool)
+            for mx, my, mw, mh in self.region_mask:
+                visible[my:my + mh, mx:mx + mw] = True
+            pixels = numpy.where(visible[:, :, None], pixels, 0) \
+                .astype(numpy.uint8)
+
+        if self.region_rotated:
+            pixels = numpy.rot90(pixels, 1)
+        return pixels
@@ -0,0 +1,167 @@
+import agglomerate.canvas
+import agglomerate.items
+from agglomerate.math import Vector2
+
+import copy
+import math
+import os
+
+import PIL.Image
+
+
+"""
+Scale variants of a sheet, e.g. @2x and @0.5x sheets for screens of
+different densities.
+
+The layout is calculated once at the base resolution and scaled: a sprite
+from x to x + w is placed from floor(x * scale) to floor((x + w) * scale).
+Since the scaled borders keep their order, sprites that didn't overlap
+don't overlap after scaling, and integer scales are exact. Each sprite
+image is resampled to its scaled size.
+"""
+
+
+# filter used to resample the sprites images
+RESAMPLING_FILTER = PIL.Image.LANCZOS
+
+
+def get_variant_path(path, scale):
+    """
+    Returns the path of a scale variant of a file, adding @<scale>x before
+    the extension, e.g. sheet.png becomes sheet@2x.png
+
+    :param str path: path of the base file
+    :param float scale:
+    :return: path string
+    """
+    root, extension = os.path.splitext(path)
+    return "{}@{:g}x{}".format(root, scale, extension)
+
+
+def scale_sprites(sprites, scale):
+    """
+    Returns the table of the sprites of a scale variant
+
+    :param list sprites: list of agglomerate.items.PlacedSprite in the base
+            sheet
+    :param float scale:
+    :return: list of ScaledSprite
+    """
+    return [ScaledSprite(s, scale) for s in sprites]
+
+
+def scale_settings(settings, scale):
+    """
+    Returns a copy of the sheet settings for a scale variant, with the size
+    scaled and the output paths of the variant
+
+    :param settings: SheetSettings instance of the base sheet, with the size
+            already calculated
+    :param float scale:
+    :return: SheetSettings instance
+    """
+    scaled = copy.copy(settings)
+    scaled.size = Vector2(_scale(settings.size.x, scale),
+                          _scale(settings.size.y, scale))
+
+    # sheets packed in memory have no paths
+    if settings.output_sheet_path is not None:
+        scaled.output_sheet_path = get_variant_path(
+                settings.output_sheet_path, scale)
+
+    if isinstance(settings.output_coordinates_path, str):
+        scaled.output_coordinates_path = get_variant_path(
+                settings.output_coordinates_path, scale)
+    elif settings.output_coordinates_path is not None:
+        scaled.output_coordinates_path = [
+                get_variant_path(p, scale)
+                for p in settings.output_coordinates_path]
+
+    return scaled
+
+
+class ScaledSprite(agglomerate.items.PlacedSprite):
+    """
+    A placed sprite in a scale variant of the sheet.
+
+    Can be given to formats and compositors in place of a placed sprite,
+    the image is resampled from the sprite image when used.
+
+    **Fields**
+    sprite
+        the Sprite instance
+    position
+        Vector2 position in the scaled sheet
+    size
+        Vector2 size in the scaled sheet, can be 0 if the sprite is too small
+    scale
+        scale of the variant
+    """
+    __slots__ = ("size", "scale")
+
+    def __init__(self, placed, scale):
+        """
+        Scales a placed sprite
+
+        :param placed: agglomerate.items.PlacedSprite in the base sheet
+        :param float scale:
+        """
+        x, y = placed.position.to_tuple()
+        w, h = placed.size.to_tuple()
+
+        super().__init__(placed.sprite,
+                         Vector2(_scale(x, scale), _scale(y, scale)))
+        self.size = Vector2(_scale(x + w, scale) - self.position.x,
+                            _scale(y + h, scale) - self.position.y)
+        self.scale = scale
+
+    @property
+    def image(self):
+        """
+        The sprite image resampled to the scaled size, not rotated
+        """
+        size = self.size.to_tuple()
+        if self.sprite.rotated:
+            size = size[::-1]
+
+        image = self.sprite.image
+        if image.size == size:
+            return image
+
+        if image.mode not in ("RGBA", "RGB", "LA", "L"):
+            image = image.convert("RGBA")
+
+        # premultiplied alpha avoids dark borders around transparent pixels
+        if image.mode in ("RGBA", "LA"):
+            premultiplied = image.convert(image.mode[:-1] + "a")
+            return premultiplied.resize(size, RESAMPLING_FILTER) \
+                .convert(image.mode)
+
+        return image.resize(size, RESAMPLING_FILTER)
+
+    def prepare(self, mode):
+        """
+        Returns the pixels of the resampled image, see Sprite.prepare()
+        """
+        return agglomerate.canvas.prepare(self.image, mode)
+
+    @property
+    def mask(self):
+        """
+        The sprite mask scaled, rounding outwards so it still covers every
+        visible pixel
+        """
+        if self.sprite.mask is None:
+            return None
+
+        return [(_scale(x, self.scale), _scale(y, self.scale),
+                 math.ceil((x + w) * self.scale) - _scale(x, self.scale),
+                 math.ceil((y + h) * self.scale) - _scale(y, self.scale))
+                for x, y, w, h in self.sprite.mask]
+
+
+def _scale(value, scale):
+    """
+    Scales a coordinate, rounding down
+    """
+    return math.floor(value * scale)
@@ -17,6 +17,13 @@ class Settings:
     size
         Vector2 that contains size of the generated sprite sheet image,
         values can be "auto"
+    optimize_time
+        seconds to spend searching a better order and orientation of the
+        items to give to the algorithm, see agglomerate.optimize. 0 disables
+        the search
+    algorithm_options
+        dictionary of options specific to the chosen algorithm, see the
+        algorithm documentation. Empty by default
 
     **Allowed dictionary**
     - rotation: True if the user allows the rotation of sprites
@@ -47,6 +54,8 @@ class Settings:
             - "padding": False
 
         - size: both x and y set to auto
+        - optimize_time: 0
+        - algorithm_options: empty dictionary
         """
         self.algorithm = algorithm
 
@@ -63,6 +72,10 @@ class Settings:
 
         self.size = agglomerate.math.Vector2("auto", "auto")
 
+        self.optimize_time = 0
+
+        self.algorithm_options = {}
+
 
     @classmethod
     def from_dict(cls, dictionary):
@@ -84,6 +97,9 @@ class Settings:
         # Vector2 can be initialized from a dict
         s.size = agglomerate.math.Vector2.from_dict(dictionary["size"])
 
+        s.optimize_time = dictionary.get("optimize_time", 0)
+        s.algorithm_options = dictionary.get("algorithm_options", {})
+
         return s
 
 
@@ -98,6 +114,8 @@ class Settings:
             "require": self.require,
             # sheet size is an object, we need to store it also as a dict
             "size": self.size.to_dict(),
+            "optimize_time": self.optimize_time,
+            "algorithm_options": self.algorithm_options,
         }
 
 
@@ -111,7 +129,8 @@ class SheetSettings(Settings):
 
     **Added settings**
     format
-        name of the coordinates file format
+        name of the coordinates file format, or a list of names to generate
+        several coordinates files from the same sheet
     output_sheet_path
         where to save the generated sprite sheet, if no extension is given,
         output_sheet_format is necessary, keep in mind that the saved file
@@ -119,7 +138,9 @@ class SheetSettings(Settings):
     output_coordinates_path
         where to save the generated coordinates file, if no extension is given
         no extension is added automatically, you can add one looking at the
-        format suggested extension
+        format suggested extension. If several formats are given, can be a
+        list with a path for each format, or a single path whose extension is
+        replaced by the suggested extension of each format
     output_sheet_format
         image format used for saving. if None the format will be determined by
         the output_coordinates_path extension, this value is given to Pillow's
@@ -127,6 +148,22 @@ class SheetSettings(Settings):
     output_sheet_color_mode
         color mode used for saving, this argument is given to Pillow's
         Image.new() method, see Pillow documentation for more info
+    output_sheet_memory_map
+        if True, the sheet is stored in a memory mapped file instead of
+        memory while drawing it, for sheets larger than the available memory.
+        Only "RGBA" and "RGB" color modes are supported, and the sheet is
+        written without loading it in memory only for "raw" and "tiff"
+        formats
+    memory_budget
+        maximum size in bytes of the decoded sprites images kept in memory
+        at the same time, the least recently used ones are discarded and
+        decoded again when needed, see agglomerate.imagecache. None means no
+        limit. The sheet itself isn't included
+    output_scales
+        list of scales of extra variants of the sheet, e.g. [2, 0.5]. The
+        layout is calculated once and scaled, see agglomerate.scaling. Each
+        variant is saved next to the sheet and the coordinates files, adding
+        @<scale>x to the paths, e.g. sheet@2x.png
     background_color
         color to use as the background of the sheet
 
@@ -135,6 +172,11 @@ class SheetSettings(Settings):
     - "png"
     - "jpeg" ("jpg" doesn't work)
     - "tiff"
+    - "bc1": DDS file with BC1 (DXT1) compression, sprites are placed in
+      positions multiple of 4 so they never share a compression block
+    - "bc3": DDS file with BC3 (DXT5) compression, also aligned
+    - "raw": headerless pixels in row-major order, only when
+      output_sheet_memory_map is True
 
     **Tested output sheet color modes**
     - "RGBA"
@@ -142,7 +184,10 @@ class SheetSettings(Settings):
     - "CYMK" but messes colors, I don't know how it works
     - "1"
     - "L"
-    - "P" doesn't work, needs more arguments
+    - "P": indexed colors, the sheet is drawn in RGBA and then converted
+      using a palette of at most 256 colors built from every sprite of the
+      pack. If the sprites use 256 colors or less, the palette contains
+      exactly those colors
     """
     def __init__(self, algorithm=None, format=None,
                  output_sheet_path=None, output_coordinates_path=None):
@@ -164,6 +209,9 @@ class SheetSettings(Settings):
 
         - output_sheet_format: None
         - output_sheet_color_mode: "RGBA"
+        - output_sheet_memory_map: False
+        - output_scales: empty list
+        - memory_budget: None
 
         - background_color: transparent (#00000000)
         """
@@ -174,6 +222,9 @@ class SheetSettings(Settings):
 
         self.output_sheet_format = None
         self.output_sheet_color_mode = "RGBA"
+        self.output_sheet_memory_map = False
+        self.output_scales = []
+        self.memory_budget = None
 
         self.background_color = \
                 agglomerate.util.Color.from_hex("#00000000")
@@ -197,6 +248,10 @@ class SheetSettings(Settings):
         s.output_coordinates_path = dictionary["output_coordinates_path"]
         s.output_sheet_format = dictionary["output_sheet_format"]
         s.output_sheet_color_mode = dictionary["output_sheet_color_mode"]
+        s.output_sheet_memory_map = dictionary.get("output_sheet_memory_map",
+                                                   False)
+        s.output_scales = dictionary.get("output_scales", [])
+        s.memory_budget = dictionary.get("memory_budget", None)
         s.allow = dictionary["allow"]
         s.require = dictionary["require"]
 
@@ -204,6 +259,9 @@ class SheetSettings(Settings):
         # Vector2 can be initialized from a dict
         s.size = agglomerate.math.Vector2.from_dict(dictionary["size"])
 
+        s.optimize_time = dictionary.get("optimize_time", 0)
+        s.algorithm_options = dictionary.get("algorithm_options", {})
+
         # background_color is a hex code string, we need a Color instance
         s.background_color = agglomerate.util.Color.from_hex(
                 dictionary["background_color"])
@@ -223,10 +281,15 @@ class SheetSettings(Settings):
             "output_coordinates_path": self.output_coordinates_path,
             "output_sheet_format": self.output_sheet_format,
             "output_sheet_color_mode": self.output_sheet_color_mode,
+            "output_sheet_memory_map": self.output_sheet_memory_map,
+            "output_scales": self.output_scales,
+            "memory_budget": self.memory_budget,
             "allow": self.allow,
             "require": self.require,
             # sheet size is an object, we need to store it also as a dict
             "size": self.size.to_dict(),
+            "optimize_time": self.optimize_time,
+            "algorithm_options": self.algorithm_options,
             # background_color is a object, we need to store it as a hex string
             "background_color": self.background_color.to_hex()
         }
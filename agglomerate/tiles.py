@@ -0,0 +1,151 @@
+import agglomerate.items
+
+import json
+import math
+
+import numpy
+import PIL.Image
+
+
+"""
+Tile sheets for level art and tilemaps made of repeated tiles.
+
+The images are sliced in tiles of a fixed size and only the unique tiles
+are packed, as sprites of their own. Each source image gets a tile map
+telling which tile goes in each place, so it can be rebuilt from the sheet.
+
+The tiles of an image are compared in bulk: every tile is viewed as a
+single opaque value of tile_size * tile_size * 4 bytes and numpy.unique()
+finds the distinct ones, so only the tiles that are unique in the image are
+compared with the tiles of the other images.
+"""
+
+
+def make_tiles(sources, tile_size, skip_empty=True, prefix="tile_"):
+    """
+    Slices the images in tiles and returns the unique ones and the tile map
+    of each image.
+
+    Images whose size isn't a multiple of the tile size are padded with
+    transparent pixels at the right and bottom.
+
+    :param list sources: sprites (or objects with name and image fields) to
+            slice, e.g. agglomerate.items.Sprite instances
+    :param int tile_size: side of the tiles in pixels
+    :param bool skip_empty: if True, fully transparent tiles aren't packed
+            and have the index -1 in the maps
+    :param str prefix: names of the tiles are the prefix and the tile index
+    :return: tuple containing a list of agglomerate.items.Sprite with the
+            unique tiles, and a list of TileMap, one for each source
+    """
+    if tile_size < 1:
+        raise ValueError("The tile size must be positive")
+
+    tiles = []
+    # index of each unique tile by its bytes
+    indices = {}
+    maps = []
+
+    for source in sources:
+        pixels = _get_tiles(source.image, tile_size)
+        rows, columns = pixels.shape[:2]
+        pixels = pixels.reshape(rows * columns, -1)
+
+        # the same tiles in this image, compared at once
+        unique, inverse = numpy.unique(
+                pixels.view(numpy.dtype((numpy.void, pixels.shape[1]))),
+                return_inverse=True)
+
+        unique_indices = numpy.empty(len(unique), numpy.int32)
+        for k, tile in enumerate(unique.view(numpy.uint8)
+                                 .reshape(len(unique), -1)):
+            if skip_empty and not tile[3::4].any():
+                unique_indices[k] = -1
+                continue
+
+            key = tile.tobytes()
+            index = indices.get(key)
+            if index is None:
+                index = len(tiles)
+                indices[key] = index
+                image = PIL.Image.fromarray(
+                        tile.reshape(tile_size, tile_size, 4), "RGBA")
+                tiles.append(agglomerate.items.Sprite.from_image(
+                        image, prefix + str(index)))
+            unique_indices[k] = index
+
+        maps.append(TileMap(source.name, tile_size,
+                            unique_indices[inverse.reshape(-1)]
+                            .reshape(rows, columns)))
+
+    return tiles, maps
+
+
+def save_maps(maps, tiles, path):
+    """
+    Saves the tile maps to a JSON file, with the names of the tiles so the
+    indices can be found in the coordinates file.
+
+    :param list maps: list of TileMap
+    :param list tiles: list of tile sprites, as returned by make_tiles()
+    :param str path: where to save the file
+    """
+    data = {
+        "tiles": [t.name for t in tiles],
+        "images": [m.to_dict() for m in maps],
+    }
+
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+class TileMap:
+    """
+    The tiles that make up a source image
+
+    **Fields**
+    name
+        name of the source image
+    tile_size
+        side of the tiles in pixels
+    indices
+        int32 array of shape (rows, columns) with the index of the tile in
+        each place, -1 for empty tiles that weren't packed
+    """
+    def __init__(self, name, tile_size, indices):
+        self.name = name
+        self.tile_size = tile_size
+        self.indices = indices
+
+    def to_dict(self):
+        """
+        Returns a dictionary with the name, tile size, rows, columns and the
+        indices as a list of rows
+        """
+        return {
+            "name": self.name,
+            "tile_size": self.tile_size,
+            "rows": self.indices.shape[0],
+            "columns": self.indices.shape[1],
+            "indices": self.indices.tolist(),
+        }
+
+
+def _get_tiles(image, tile_size):
+    """
+    Returns the RGBA pixels of the image as an array of tiles of shape
+    (rows, columns, tile_size, tile_size, 4)
+    """
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    rows = math.ceil(image.height / tile_size)
+    columns = math.ceil(image.width / tile_size)
+
+    pixels = numpy.zeros((rows * tile_size, columns * tile_size, 4),
+                         numpy.uint8)
+    pixels[:image.height, :image.width] = numpy.asarray(image)
+
+    return numpy.ascontiguousarray(
+            pixels.reshape(rows, tile_size, columns, tile_size, 4)
+            .swapaxes(1, 2))
@@ -1,17 +1,27 @@
 from __future__ import print_function
 
 import agglomerate
+import agglomerate.compression
+import agglomerate.events
+import agglomerate.layoutcache
 import agglomerate.packer
+import agglomerate.regions
 import agglomerate.settings
+import agglomerate.tiles
+import agglomerate.update
 import agglomerate.math
 import agglomerate.format
 import agglomerate.util
+import agglomerate.validation
 
 import argparse
+import itertools
 import json
 import os
 import sys
 
+import PIL.Image
+
 
 """
 Commandline interface for the packer.
@@ -39,12 +49,30 @@ def main():
     parser_pack = subparsers.add_parser("pack",
             help="pack from commandline arguments")
 
-    parser_pack.add_argument("-i", "--images", nargs="+",
-            help="create from paths to images, can use wildcards")
+    parser_pack.add_argument("-i", "--images", nargs="+", default=[],
+            help=("create from paths to images, can use wildcards and ** to "
+                  "match subdirectories. Images inside zip and tar archives "
+                  "are given as ARCHIVE!/PATH, e.g. assets.zip!/ui/*.png"))
+    parser_pack.add_argument("-I", "--images-from", default=None,
+            metavar="FILE",
+            help=("read paths to images from a file, one per line, use '-' "
+                  "to read them from the standard input. The paths are "
+                  "taken as they are, without wildcards"))
+    parser_pack.add_argument("-S", "--sheet", nargs=2, action="append",
+            default=[], metavar=("SHEET", "COORDINATES"),
+            help=("take the sprites from the regions of a sheet packed "
+                  "before, given with its coordinates file in simplejson "
+                  "format. Can be used several times to merge sheets"))
     parser_pack.add_argument("-a", "--algorithm", default=_default_algorithm,
             help="specify packing algorithm")
-    parser_pack.add_argument("-f", "--format", default=_default_format,
-            help="specify output format for coordinates file")
+    parser_pack.add_argument("-A", "--algorithm-option", nargs="+",
+                             default=[], metavar="KEY=VALUE",
+            help=("options specific to the algorithm, e.g. policy=best_fit "
+                  "for the shelf algorithm"))
+    parser_pack.add_argument("-f", "--format", nargs="+",
+                             default=[_default_format],
+            help=("specify output format for coordinates file, several "
+                  "formats can be given to generate a file for each one"))
     parser_pack.add_argument("-s", "--size", default=_default_size,
             help=("size of the sheet in pixels, no number means auto e.g. "
                   "400x500 or 400x or x100 or auto"))
@@ -57,12 +85,52 @@ def main():
                   "--image-format extension is appended (png by default)"))
     parser_pack.add_argument("-F", "--image-format", default=None,
             help=("image format to use, using given output extension or 'png' "
-                  "by default. Write for example 'png' or '.png'"))
+                  "by default. Write for example 'png' or '.png', use 'bc1' "
+                  "or 'bc3' for block compressed DDS files"))
     parser_pack.add_argument("-c", "--background-color", default="#00000000",
             help=("background color to use, must be a RGB or RGBA hex value, "
                   "for example #FFAA9930 or #112233, transparent by default: "
                   "#00000000"))
 
+    parser_pack.add_argument("-O", "--optimize", type=float, default=0,
+            help=("seconds to spend searching a better order and rotation "
+                  "of the sprites, rotation is used only if allowed"))
+    parser_pack.add_argument("-t", "--tiles", type=int, default=None,
+                             metavar="SIZE",
+            help=("slice the images in tiles of SIZE x SIZE pixels and pack "
+                  "only the unique ones, saving the tile maps of the images "
+                  "to the file given by --tile-maps"))
+    parser_pack.add_argument("-T", "--tile-maps", default="tilemaps.json",
+            help=("where to save the tile maps when using --tiles, "
+                  "'tilemaps.json' by default"))
+    parser_pack.add_argument("-x", "--scales", nargs="+", type=float,
+                             default=[],
+            help=("also save variants of the sheet and coordinates files "
+                  "scaled by the given factors, e.g. 2 0.5 saves "
+                  "sheet@2x.png and sheet@0.5x.png"))
+    parser_pack.add_argument("-M", "--memory-budget", type=float,
+                             default=None, metavar="MIB",
+            help=("maximum size in MiB of the decoded images kept in memory, "
+                  "the least recently used are decoded again when needed"))
+    parser_pack.add_argument("-m", "--memory-map", action="store_true",
+            help=("keep the sheet in a memory mapped file instead of memory, "
+                  "for sheets larger than the available memory, use with "
+                  "'raw' or 'tiff' image formats"))
+    parser_pack.add_argument("-p", "--pipelined", action="store_true",
+            help=("decode, draw and save the sheet at the same time instead "
+                  "of one step after the other"))
+    parser_pack.add_argument("-l", "--layout-only", action="store_true",
+            help=("save only the coordinates file, without decoding the "
+                  "images or generating the sheet"))
+    parser_pack.add_argument("-L", "--layout-cache", default=None,
+            help=("file where calculated layouts are saved, so packing "
+                  "again sprites with the same sizes doesn't run the "
+                  "algorithms"))
+    parser_pack.add_argument("-u", "--update", action="store_true",
+            help=("update the existing output sheet and coordinates file, "
+                  "keeping the sprites that didn't change in their "
+                  "positions and placing only the new or resized ones"))
+
     # parser for "agglomerate new ..."
     parser_new = subparsers.add_parser("new",
             help=("create parameters file, so you can load them with "
@@ -78,43 +146,177 @@ def main():
 
     parser_from.add_argument("path", default="parameters.json",
             help="path to the file to load, 'parameters.json' by default")
+    parser_from.add_argument("-p", "--pipelined", action="store_true",
+            help=("decode, draw and save the sheet at the same time instead "
+                  "of one step after the other"))
+    parser_from.add_argument("-l", "--layout-only", action="store_true",
+            help=("save only the coordinates file, without decoding the "
+                  "images or generating the sheet"))
+    parser_from.add_argument("-L", "--layout-cache", default=None,
+            help=("file where calculated layouts are saved, so packing "
+                  "again sprites with the same sizes doesn't run the "
+                  "algorithms"))
+    parser_from.add_argument("-u", "--update", action="store_true",
+            help=("update the existing output sheet and coordinates file, "
+                  "keeping the sprites that didn't change in their "
+                  "positions and placing only the new or resized ones"))
+
+    # parser for "agglomerate validate ..."
+    parser_validate = subparsers.add_parser("validate",
+            help=("check that the sprites of a coordinates file don't "
+                  "overlap and are inside the sheet"))
+
+    parser_validate.add_argument("coordinates",
+            help="coordinates file to check")
+    parser_validate.add_argument("-f", "--format", default=_default_format,
+            help="format of the coordinates file")
+    parser_validate.add_argument("-S", "--sheet", default=None,
+            help="sheet image, its size is the size of the sheet")
+    parser_validate.add_argument("-s", "--size", default=None,
+            help=("size of the sheet in pixels e.g. 400x500, if no sheet is "
+                  "given"))
 
     # parse and work
     args = parser.parse_args()
 
     if args.subparser == "pack":
         params = _load_parameters_from_arguments(args)
-        agglomerate.packer.pack(params)
+        if args.tiles is not None:
+            # the tiles are packed in place of the images
+            tiles, maps = agglomerate.tiles.make_tiles(params.items,
+                                                       args.tiles)
+            print("{} unique tiles".format(len(tiles)))
+            params.items = tiles
+            _pack(params, args)
+            agglomerate.tiles.save_maps(maps, tiles, args.tile_maps)
+        else:
+            _pack(params, args)
     elif args.subparser == "from":
         params = _load_parameters_from_file(args.path)
-        agglomerate.packer.pack(params)
+        _pack(params, args)
     elif args.subparser == "new":
         _create_parameters_file(args.path)
+    elif args.subparser == "validate":
+        if args.sheet is None and args.size is None:
+            parser_validate.error("the sheet or its size must be given")
+        sys.exit(_validate(args))
+
+
+def _pack(params, args):
+    """
+    Packs or updates the sheet as chosen in the arguments
+
+    :param params: parameters object
+    :param args: args from argparse
+    """
+    if args.update:
+        regions = agglomerate.update.update(params,
+                                            observer=_ProgressPrinter())
+        print("Repainted {} regions".format(len(regions)))
+    else:
+        agglomerate.packer.pack(params, args.pipelined, args.layout_only,
+                                _get_layout_cache(args), _ProgressPrinter())
+
+
+def _validate(args):
+    """
+    Checks the layout of a coordinates file and prints the problems found
+
+    :param args: args from argparse, with the sheet or its size
+    :return: exit status, 1 if the layout is invalid
+    """
+    if args.sheet is not None:
+        with PIL.Image.open(args.sheet) as image:
+            size = agglomerate.math.Vector2.from_tuple(image.size)
+    else:
+        size = _parse_size(args.size)
+
+    with open(args.coordinates) as f:
+        entries = agglomerate.format.get_format(args.format).parse(f.read())
+
+    items = []
+    for e in entries:
+        item = agglomerate.Item(agglomerate.math.Vector2(e["x"], e["y"]),
+                                agglomerate.math.Vector2(e["w"], e["h"]))
+        item.type = "sprite"
+        item.name = e["name"]
+        item.mask = e.get("mask")
+        items.append(item)
+
+    settings = agglomerate.Settings()
+    settings.size = size
+
+    # sprites with masks can overlap, but their masks can't
+    problems = agglomerate.validation.find_problems(
+            items, settings, any(i.mask is not None for i in items))
+
+    for p in problems:
+        print(p)
+    print("{} sprites, {} problems".format(len(items), len(problems)))
+
+    return 1 if problems else 0
+
+
+class _ProgressPrinter(agglomerate.events.Observer):
+    """
+    Prints how long each phase of the pack took
+    """
+    def notify(self, event):
+        if event.type == agglomerate.events.PHASE_FINISHED:
+            target = ""
+            if event.target is not None:
+                target = " " + event.target
+
+            print("Finished {}{} in {:.2f} s".format(event.phase, target,
+                                                    event.elapsed))
+
+
+def _get_layout_cache(args):
+    """
+    Returns the layout cache chosen in the arguments, or None
+
+    :param args: args from argparse
+    """
+    if args.layout_cache is None:
+        return None
+
+    return agglomerate.layoutcache.LayoutCache(args.layout_cache)
 
 
 def _load_parameters_from_arguments(args):
     """
     Loads the parameters from the commandline arguments.
 
+    The items are a generator, the paths are matched and the list of
+    images is read when the packer asks for the sprites, so the first
+    sprites can be decoded while the next ones are read.
+
     :param args: args from argparse
     :return: parameters instance ready for packing
     """
 
-    # sprite paths list
-    sprites_paths = args.images
-
     # parse the items to pack, we don't need groups here
-    items = []
-    for s in sprites_paths:
-        sprites_paths = agglomerate.util.get_matching_paths(i)
-        for p in sprites_paths:
-            items.append(agglomerate.Sprite(p))
+    loaded = set()
+    sources = [_load_sprites(args.images, agglomerate.util.DirectoryCache(),
+                             loaded)]
+    if args.images_from is not None:
+        sources.append(_load_sprites_from_list(args.images_from, loaded))
+    sources.extend(_load_regions(sheet, coordinates)
+                   for sheet, coordinates in args.sheet)
+    items = itertools.chain.from_iterable(sources)
 
     # create transitory settings
     settings = agglomerate.SheetSettings(args.algorithm, args.format)
     settings.output_sheet_path = args.output[0]
     settings.output_coordinates_path = args.output[1]
     settings.output_sheet_format = args.image_format
+    settings.output_sheet_memory_map = args.memory_map
+    settings.output_scales = args.scales
+    if args.memory_budget is not None:
+        settings.memory_budget = int(args.memory_budget * 2 ** 20)
+    settings.optimize_time = args.optimize
+    settings.algorithm_options = _parse_algorithm_options(
+            args.algorithm_option)
     # the _process_parameters method will parse the string into a Color
     settings.background_color = args.background_color
     # the _process_parameters method will parse it later into a Vector2
@@ -126,20 +328,43 @@ def _load_parameters_from_arguments(args):
     return _process_parameters_settings(params)
 
 
+def _parse_algorithm_options(options):
+    """
+    Parses the algorithm options given as KEY=VALUE strings into a
+    dictionary. Values are parsed as JSON if possible, as strings otherwise
+
+    :param list options: list of strings
+    :return: dictionary
+    """
+    result = {}
+    for o in options:
+        key, separator, value = o.partition("=")
+        if not separator:
+            raise ValueError("Algorithm options must be KEY=VALUE, got " + o)
+        try:
+            result[key] = json.loads(value)
+        except ValueError:
+            result[key] = value
+
+    return result
+
+
 def _load_parameters_from_file(path):
     """
     Loads the parameters from a json file.
 
+    The file is parsed incrementally and the sprites are created while
+    reading it, so the text of the file is never whole in memory. The
+    sprites themselves are kept in the groups, because the settings of a
+    group can come after its items.
+
     :param path: path to parameters file
     :return: parameters instance ready for packing
     """
-    # Read json
     with open(path, "r") as f:
-        json_string = f.read()
-
-    root = json.loads(json_string)
-
-    params = _parse_group(root, True)
+        reader = agglomerate.util.JSONReader(f)
+        params = _parse_group(reader, True,
+                              agglomerate.util.DirectoryCache(), set())
 
     return _process_parameters_settings(params)
 
@@ -158,12 +383,18 @@ def _process_parameters_settings(params):
         - output_sheet_path: We add a extension if none given, the extension
                 given is the output_sheet_format, or "png" of none given
         - output_coordinates_path: We add the recommended extension by the
-                format if no extension is given
+                format if no extension is given, if several formats are given
+                we create a path for each one
     """
+    # a list containing a single format is the same as giving only the name
+    if isinstance(params.settings.format, list) and \
+            len(params.settings.format) == 1:
+        params.settings.format = params.settings.format[0]
+
     # the color given by the user is a string, we need to create the Color
     # instance
     if isinstance(params.settings.background_color, str):
-        params.settings.background_color = agglomerate.utils. \
+        params.settings.background_color = agglomerate.util. \
                 Color.from_hex(params.settings.background_color)
 
     # the size given by the user is a string, we need to create the Vector2
@@ -183,18 +414,35 @@ def _process_parameters_settings(params):
             # set image format to png
             params.settings.output_sheet_format = "png"
 
-        # add extension to output_sheet_path
-        params.settings.output_sheet_path += \
-                "." + params.settings.output_sheet_format
+        # add extension to output_sheet_path, block compressed formats are
+        # saved as DDS files
+        if agglomerate.compression.is_block_format(
+                params.settings.output_sheet_format):
+            params.settings.output_sheet_path += \
+                    "." + agglomerate.compression.suggested_extension
+        else:
+            params.settings.output_sheet_path += \
+                    "." + params.settings.output_sheet_format
+
+    if isinstance(params.settings.format, list):
+        # if several formats are given and only one path, create a path for
+        # each format using their suggested extensions
+        if isinstance(params.settings.output_coordinates_path, str):
+            root = os.path.splitext(
+                    params.settings.output_coordinates_path)[0]
+            params.settings.output_coordinates_path = [
+                    root + "." + agglomerate.format.get_format(f)
+                    .suggested_extension
+                    for f in params.settings.format]
 
     # if output_coordinates_path doesn't have extension
-    if os.path.splitext(params.settings.output_coordinates_path)[1] == "":
+    elif os.path.splitext(params.settings.output_coordinates_path)[1] == "":
         # add the suggested extension by the format
         chosen_format = \
                 agglomerate.format.get_format(params.settings.format)
 
         params.settings.output_coordinates_path += \
-                "." + params.chosen_format.suggested_extension
+                "." + chosen_format.suggested_extension
 
     return params
 
@@ -269,9 +517,70 @@ def _parse_size(string):
             return agglomerate.math.Vector2(x, y)
 
 
-def _parse_group(dictionary, is_params):
+def _load_sprites(patterns, cache, loaded):
     """
-    Takes a dictionary that represents a group (or a parameters object) and
+    Creates the sprites from the files matched by the given paths, which can
+    use wildcards. Files already loaded are skipped, so a file matched by
+    several paths results in only one sprite.
+
+    The sprites are created one by one as they are consumed.
+
+    :param list patterns: paths to images, can use wildcards
+    :param cache: agglomerate.util.DirectoryCache used to match the paths
+    :param set loaded: normalized paths of the files already loaded, the new
+            ones are added
+    :return: generator of sprites
+    """
+    for pattern in patterns:
+        for p in agglomerate.util.get_matching_paths(pattern, cache):
+            normalized = os.path.normpath(p)
+            if normalized not in loaded:
+                loaded.add(normalized)
+                yield agglomerate.Sprite(p)
+
+
+def _load_regions(sheet, coordinates):
+    """
+    Creates the sprites from the regions of a sheet when the first one is
+    consumed, see agglomerate.regions.load_regions()
+
+    :return: generator of sprites
+    """
+    yield from agglomerate.regions.load_regions(sheet, coordinates)
+
+
+def _load_sprites_from_list(path, loaded):
+    """
+    Creates the sprites from the paths listed in a file, one per line,
+    without wildcards. Empty lines and files already loaded are skipped.
+
+    The file is read line by line as the sprites are consumed.
+
+    :param str path: file with the list, "-" means the standard input
+    :param set loaded: normalized paths of the files already loaded, the new
+            ones are added
+    :return: generator of sprites
+    """
+    f = sys.stdin if path == "-" else open(path, "r")
+
+    try:
+        for line in f:
+            p = line.rstrip("\r\n")
+            if p == "":
+                continue
+
+            normalized = os.path.normpath(p)
+            if normalized not in loaded:
+                loaded.add(normalized)
+                yield agglomerate.Sprite(p)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _parse_group(reader, is_params, cache, loaded):
+    """
+    Reads a dictionary that represents a group (or a parameters object) and
     returns a group/parameters instance, parsing child groups recursively.
 
     The structure of a parameters dictionary is as follows::
@@ -290,20 +599,30 @@ def _parse_group(dictionary, is_params):
         |
                 └─ settings
 
-    :param dict dictionary: dictionary that represents the group
+    Files matched by several paths are loaded only once, in the first group
+    that matches them.
+
+    :param reader: agglomerate.util.JSONReader placed before the dictionary
     :param bool is_params: True if the group is a parameters group
+    :param cache: agglomerate.util.DirectoryCache shared by every group
+    :param set loaded: normalized paths of the files already loaded
     :return: Group or Parameters instance
     """
-    raw_items = dictionary["items"]
     items = []
-    for i in raw_items:
-        if isinstance(i, str): # means that i is a sprite path
-            sprites_paths = agglomerate.util.get_matching_paths(i)
-            for p in sprites_paths:
-                items.append(agglomerate.Sprite(p))
-
-        else: # means that i is a dictionary i.e. a group
-            items.append(_parse_group(i, False))
+    dictionary = {}
+
+    for key in reader.object():
+        if key == "items":
+            # the items are parsed one by one, without reading the whole list
+            for __ in reader.array():
+                if reader.peek() == "{": # means that i is a group
+                    items.append(_parse_group(reader, False, cache, loaded))
+
+                else: # means that i is a sprite path
+                    items.extend(_load_sprites([reader.value()], cache,
+                                               loaded))
+        else:
+            dictionary[key] = reader.value()
 
     settings_dict = dictionary["settings"]
 
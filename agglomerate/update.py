@@ -0,0 +1,466 @@
+import agglomerate.algorithm
+import agglomerate.archives
+import agglomerate.compression
+import agglomerate.events
+import agglomerate.packer
+import agglomerate.palette
+from agglomerate.math import Vector2
+
+import os
+
+import PIL.Image
+
+
+"""
+Updates of sheets packed before, keeping the sprites where they were.
+
+The previous sheet and its coordinates file are read back. Sprites with the
+same name and size as before stay in their positions, and only new or
+resized sprites are placed, in the space left free by the others. The
+sheet is repainted only where something changed: regions of removed or
+moved sprites are cleared and the sprites that are new, moved or whose
+image file was modified after the previous sheet are drawn again.
+
+Since the sprites that didn't change keep their positions, the differences
+between the previous and the updated sheet are small and can be shipped as
+patches.
+
+The free space is kept as the list of maximal free rectangles of the sheet
+(MaxRects), new sprites are placed in the rectangle where they fit best. If
+a sprite doesn't fit and the sheet size is "auto", the sheet grows.
+
+If the previous sheet or its coordinates file is missing or can't be read,
+there is nothing to keep and the sheet is packed from scratch.
+"""
+
+
+def update(params, previous_sheet_path=None, previous_coordinates_path=None,
+           observer=None):
+    """
+    Updates a sheet packed before with the sprites in the parameters, and
+    saves the sheet and the coordinates files according to settings.
+
+    The previous coordinates are read with the first format of the settings,
+    which must implement Format.parse(). By default the previous files are
+    the output files of the settings, so they are updated in place. If they
+    are missing or can't be read, the sheet is packed like pack() does.
+
+    The algorithm of the settings isn't used. Groups, scale variants,
+    memory mapped sheets and sheets packed by masks aren't supported.
+
+    Block compressed sheets are decoded and compressed again, so the
+    regions that didn't change can lose some quality.
+
+    Like pack(), the sizes given in the settings are restored after
+    updating, and the observer is notified of the progress and can cancel
+    the update.
+
+    :param params: parameters object
+    :param str previous_sheet_path: sheet to update, the output sheet path
+            by default
+    :param str previous_coordinates_path: coordinates file of the sheet to
+            update, the path of the first format by default
+    :param observer: agglomerate.events.Observer instance
+    :return: list of (x, y, width, height) tuples, the regions of the sheet
+            that were repainted, the whole sheet if it was packed again
+    """
+    agglomerate.packer._read_items(params)
+    with agglomerate.packer._keeping_sizes(params), \
+            agglomerate.packer._budget(params):
+        return _update(params, previous_sheet_path,
+                       previous_coordinates_path, observer)
+
+
+def _update(params, previous_sheet_path, previous_coordinates_path,
+            observer):
+    """
+    Updates the sheet and returns the repainted regions, see update()
+    """
+    settings = params.settings
+
+    formats = agglomerate.packer._get_formats(settings)
+    agglomerate.packer._check_formats(formats, settings)
+
+    if any(i.type == "group" for i in params.items):
+        raise ValueError("Sheets with groups can't be updated")
+    if settings.output_sheet_memory_map:
+        raise ValueError("Memory mapped sheets can't be updated")
+    if agglomerate.packer._get_scales(settings):
+        raise ValueError("Sheets with scale variants can't be updated")
+
+    if previous_sheet_path is None:
+        previous_sheet_path = settings.output_sheet_path
+    if previous_coordinates_path is None:
+        previous_coordinates_path = formats[0][2]
+
+    try:
+        with open(previous_coordinates_path) as f:
+            previous = formats[0][1].parse(f.read())
+        with PIL.Image.open(previous_sheet_path) as image:
+            previous_sheet = image.convert(
+                    agglomerate.packer._get_drawing_mode(settings))
+        # sprites whose files were modified after this time are repainted
+        sheet_time = os.path.getmtime(previous_sheet_path)
+    except (OSError, ValueError, KeyError):
+        # nothing to keep, the whole sheet is packed
+        agglomerate.packer._pack(params, None, False, None, observer)
+        return [(0, 0, settings.size.x, settings.size.y)]
+
+    # clearing a sprite packed by masks would clear the sprites nested in it
+    if any(p.get("mask") is not None for p in previous):
+        raise ValueError("Sheets packed by masks can't be updated")
+
+    with agglomerate.events.phase(observer, agglomerate.events.PACKING):
+        changes = _place(params.items, previous, previous_sheet.size,
+                         sheet_time, settings)
+        agglomerate.events.notify(
+                observer, agglomerate.events.SPRITES_PLACED,
+                agglomerate.events.PACKING, len(changes.placed))
+
+    sprites = agglomerate.packer.flatten(params)
+
+    palette = None
+    if settings.output_sheet_color_mode == "P":
+        # the colors of the previous sheet and of the sprites drawn again
+        palette = agglomerate.palette.build_palette(
+                [previous_sheet] + [s.image for s in changes.drawn],
+                [settings.background_color.to_tuple()])
+
+    sheet = _repaint(previous_sheet, changes, settings, observer)
+    agglomerate.packer._save_sheet(sheet, settings, palette, observer)
+
+    with agglomerate.events.phase(observer, agglomerate.events.COORDINATES):
+        for __, format, path in formats:
+            agglomerate.packer._save_coordinates(
+                    format.generate(sprites, settings), path, observer)
+
+    return changes.regions
+
+
+class _Changes:
+    """
+    What changed in the sheet
+
+    **Fields**
+    placed
+        sprites placed in new positions
+    drawn
+        sprites that must be drawn, the placed ones and the ones modified
+        after the previous sheet
+    cleared
+        (x, y, width, height) of the regions to clear, left by removed or
+        moved sprites
+    regions
+        (x, y, width, height) of every repainted region
+    """
+    def __init__(self):
+        self.placed = []
+        self.drawn = []
+        self.cleared = []
+        self.regions = []
+
+
+def _place(sprites, previous, previous_size, sheet_time, settings):
+    """
+    Keeps the sprites that didn't change in their previous positions and
+    places the others in the free space, growing the sheet if needed.
+
+    Sets the sprites positions and the settings size.
+
+    :param list sprites: sprites to place
+    :param list previous: result of Format.parse() of the previous
+            coordinates
+    :param tuple previous_size: (width, height) of the previous sheet
+    :param float sheet_time: modification time of the previous sheet
+    :param settings: SheetSettings object
+    :return: _Changes instance
+    """
+    changes = _Changes()
+
+    # the sheet keeps the previous size unless a larger one is given
+    size = [p if s == "auto" else s
+            for s, p in zip(settings.size.to_tuple(), previous_size)]
+    if size[0] < previous_size[0] or size[1] < previous_size[1]:
+        raise ValueError("The sheet can't be smaller than the previous one")
+
+    # block compressed sheets can have any size, but the free space must
+    # start at the compression blocks
+    aligned = agglomerate.compression.is_block_format(
+            settings.output_sheet_format)
+    if aligned:
+        size = [agglomerate.compression.align(v) for v in size]
+
+    # previous placements by name, removed when kept so a name is kept once
+    remaining = {}
+    for p in previous:
+        remaining.setdefault(p["name"], p)
+
+    # keep the sprites with the same name and size in their positions
+    kept = []
+    pending = []
+    for s in sprites:
+        # updated sheets aren't packed by masks, see update()
+        s.mask = None
+
+        # the size as the sprite was created, before any rotation
+        w, h = s.size.to_tuple()
+        if s.rotated:
+            w, h = h, w
+
+        p = remaining.get(s.name)
+        if p is None or (w, h) != ((p["h"], p["w"]) if p["rotated"]
+                                   else (p["w"], p["h"])):
+            s.rotated = False
+            s.size = Vector2(w, h)
+            pending.append(s)
+            continue
+
+        del remaining[s.name]
+        s.rotated = p["rotated"]
+        s.size = Vector2(p["w"], p["h"])
+        s.position = Vector2(p["x"], p["y"])
+        kept.append(s)
+
+        if s.path is None or \
+                agglomerate.archives.get_mtime(s.path) > sheet_time:
+            changes.drawn.append(s)
+
+    free = _FreeRectangles(*previous_size)
+    free.grow(*size)
+
+    # from top to bottom, so the free space stays simple while it's split
+    kept.sort(key=lambda s: (s.position.y, s.position.x))
+    for s in kept:
+        free.occupy(s.position.x, s.position.y, *_get_size(s, aligned))
+
+    # regions of the sprites not kept are cleared
+    changes.cleared = [(p["x"], p["y"], p["w"], p["h"])
+                       for p in remaining.values()]
+
+    # place the new ones from the largest, like the algorithms do
+    pending.sort(key=lambda s: (s.size.y, s.size.x), reverse=True)
+
+    for s in pending:
+        w, h = _get_size(s, aligned)
+        position = free.find(w, h)
+
+        while position is None:
+            _grow(free, w, h, settings, aligned)
+            position = free.find(w, h)
+
+        s.position = Vector2(*position)
+        free.occupy(position[0], position[1], w, h)
+        changes.placed.append(s)
+        changes.drawn.append(s)
+
+    settings.size = Vector2(free.width, free.height)
+
+    changes.regions = changes.cleared + [
+            (s.position.x, s.position.y, s.size.x, s.size.y)
+            for s in changes.drawn]
+
+    return changes
+
+
+def _get_size(sprite, aligned):
+    """
+    Returns the (width, height) used by the sprite in the sheet, rounded up
+    to the compression blocks if aligned is True
+    """
+    w, h = sprite.size.to_tuple()
+    if aligned:
+        return (agglomerate.compression.align(w),
+                agglomerate.compression.align(h))
+    return (w, h)
+
+
+def _grow(free, w, h, settings, aligned):
+    """
+    Makes the sheet larger so a sprite of the given size can fit, only the
+    sides with "auto" size can grow.
+
+    The side that keeps the sheet closer to a square grows, the new size
+    keeps the square and power of two requirements of the settings.
+
+    :raises agglomerate.algorithm.AlgorithmOutOfSpaceException: if the sheet
+            can't grow
+    """
+    can_grow_x = settings.size.x == "auto"
+    can_grow_y = settings.size.y == "auto"
+
+    width, height = free.width, free.height
+
+    if w > width and not can_grow_x or h > height and not can_grow_y or \
+            not can_grow_x and not can_grow_y:
+        raise agglomerate.algorithm.AlgorithmOutOfSpaceException(
+                "The sprites don't fit in the given size")
+
+    if w > width or h > height:
+        width, height = max(width, w), max(height, h)
+    elif can_grow_x and (not can_grow_y or width + w <= height + h):
+        width += w
+    else:
+        height += h
+
+    if settings.require["power_of_two_size"]:
+        width, height = _next_power_of_two(width), _next_power_of_two(height)
+    if settings.require["square_size"]:
+        width = height = max(width, height)
+    if aligned:
+        width = agglomerate.compression.align(width)
+        height = agglomerate.compression.align(height)
+
+    free.grow(width, height)
+
+
+def _next_power_of_two(value):
+    """
+    Returns the smallest power of two greater than or equal to the value
+    """
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def _repaint(previous_sheet, changes, settings, observer):
+    """
+    Returns the updated sheet: the previous one, clearing the regions left
+    by removed sprites and drawing the changed sprites
+
+    :param previous_sheet: PIL image in the drawing mode
+    :param changes: _Changes instance
+    :param settings: SheetSettings object with the updated size
+    """
+    path = settings.output_sheet_path
+    mode = agglomerate.packer._get_drawing_mode(settings)
+    background = settings.background_color.to_tuple()
+
+    sheet = agglomerate.packer._new_sheet(settings)
+
+    try:
+        with agglomerate.events.phase(observer, agglomerate.events.DRAWING,
+                                      path):
+            sheet.paste(previous_sheet, (0, 0))
+
+            # the regions of the sprites drawn again are cleared too, their
+            # images can have transparent pixels
+            for x, y, w, h in changes.cleared + [
+                    (s.position.x, s.position.y, s.size.x, s.size.y)
+                    for s in changes.drawn]:
+                sheet.paste(PIL.Image.new(mode, (w, h), background), (x, y))
+
+            for s in changes.drawn:
+                agglomerate.packer._paste_sprite(sheet, s)
+                agglomerate.events.notify(
+                        observer, agglomerate.events.SPRITES_DRAWN,
+                        agglomerate.events.DRAWING, 1, path)
+    except:
+        sheet.close()
+        raise
+
+    return sheet
+
+
+# -----------------------------------------------------------------------------
+# Free space
+# -----------------------------------------------------------------------------
+
+
+class _FreeRectangles:
+    """
+    Free space of a sheet as the list of maximal free rectangles, they can
+    overlap each other. Every rectangle is a (x, y, right, bottom) tuple.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rectangles = []
+        self._add((0, 0, width, height))
+
+    def find(self, w, h):
+        """
+        Returns the (x, y) position where a rectangle of the given size fits
+        best, leaving the shortest side left over as small as possible, or
+        None if it doesn't fit anywhere
+        """
+        best = None
+        best_score = None
+
+        for x, y, right, bottom in self.rectangles:
+            free_w = right - x
+            free_h = bottom - y
+            if free_w >= w and free_h >= h:
+                score = (min(free_w - w, free_h - h),
+                         max(free_w - w, free_h - h), y, x)
+                if best_score is None or score < best_score:
+                    best, best_score = (x, y), score
+
+        return best
+
+    def occupy(self, x, y, w, h):
+        """
+        Removes a rectangle from the free space, splitting the free
+        rectangles that intersect it
+        """
+        right, bottom = x + w, y + h
+        kept = []
+        split = []
+
+        for r in self.rectangles:
+            rx, ry, rright, rbottom = r
+            if rx >= right or rright <= x or ry >= bottom or rbottom <= y:
+                kept.append(r)
+                continue
+
+            # the parts of the free rectangle around the occupied one
+            if rx < x:
+                split.append((rx, ry, x, rbottom))
+            if rright > right:
+                split.append((right, ry, rright, rbottom))
+            if ry < y:
+                split.append((rx, ry, rright, y))
+            if rbottom > bottom:
+                split.append((rx, bottom, rright, rbottom))
+
+        # only the new rectangles can be contained in others
+        self.rectangles = kept
+        for r in split:
+            self._add(r)
+
+    def grow(self, width, height):
+        """
+        Makes the free space larger, extending the rectangles that touch the
+        right and bottom borders
+        """
+        rectangles = []
+        for x, y, right, bottom in self.rectangles:
+            if right == self.width:
+                right = width
+            if bottom == self.height:
+                bottom = height
+            rectangles.append((x, y, right, bottom))
+
+        self.rectangles = rectangles
+        if width > self.width:
+            self._add((self.width, 0, width, height))
+        if height > self.height:
+            self._add((0, self.height, width, height))
+
+        self.width = width
+        self.height = height
+
+    def _add(self, rectangle):
+        """
+        Adds a free rectangle unless another one contains it, removing the
+        ones it contains
+        """
+        x, y, right, bottom = rectangle
+
+        for rx, ry, rright, rbottom in self.rectangles:
+            if rx <= x and ry <= y and rright >= right and rbottom >= bottom:
+                return
+
+        self.rectangles = [
+                (rx, ry, rright, rbottom)
+                for rx, ry, rright, rbottom in self.rectangles
+                if not (x <= rx and y <= ry and right >= rright and
+                        bottom >= rbottom)]
+        self.rectangles.append(rectangle)
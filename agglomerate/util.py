@@ -1,35 +1,358 @@
+import agglomerate.archives
 import os
+import posixpath
 import fnmatch
+import json
+import re
 import PIL
 
 
-def get_matching_paths(path):
+def get_matching_paths(path, cache=None):
     """
     Returns a list of paths that were matched by the given path. e.g. *.png
 
-    Supports unix style wildcards, e.g. file_*, sprites/*.png or ./f.png
+    Supports unix style wildcards, e.g. file_*, sprites/*.png or ./f.png, in
+    any component of the path. A "**" component matches any amount of
+    directories, e.g. sprites/**/*.png matches png files in sprites and in
+    its subdirectories. Like in shells, "**" doesn't enter symbolic links to
+    directories, so links that loop back are matched once
+
+    Files inside zip and tar archives are matched too, e.g.
+    assets.zip!/ui/*.png, see agglomerate.archives
 
     Adds ./ at the beggining of the path if given path doesn't have
     directory
 
+    Only files are returned, sorted by path inside each directory
+
     :param str path:
+    :param cache: DirectoryCache instance to use, so directories already
+            listed aren't listed again, a new one is used if not given
     :return: list of matching file paths
     :rtype: list of str
     """
-    directory = os.path.dirname(path)
+    if cache is None:
+        cache = DirectoryCache()
+
+    split = agglomerate.archives.split_path(path)
+    if split is not None:
+        return _get_matching_members(split[0], split[1], cache)
+
+    directory, pattern = os.path.split(path)
     if directory == "":
         directory = "./"
-    pattern = os.path.basename(path)
-    # Files in given directory
-    available_files = os.listdir(directory)
-    # Files matched
+
+    # absolute paths start from the root directory
+    drive, directory = os.path.splitdrive(directory)
+    base = drive + os.sep if os.path.isabs(directory) else drive
+
+    parts = [p for p in directory.split(os.sep) if p != ""]
+    if os.altsep:
+        parts = [q for p in parts for q in p.split(os.altsep) if q != ""]
+    parts.append(pattern)
+
+    # start matching from the first directory with wildcards
+    while len(parts) > 1 and not _has_wildcards(parts[0]):
+        base = os.path.join(base, parts.pop(0))
+
+    if base == "":
+        base = "./"
+
+    files = []
+    _match(base, parts, cache, files)
+
+    # "**" can match the same file more than once, remove duplicates
+    # keeping the order
+    return list(dict.fromkeys(files))
+
+
+def _get_matching_members(archive_path, member_path, cache):
+    """
+    Helper function for get_matching_paths(). Returns the paths of the
+    members of the matching archives that match the member path
+    """
+    parts = [p for p in member_path.split("/") if p not in ("", ".")]
+    if not parts:
+        return []
+
     files = []
+    for a in get_matching_paths(archive_path, cache):
+        members = []
+        _match(".", parts, agglomerate.archives.get_archive(a), members)
+        files.extend(agglomerate.archives.join_path(
+                         a, posixpath.normpath(m.replace(os.sep, "/")))
+                     for m in members)
+
+    return list(dict.fromkeys(files))
+
+
+def _has_wildcards(pattern):
+    """
+    Returns True if the pattern contains unix style wildcards
+    """
+    return any(c in pattern for c in "*?[")
+
+
+def _match(base, parts, cache, files):
+    """
+    Helper function for get_matching_paths(). Appends to files the paths
+    inside the base directory that match the remaining path components,
+    recursively.
+
+    :param str base: directory where the remaining components are matched
+    :param list parts: remaining path components, the last one is the file
+            name pattern
+    :param cache: DirectoryCache instance
+    :param list files: list where matched files are appended
+    """
+    part, rest = parts[0], parts[1:]
+
+    if part == "**":
+        # "**" matching zero directories
+        if rest:
+            _match(base, rest, cache, files)
+        # "**" matching one or more directories
+        for name, is_dir in cache.list(base):
+            path = os.path.join(base, name)
+            if is_dir:
+                if not cache.is_link(base, name):
+                    _match(path, parts, cache, files)
+            elif not rest:
+                files.append(path)
+        return
+
+    # names without wildcards are looked up instead of compared with every
+    # entry, so long lists of plain paths are matched quickly
+    if not _has_wildcards(part):
+        is_dir = cache.find(base, part)
+        path = os.path.join(base, part)
+        if is_dir is None:
+            return
+        if rest:
+            if is_dir:
+                _match(path, rest, cache, files)
+        elif not is_dir:
+            files.append(path)
+        return
+
+    for name, is_dir in cache.list(base):
+        if not fnmatch.fnmatch(name, part):
+            continue
+
+        path = os.path.join(base, name)
+        if rest:
+            if is_dir:
+                _match(path, rest, cache, files)
+        elif not is_dir:
+            files.append(path)
+
+
+class DirectoryCache:
+    """
+    Keeps the listings of directories already visited, so many patterns
+    over the same directories list them only once.
+
+    Directories are listed with os.scandir(), which also tells if each entry
+    is a directory or a symbolic link without an extra stat call. A cache
+    should be used only while files aren't being created or deleted, for
+    example during a single run of the packer.
+    """
+    def __init__(self):
+        """
+        Creates an empty cache
+        """
+        self._listings = {}
+        self._entries = {}
+        self._links = {}
+
+    def list(self, directory):
+        """
+        Returns the entries of a directory as a list of (name, is_dir)
+        tuples sorted by name. Directories that don't exist are empty.
+
+        :param str directory:
+        """
+        key = os.path.normpath(directory)
+
+        if key not in self._listings:
+            links = set()
+            try:
+                with os.scandir(directory) as entries:
+                    listing = []
+                    for e in entries:
+                        listing.append((e.name, e.is_dir()))
+                        if e.is_symlink():
+                            links.add(e.name)
+            except (FileNotFoundError, NotADirectoryError):
+                listing = []
+
+            listing.sort()
+            self._listings[key] = listing
+            self._entries[key] = dict(listing)
+            self._links[key] = links
 
-    for f in available_files:
-        if fnmatch.fnmatch(f, pattern):
-            files.append(os.path.join(directory, f))
+        return self._listings[key]
+
+    def find(self, directory, name):
+        """
+        Looks for an entry of a directory
+
+        :param str directory:
+        :param str name: name of the entry
+        :return: True if the entry is a directory, False if it's a file, None
+                if it doesn't exist
+        """
+        self.list(directory)
+        return self._entries[os.path.normpath(directory)].get(name)
+
+    def is_link(self, directory, name):
+        """
+        Tells if an entry of a directory is a symbolic link
+
+        :param str directory:
+        :param str name: name of the entry
+        :return: True if the entry is a symbolic link, False otherwise
+        """
+        self.list(directory)
+        return name in self._links[os.path.normpath(directory)]
+
+
+# whitespace between JSON values
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# characters that can follow a JSON value
+_DELIMITERS = " \t\n\r,:]}"
+
+
+class JSONReader:
+    """
+    Reads a JSON document from a file a piece at a time, so large documents
+    can be parsed without loading them in memory at once.
+
+    Objects and arrays can be walked one element at a time with object()
+    and array(), other values are read whole with value(). peek() tells
+    the type of the next value.
+
+    Example, reading the elements of a huge array::
+
+        reader = JSONReader(f)
+        for __ in reader.array():
+            element = reader.value()
+    """
+    def __init__(self, file, chunk_size=65536):
+        """
+        Creates a reader
+
+        :param file: text file object
+        :param int chunk_size: amount of characters read at a time
+        """
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming
+        it, "{" means an object, "[" an array, etc. Returns "" at the end of
+        the file
+        """
+        while True:
+            self._position = _WHITESPACE.match(self._buffer,
+                                               self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ""
+
+    def value(self):
+        """
+        Reads and returns the next value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._position)
+            except json.JSONDecodeError:
+                # the value can be incomplete
+                if not self._fill():
+                    raise
+                continue
+
+            # numbers can continue in the next chunk, they are complete only
+            # if something that can't be part of them follows
+            if (end == len(self._buffer) or
+                    self._buffer[end] not in _DELIMITERS) and self._fill():
+                continue
+
+            self._position = end
+            return value
+
+    def array(self):
+        """
+        Generator that consumes an array, yields once for each element. The
+        element must be read (with value(), array() or object()) before
+        asking for the next one
+        """
+        self._expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+
+        while True:
+            yield
+            if self.peek() == "]":
+                self._position += 1
+                return
+            self._expect(",")
+
+    def object(self):
+        """
+        Generator that consumes an object, yields the key of each member.
+        The value must be read (with value(), array() or object()) before
+        asking for the next key
+        """
+        self._expect("{")
+        if self.peek() == "}":
+            self._position += 1
+            return
+
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Object keys must be strings")
+            self._expect(":")
+            yield key
+            if self.peek() == "}":
+                self._position += 1
+                return
+            self._expect(",")
+
+    def _expect(self, char):
+        """
+        Consumes the given character, raises ValueError if it's not the next
+        one
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected '{}' but found '{}' while reading "
+                             "JSON".format(char, found))
+        self._position += 1
+
+    def _fill(self):
+        """
+        Reads another chunk of the file, discarding what was already read.
+        Returns False at the end of the file
+        """
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            return False
 
-    return files
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
 
 
 class Color:
@@ -0,0 +1,167 @@
+import bisect
+import heapq
+import numbers
+
+
+"""
+Validation of the layouts given by the algorithms.
+
+A layout is valid if every item has a position, the items are inside the
+size of the sheet or group, and no two items overlap. Sprites packed by
+their masks (see agglomerate.algorithms.mask) can overlap, but the
+rectangles of their masks can't.
+
+The overlaps are found with a sweep line in O(n log n), so the layouts can
+be checked after every pack even with hundreds of thousands of sprites.
+"""
+
+
+def validate(items, settings, masks=False):
+    """
+    Raises InvalidLayoutException if the layout of the items isn't valid
+
+    :param list items: items placed by an algorithm
+    :param settings: Settings instance with the size set by the algorithm
+    :param bool masks: True if the items were packed by their masks, so
+            the mask rectangles of the sprites are checked for overlaps
+            instead of the sprites rectangles
+    """
+    problems = find_problems(items, settings, masks)
+    if problems:
+        raise InvalidLayoutException(problems)
+
+
+def find_problems(items, settings, masks=False):
+    """
+    Returns the problems of the layout of the items, see validate().
+
+    Only the first overlap found is reported.
+
+    :return: list of strings describing the problems, empty if the layout
+            is valid
+    """
+    problems = []
+
+    width, height = settings.size.to_tuple()
+    if not _is_number(width) or not _is_number(height):
+        problems.append("The size of the sheet wasn't set: {}x{}"
+                        .format(width, height))
+        width = height = None
+
+    rectangles = []
+    owners = []
+
+    for index, i in enumerate(items):
+        if i.position is None or not _is_number(i.position.x) or \
+                not _is_number(i.position.y):
+            problems.append("{} has no position".format(_get_name(i, index)))
+            continue
+
+        x, y = i.position.x, i.position.y
+        w, h = i.size.x, i.size.y
+
+        if x < 0 or y < 0 or width is not None and \
+                (x + w > width or y + h > height):
+            problems.append("{} at ({}, {}) with size {}x{} is out of the "
+                            "sheet of {}x{}".format(_get_name(i, index), x, y,
+                                                    w, h, width, height))
+
+        mask = getattr(i, "mask", None) if masks else None
+        if mask is None:
+            rectangles.append((x, y, x + w, y + h))
+            owners.append(index)
+        else:
+            for mx, my, mw, mh in mask:
+                rectangles.append((x + mx, y + my, x + mx + mw, y + my + mh))
+                owners.append(index)
+
+    overlap = find_overlap(rectangles, owners)
+    if overlap is not None:
+        a, b = overlap
+        problems.append("{} and {} overlap".format(
+                _get_name(items[owners[a]], owners[a]),
+                _get_name(items[owners[b]], owners[b])))
+
+    return problems
+
+
+def find_overlap(rectangles, owners=None):
+    """
+    Returns the indices of two overlapping rectangles, or None if no
+    rectangles overlap. Rectangles with no area and rectangles with the same
+    owner never overlap.
+
+    Sweeps the rectangles from left to right keeping the vertical intervals
+    of the rectangles that cross the sweep line sorted, if no rectangles
+    overlapped so far a new rectangle can only overlap its neighbours in
+    that order.
+
+    :param list rectangles: (x, y, right, bottom) tuples
+    :param list owners: owner of each rectangle, optional
+    :return: tuple of two indices or None
+    """
+    order = [r for r in sorted(range(len(rectangles)),
+                               key=rectangles.__getitem__)
+             if rectangles[r][2] > rectangles[r][0] and
+             rectangles[r][3] > rectangles[r][1]]
+
+    # (y, bottom, index) of the rectangles crossing the sweep line, sorted
+    active = []
+    # (right, y, bottom, index) of the active rectangles, to remove them when
+    # the sweep line passes them
+    ending = []
+
+    for r in order:
+        x, y, right, bottom = rectangles[r]
+
+        while ending and ending[0][0] <= x:
+            __, old_y, old_bottom, old = heapq.heappop(ending)
+            del active[bisect.bisect_left(active, (old_y, old_bottom, old))]
+
+        index = bisect.bisect_left(active, (y, bottom, r))
+        for neighbour in (index - 1, index):
+            if not 0 <= neighbour < len(active):
+                continue
+            other_y, other_bottom, other = active[neighbour]
+            if other_y < bottom and other_bottom > y and \
+                    (owners is None or owners[other] != owners[r]):
+                return (other, r)
+
+        active.insert(index, (y, bottom, r))
+        heapq.heappush(ending, (right, y, bottom, r))
+
+    return None
+
+
+class InvalidLayoutException(Exception):
+    """
+    Raised when an algorithm gives an invalid layout
+
+    **Fields**
+    problems
+        list of strings describing the problems found
+    """
+    def __init__(self, problems):
+        self.problems = problems
+
+        message = "Invalid layout: " + "; ".join(problems)
+        super(InvalidLayoutException, self).__init__(message)
+
+
+def _is_number(value):
+    """
+    Returns True if the value is a number, booleans aren't numbers
+    """
+    # checking the common types first is much faster
+    return type(value) in (int, float) or \
+        isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _get_name(item, index):
+    """
+    Returns a name for the item to use in the problems found
+    """
+    name = getattr(item, "name", None)
+    if name is None:
+        return "Item {}".format(index)
+    return name
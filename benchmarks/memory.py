@@ -0,0 +1,281 @@
+import os
+import sys
+
+# the script is run directly, the package doesn't need to be installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agglomerate
+import agglomerate.format
+import agglomerate.imagecache
+import agglomerate.packer
+import agglomerate.ui.shell
+
+import argparse
+import contextlib
+import json
+import random
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy
+import PIL.Image
+
+
+"""
+Memory benchmarks of each phase of a pack.
+
+Packs synthetic sprites of random sizes, saved as PNG files in a temporary
+directory with a parameters file listing them, and measures each phase
+separately: loading the parameters file (as the "from" command does),
+running the algorithms, flattening the tree, drawing the sheet, encoding it
+and generating the coordinates.
+
+For each phase the peak resident set size (RSS) of the process and the peak
+of the memory allocated by Python (tracemalloc) are reported. The RSS is
+sampled by a thread while the phase runs. tracemalloc slows down the
+phases, so the times shown are only a reference.
+
+The benchmark fails (exit status 1) if the peak RSS of any phase exceeds the
+budget given with --budget.
+
+Usage, from the repository root or anywhere else, the package doesn't need
+to be installed:
+
+    python benchmarks/memory.py --sprites 1000 10000 --budget 512
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Memory benchmarks of each phase of a pack.")
+    parser.add_argument("-n", "--sprites", nargs="+", type=int,
+                        default=[1000, 5000],
+            help="amounts of sprites to pack, one run for each")
+    parser.add_argument("-s", "--max-size", type=int, default=64,
+            help="maximum width and height of the sprites")
+    parser.add_argument("-a", "--algorithm", default="shelf",
+            help="algorithm to use")
+    parser.add_argument("-b", "--budget", type=float, default=None,
+                        metavar="MIB",
+            help="fail if the peak RSS of a phase exceeds this many MiB")
+    parser.add_argument("-M", "--memory-budget", type=float, default=None,
+                        metavar="MIB",
+            help="memory budget of the decoded images, see "
+                 "agglomerate.imagecache")
+    args = parser.parse_args()
+
+    failed = False
+
+    for count in args.sprites:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = _create_sprites(directory, count, args.max_size)
+            results = run(paths, directory, args.algorithm,
+                          args.memory_budget)
+
+        print("{} sprites".format(count))
+        _print_results(results)
+
+        if args.budget is not None:
+            for r in results:
+                if r.peak_rss > args.budget * 2 ** 20:
+                    print("  {} exceeded the budget of {} MiB".format(
+                            r.phase, args.budget))
+                    failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+def run(paths, directory, algorithm="shelf", memory_budget=None):
+    """
+    Packs the sprites measuring each phase
+
+    :param list paths: paths to the sprites images
+    :param str directory: where to save the parameters file and the sheet
+    :param str algorithm: algorithm name
+    :param float memory_budget: memory budget of the decoded images in MiB
+    :return: list of Result, one for each phase
+    """
+    results = []
+
+    parameters_path = os.path.join(directory, "parameters.json")
+    _write_parameters(parameters_path, paths, directory, algorithm,
+                      memory_budget)
+
+    tracemalloc.start()
+
+    try:
+        with _measure("loading", results):
+            params = agglomerate.ui.shell._load_parameters_from_file(
+                    parameters_path)
+        settings = params.settings
+
+        with agglomerate.imagecache.budget(settings.memory_budget,
+                                           params.items):
+            with _measure("packing", results):
+                agglomerate.packer._pack_group(params)
+
+            with _measure("flatten", results):
+                sprites = agglomerate.packer.flatten(params)
+
+            with _measure("drawing", results):
+                sheet = agglomerate.packer._draw_sheet(sprites, settings)
+
+            with _measure("encoding", results):
+                agglomerate.packer._save_sheet(sheet, settings)
+
+            with _measure("coordinates", results):
+                agglomerate.format.get_format("simplejson").generate(
+                        sprites, settings)
+    finally:
+        tracemalloc.stop()
+
+    return results
+
+
+def _write_parameters(path, paths, directory, algorithm, memory_budget):
+    """
+    Saves a parameters file listing the sprites, see the "from" command
+    """
+    settings = {
+        "algorithm": algorithm,
+        "format": "simplejson",
+        "output_sheet_path": os.path.join(directory, "sheet.png"),
+        "output_coordinates_path": os.path.join(directory, "sheet.json"),
+        "output_sheet_format": "png",
+        "output_sheet_color_mode": "RGBA",
+        "memory_budget": (None if memory_budget is None
+                          else int(memory_budget * 2 ** 20)),
+        "allow": {"rotation": False, "cropping": False},
+        "require": {"square_size": False, "power_of_two_size": False,
+                    "padding": False},
+        "size": {"x": "auto", "y": "auto"},
+        "background_color": "#00000000",
+    }
+
+    with open(path, "w") as f:
+        json.dump({"items": paths, "settings": settings}, f)
+
+
+class Result:
+    """
+    Measures of a phase
+
+    **Fields**
+    phase
+        phase name
+    seconds
+        time spent
+    peak_rss
+        peak resident set size of the process in bytes
+    peak_traced
+        peak of the memory allocated by Python during the phase in bytes,
+        above the memory allocated when the phase started
+    """
+    def __init__(self, phase, seconds, peak_rss, peak_traced):
+        self.phase = phase
+        self.seconds = seconds
+        self.peak_rss = peak_rss
+        self.peak_traced = peak_traced
+
+
+@contextlib.contextmanager
+def _measure(phase, results):
+    """
+    Context manager that measures the code inside it and appends a Result
+    to the results list
+    """
+    with _RSSSampler() as sampler:
+        tracemalloc.reset_peak()
+        start_traced = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+
+        yield
+
+        seconds = time.perf_counter() - start
+        peak_traced = tracemalloc.get_traced_memory()[1] - start_traced
+
+    results.append(Result(phase, seconds, sampler.peak, peak_traced))
+
+
+class _RSSSampler:
+    """
+    Context manager that samples the RSS of the process from a thread while
+    inside it, keeping the peak.
+
+    The RSS is read from /proc/self/statm. Where it isn't available the peak
+    RSS of the whole process life is used.
+    """
+    INTERVAL = 0.001
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self.peak = _get_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _get_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, _get_rss())
+
+
+def _get_rss():
+    """
+    Returns the resident set size of the process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # in kilobytes on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _create_sprites(directory, count, max_size):
+    """
+    Saves sprites of random sizes and colors in the directory, filled with
+    noise so they don't compress too much
+
+    :return: list of paths
+    """
+    rng = random.Random(0)
+    noise = numpy.random.default_rng(0)
+    paths = []
+
+    for i in range(count):
+        w, h = rng.randint(1, max_size), rng.randint(1, max_size)
+        pixels = noise.integers(0, 256, (h, w, 4), numpy.uint8)
+
+        path = os.path.join(directory, "sprite{}.png".format(i))
+        PIL.Image.fromarray(pixels, "RGBA").save(path)
+        paths.append(path)
+
+    return paths
+
+
+def _print_results(results):
+    """
+    Prints a table with the results
+    """
+    print("  {:<12} {:>9} {:>14} {:>14}".format(
+            "phase", "seconds", "peak RSS MiB", "traced MiB"))
+    for r in results:
+        print("  {:<12} {:>9.3f} {:>14.1f} {:>14.1f}".format(
+                r.phase, r.seconds, r.peak_rss / 2 ** 20,
+                r.peak_traced / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,7 +35,7 @@ setup(
     keywords='development sprite image game',
 
     packages=find_packages(),
-    install_requires=['pillow'],
+    install_requires=['pillow', 'numpy'],
 
     entry_points={
         'console_scripts': [
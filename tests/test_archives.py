@@ -0,0 +1,105 @@
+import agglomerate
+import agglomerate.archives
+import agglomerate.packer
+import agglomerate.util
+
+from tests import util
+
+import os
+import tarfile
+import zipfile
+
+import numpy
+import pytest
+
+
+@pytest.fixture
+def sprites_dir(tmp_path):
+    directory = tmp_path / "s"
+    (directory / "sub").mkdir(parents=True)
+    util.save_sprites(directory, 4)
+    util.save_sprites(directory / "sub", 2, seed=10)
+    yield directory
+    agglomerate.archives.close_archives()
+
+
+def _make_archive(tmp_path, sprites_dir, name):
+    path = str(tmp_path / name)
+    files = sorted(p for p in sprites_dir.rglob("*.png"))
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path, "w") as f:
+            for p in files:
+                f.write(str(p), str(p.relative_to(tmp_path)))
+    else:
+        mode = "w:gz" if name.endswith(".tgz") else "w"
+        with tarfile.open(path, mode) as f:
+            # like tar -C dir ./s
+            for p in files:
+                f.add(str(p), "./" + str(p.relative_to(tmp_path)))
+
+    return path
+
+
+@pytest.mark.parametrize("name", ["a.zip", "a.tar", "a.tgz"])
+def test_matching_members(tmp_path, sprites_dir, name):
+    archive = _make_archive(tmp_path, sprites_dir, name)
+
+    matched = agglomerate.util.get_matching_paths(archive + "!/s/*.png")
+    assert [agglomerate.archives.split_path(p)[1] for p in matched] == \
+        ["s/s0.png", "s/s1.png", "s/s2.png", "s/s3.png"]
+
+    recursive = agglomerate.util.get_matching_paths(archive + "!/**/*.png")
+    assert len(recursive) == 6
+
+
+@pytest.mark.parametrize("name", ["a.zip", "a.tar", "a.tgz"])
+def test_members_are_read_like_files(tmp_path, sprites_dir, name):
+    archive = _make_archive(tmp_path, sprites_dir, name)
+
+    for path in agglomerate.util.get_matching_paths(archive + "!/**/*.png"):
+        member = agglomerate.archives.split_path(path)[1]
+        with agglomerate.archives.open_file(path) as f, \
+                open(str(tmp_path / member), "rb") as expected:
+            assert f.read() == expected.read()
+
+        sprite = agglomerate.Sprite(path)
+        assert sprite.name == os.path.basename(member)
+        assert sprite.image.size == sprite.size.to_tuple()
+
+
+def test_pack_from_archive_equals_pack_from_files(tmp_path, sprites_dir):
+    archive = _make_archive(tmp_path, sprites_dir, "a.tgz")
+
+    from_files = util.new_params(
+            [agglomerate.Sprite(p) for p in
+             agglomerate.util.get_matching_paths(str(sprites_dir / "*.png"))])
+    from_archive = util.new_params(
+            [agglomerate.Sprite(p) for p in
+             agglomerate.util.get_matching_paths(archive + "!/s/*.png")])
+
+    assert numpy.array_equal(
+            util.decode(agglomerate.packer.pack_to_memory(from_files).sheet),
+            util.decode(agglomerate.packer.pack_to_memory(from_archive).sheet))
+
+
+def test_missing_member(tmp_path, sprites_dir):
+    archive = _make_archive(tmp_path, sprites_dir, "a.zip")
+
+    assert agglomerate.util.get_matching_paths(archive + "!/s/x*.png") == []
+    with pytest.raises(FileNotFoundError):
+        agglomerate.archives.open_file(archive + "!/s/missing.png")
+
+
+def test_paths_outside_archives(tmp_path):
+    assert agglomerate.archives.split_path("a.png") is None
+    assert agglomerate.archives.split_path("dir!/a.png") is None
+    assert agglomerate.archives.split_path("a.ZIP!/b/c.png") == \
+        ("a.ZIP", "b/c.png")
+
+
+def test_members_use_archive_mtime(tmp_path, sprites_dir):
+    archive = _make_archive(tmp_path, sprites_dir, "a.zip")
+    os.utime(archive, (1000, 1000))
+
+    assert agglomerate.archives.get_mtime(archive + "!/s/s0.png") == 1000
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "benchmarks", "memory.py")
+
+
+def _run(tmp_path, *args):
+    # from another directory, without the package in the path
+    environment = dict(os.environ)
+    environment.pop("PYTHONPATH", None)
+    return subprocess.run([sys.executable, _SCRIPT, "--sprites", "20"] +
+                          list(args),
+                          cwd=str(tmp_path), env=environment,
+                          capture_output=True, text=True)
+
+
+def test_memory_benchmark_runs(tmp_path):
+    result = _run(tmp_path, "--memory-budget", "1")
+
+    assert result.returncode == 0, result.stderr
+    for phase in ("loading", "packing", "flatten", "drawing", "encoding",
+                  "coordinates"):
+        assert phase in result.stdout
+
+
+def test_memory_benchmark_budget(tmp_path):
+    result = _run(tmp_path, "--budget", "1")
+
+    assert result.returncode == 1
+    assert "exceeded the budget" in result.stdout
@@ -0,0 +1,157 @@
+import agglomerate
+import agglomerate.canvas
+import agglomerate.packer
+
+from tests import util
+
+import os
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _pack(directory, name, **settings):
+    """
+    Packs the same sprites saving the sheet with the given name
+    """
+    params = util.new_params(util.random_sprites(20, 40), directory=directory)
+    params.settings.output_sheet_path = str(directory / name)
+    params.settings.output_coordinates_path = str(directory / (name +
+                                                               ".json"))
+    for key, value in settings.items():
+        setattr(params.settings, key, value)
+
+    agglomerate.packer.pack(params)
+
+
+def _read(path):
+    with PIL.Image.open(path) as image:
+        return numpy.asarray(image.convert("RGBA"))
+
+
+# -----------------------------------------------------------------------------
+# Memory mapped canvases
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("height", [1, 64, 100])
+def test_tiff_round_trip(tmp_path, mode, height):
+    pixels = numpy.asarray(util.random_image(37, height).convert(mode))
+    path = str(tmp_path / "sheet.tiff")
+    agglomerate.canvas.write_tiff(pixels, path, mode, rows_per_strip=16)
+
+    with PIL.Image.open(path) as image:
+        assert image.mode == mode
+        assert numpy.array_equal(numpy.asarray(image), pixels)
+
+
+def test_temporary_map_is_deleted(tmp_path):
+    canvas = agglomerate.canvas.MappedCanvas((8, 4), "RGBA", (1, 2, 3, 4))
+    path = canvas.path
+    assert os.path.exists(path)
+    assert (canvas.pixels == (1, 2, 3, 4)).all()
+
+    canvas.close()
+    canvas.close()
+    assert not os.path.exists(path)
+
+
+def test_mapped_canvas_modes():
+    with pytest.raises(ValueError):
+        agglomerate.canvas.MappedCanvas((4, 4), "L", (0, 0, 0, 0))
+
+
+@pytest.mark.parametrize("name", ["mapped.png", "mapped.tiff"])
+def test_mapped_sheet_equals_normal_sheet(tmp_path, name):
+    _pack(tmp_path, "normal.png")
+    _pack(tmp_path, name, output_sheet_memory_map=True)
+
+    assert numpy.array_equal(_read(str(tmp_path / "normal.png")),
+                             _read(str(tmp_path / name)))
+
+
+def test_raw_sheet_is_the_mapped_file(tmp_path):
+    _pack(tmp_path, "normal.png")
+    _pack(tmp_path, "mapped.raw", output_sheet_memory_map=True)
+
+    normal = _read(str(tmp_path / "normal.png"))
+    with open(str(tmp_path / "mapped.raw"), "rb") as f:
+        raw = numpy.frombuffer(f.read(), numpy.uint8)
+    assert numpy.array_equal(normal, raw.reshape(normal.shape))
+
+
+def test_mapped_sheets_are_rgb_or_rgba(tmp_path):
+    with pytest.raises(ValueError):
+        _pack(tmp_path, "mapped.png", output_sheet_memory_map=True,
+              output_sheet_color_mode="L")
+
+    params = util.new_params(util.random_sprites(2))
+    params.settings.output_sheet_memory_map = True
+    with pytest.raises(ValueError):
+        agglomerate.packer.pack_to_memory(params)
+
+
+# -----------------------------------------------------------------------------
+# Array canvases
+# -----------------------------------------------------------------------------
+
+
+def _semi_transparent(width, height, seed=0):
+    pixels = numpy.asarray(util.random_image(width, height, seed)).copy()
+    pixels[:, :, 3] = numpy.random.default_rng(seed) \
+        .integers(0, 256, (height, width))
+    return PIL.Image.fromarray(pixels, "RGBA")
+
+
+def test_sprites_are_copied_on_transparent_backgrounds():
+    image = _semi_transparent(6, 5)
+    canvas = agglomerate.canvas.ArrayCanvas((10, 10), "RGBA", (0, 0, 0, 0))
+    canvas.paste(image, (3, 2), image)
+
+    assert numpy.array_equal(canvas.pixels[2:7, 3:9], numpy.asarray(image))
+    assert not canvas.pixels[:2].any()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_opaque_sheets_blend_like_paste(mode):
+    image = _semi_transparent(6, 5)
+    background = (10, 200, 30, 255)
+    canvas = agglomerate.canvas.ArrayCanvas((10, 10), mode, background)
+    canvas.paste(image, (3, 2), image)
+
+    expected = PIL.Image.new("RGBA", (10, 10), background).convert(mode)
+    expected.paste(image.convert(mode), (3, 2), image)
+    assert numpy.array_equal(numpy.asarray(canvas.to_image()),
+                             numpy.asarray(expected))
+
+
+def test_overlapping_sprites_are_composited():
+    first = _semi_transparent(6, 6, 1)
+    second = _semi_transparent(6, 6, 2)
+    canvas = agglomerate.canvas.ArrayCanvas((8, 8), "RGBA", (0, 0, 0, 0))
+    canvas.overlapping = True
+    canvas.paste(first, (0, 0), first)
+    canvas.paste(second, (2, 2), second)
+
+    expected = PIL.Image.new("RGBA", (8, 8), (0, 0, 0, 0))
+    expected.alpha_composite(first, (0, 0))
+    expected.alpha_composite(second, (2, 2))
+    difference = numpy.abs(canvas.pixels.astype(int) -
+                           numpy.asarray(expected).astype(int))
+    assert difference.max() <= 1
+
+
+def test_unmasked_sprites_are_copied():
+    image = _semi_transparent(4, 4)
+    canvas = agglomerate.canvas.ArrayCanvas((4, 4), "RGB", (255, 255, 255,
+                                                            255))
+    canvas.paste(image, (0, 0))
+    assert numpy.array_equal(canvas.pixels,
+                             numpy.asarray(image.convert("RGB")))
+
+
+def test_array_canvas_modes():
+    with pytest.raises(ValueError):
+        agglomerate.canvas.ArrayCanvas((4, 4), "CMYK", (0, 0, 0, 0))
@@ -0,0 +1,102 @@
+import agglomerate.compression
+import agglomerate.packer
+
+from tests import util
+
+import io
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _gradient(width, height):
+    y, x = numpy.mgrid[:height, :width]
+    pixels = numpy.empty((height, width, 4), numpy.uint8)
+    pixels[:, :, 0] = x * 255 // max(width - 1, 1)
+    pixels[:, :, 1] = y * 255 // max(height - 1, 1)
+    pixels[:, :, 2] = 128
+    pixels[:, :, 3] = 255
+    return pixels
+
+
+def _round_trip(pixels, name):
+    data = agglomerate.compression.encode_dds(
+            PIL.Image.fromarray(pixels, "RGBA"), name)
+    with PIL.Image.open(io.BytesIO(data)) as image:
+        return numpy.asarray(image.convert("RGBA")).astype(int)
+
+
+def _opaque_error(pixels, decoded):
+    opaque = pixels[:, :, 3] == 255
+    return numpy.abs(decoded[:, :, :3] - pixels[:, :, :3])[opaque].mean()
+
+
+@pytest.mark.parametrize("name", ["bc1", "bc3"])
+def test_round_trip(name):
+    pixels = _gradient(32, 16)
+    decoded = _round_trip(pixels, name)
+
+    assert decoded.shape == pixels.shape
+    assert _opaque_error(pixels, decoded) < 6
+    assert (decoded[:, :, 3] == 255).all()
+
+
+@pytest.mark.parametrize("name", ["bc1", "bc3"])
+def test_sizes_not_multiple_of_the_block(name):
+    pixels = _gradient(13, 7)
+    decoded = _round_trip(pixels, name)
+
+    assert decoded.shape == pixels.shape
+    assert _opaque_error(pixels, decoded) < 12
+
+
+def test_bc1_transparency():
+    pixels = _gradient(16, 16)
+    pixels[::2, :, 3] = 0
+    decoded = _round_trip(pixels, "bc1")
+
+    assert numpy.array_equal(decoded[:, :, 3] == 0, pixels[:, :, 3] == 0)
+
+
+def test_bc3_alpha():
+    pixels = _gradient(16, 16)
+    pixels[:, :, 3] = numpy.arange(16, dtype=numpy.uint8)[None] * 17
+    decoded = _round_trip(pixels, "bc3")
+
+    assert numpy.abs(decoded[:, :, 3] - pixels[:, :, 3]).max() <= 18
+
+
+def test_bc3_ignores_transparent_colors():
+    # transparent pixels of random colors, between opaque ones
+    pixels = _gradient(64, 64)
+    y, x = numpy.mgrid[:64, :64]
+    holes = (x % 10 > 6) | (y % 9 > 6)
+    rng = numpy.random.default_rng(0)
+    pixels[holes] = rng.integers(0, 256, (holes.sum(), 4))
+    pixels[holes, 3] = 0
+
+    bc1 = _opaque_error(pixels, _round_trip(pixels, "bc1"))
+    bc3 = _opaque_error(pixels, _round_trip(pixels, "bc3"))
+
+    assert bc3 <= bc1 * 1.1
+
+
+def test_block_format_names():
+    assert agglomerate.compression.is_block_format("BC1")
+    assert agglomerate.compression.is_block_format("bc3")
+    assert not agglomerate.compression.is_block_format("png")
+    assert not agglomerate.compression.is_block_format(None)
+    assert [agglomerate.compression.align(v) for v in (0, 1, 4, 5)] == \
+        [0, 4, 4, 8]
+
+
+@pytest.mark.parametrize("name", ["bc1", "bc3"])
+def test_sprites_are_aligned_to_blocks(name):
+    params = util.new_params(util.random_sprites(10, 13), sheet_format=name)
+    result = agglomerate.packer.pack_to_memory(params)
+
+    assert result.sheet_format == name
+    assert result.sheet[:4] == b"DDS "
+    for s in result.sprites:
+        assert s.position.x % 4 == 0 and s.position.y % 4 == 0
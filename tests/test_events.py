@@ -0,0 +1,85 @@
+import agglomerate
+import agglomerate.events
+import agglomerate.packer
+
+from tests import util
+
+import os
+import threading
+
+import pytest
+
+
+class _Recorder(agglomerate.events.Observer):
+    """
+    Keeps the events, and cancels the pack at the first event of the given
+    type
+    """
+    def __init__(self, cancel_at=None):
+        self.events = []
+        self.cancel_at = cancel_at
+        self._lock = threading.Lock()
+
+    def notify(self, event):
+        with self._lock:
+            self.events.append(event)
+        if event.type == self.cancel_at:
+            self.cancel()
+
+    def phases(self):
+        return [(e.type, e.phase) for e in self.events
+                if e.type in (agglomerate.events.PHASE_STARTED,
+                              agglomerate.events.PHASE_FINISHED)]
+
+    def total(self, type, phase=None):
+        return sum(e.count for e in self.events
+                   if e.type == type and phase in (None, e.phase))
+
+
+def _pack(tmp_path, observer, pipelined=False, count=20):
+    params = util.new_params(util.random_sprites(count), directory=tmp_path)
+    agglomerate.packer.pack(params, pipelined=pipelined, observer=observer)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_progress_counts(tmp_path, pipelined):
+    observer = _Recorder()
+    _pack(tmp_path, observer, pipelined)
+
+    assert observer.total(agglomerate.events.SPRITES_PLACED) == 20
+    assert observer.total(agglomerate.events.SPRITES_DRAWN) == 20
+    assert observer.total(agglomerate.events.BYTES_ENCODED,
+                          agglomerate.events.ENCODING) == \
+        os.path.getsize(str(tmp_path / "sheet.png"))
+    assert observer.total(agglomerate.events.BYTES_ENCODED,
+                          agglomerate.events.COORDINATES) == \
+        os.path.getsize(str(tmp_path / "sheet.json"))
+
+
+def test_same_phases_when_pipelined(tmp_path):
+    plain = _Recorder()
+    _pack(tmp_path, plain)
+    pipelined = _Recorder()
+    _pack(tmp_path, pipelined, pipelined=True)
+
+    def sheet_phases(observer):
+        return [p for p in observer.phases()
+                if p[1] != agglomerate.events.COORDINATES]
+
+    assert sheet_phases(plain) == sheet_phases(pipelined)
+    assert [p for __, p in sheet_phases(plain)] == [
+            agglomerate.events.PACKING, agglomerate.events.PACKING,
+            agglomerate.events.DRAWING, agglomerate.events.DRAWING,
+            agglomerate.events.ENCODING, agglomerate.events.ENCODING]
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+@pytest.mark.parametrize("cancel_at", [agglomerate.events.SPRITES_PLACED,
+                                       agglomerate.events.SPRITES_DRAWN])
+def test_cancel(tmp_path, pipelined, cancel_at):
+    observer = _Recorder(cancel_at)
+
+    with pytest.raises(agglomerate.events.PackCancelledException):
+        _pack(tmp_path, observer, pipelined)
+
+    assert observer.cancelled
@@ -0,0 +1,62 @@
+import agglomerate
+import agglomerate.packer
+
+from tests import util
+
+import json
+
+import pytest
+
+
+# -----------------------------------------------------------------------------
+# Several coordinates formats
+# -----------------------------------------------------------------------------
+
+
+def test_several_formats_with_a_path_each(tmp_path):
+    paths = util.save_sprites(tmp_path, 6)
+    params = util.new_params([agglomerate.Sprite(p) for p in paths],
+                             formats=["simplejson", "simplejson"],
+                             directory=tmp_path)
+    params.settings.output_coordinates_path = [str(tmp_path / "a.json"),
+                                               str(tmp_path / "b.json")]
+    agglomerate.packer.pack(params)
+
+    with open(str(tmp_path / "a.json")) as a, \
+            open(str(tmp_path / "b.json")) as b:
+        first = a.read()
+        assert first == b.read()
+    assert {c["name"] for c in json.loads(first)} == \
+        {"s{}.png".format(k) for k in range(6)}
+
+
+def test_single_path_gets_the_extension_of_each_format(tmp_path):
+    settings = agglomerate.SheetSettings("binarytree", ["simplejson"])
+    settings.output_coordinates_path = str(tmp_path / "sheet.txt")
+    formats = agglomerate.packer._get_formats(settings)
+    assert [f[2] for f in formats] == [str(tmp_path / "sheet.txt")]
+
+    settings.format = ["simplejson", "simplejson"]
+    formats = agglomerate.packer._get_formats(settings)
+    assert [f[2] for f in formats] == [str(tmp_path / "sheet.json")] * 2
+
+
+def test_a_path_is_needed_for_each_format(tmp_path):
+    settings = agglomerate.SheetSettings("binarytree",
+                                         ["simplejson", "simplejson"])
+    settings.output_coordinates_path = [str(tmp_path / "a.json")]
+    with pytest.raises(ValueError):
+        agglomerate.packer._get_formats(settings)
+
+
+def test_unknown_format_packs_nothing(tmp_path):
+    paths = util.save_sprites(tmp_path, 3)
+    params = util.new_params([agglomerate.Sprite(p) for p in paths],
+                             formats=["simplejson", "nonexistent"],
+                             directory=tmp_path)
+    params.settings.output_coordinates_path = [str(tmp_path / "a.json"),
+                                               str(tmp_path / "b.txt")]
+    with pytest.raises(Exception):
+        agglomerate.packer.pack(params)
+    assert not (tmp_path / "sheet.png").exists()
+    assert not (tmp_path / "a.json").exists()
@@ -0,0 +1,62 @@
+import agglomerate
+import agglomerate.imagecache
+import agglomerate.packer
+
+from tests import util
+
+import concurrent.futures
+
+import numpy
+import pytest
+
+
+def _sprites_from_files(tmp_path, count=20):
+    return [agglomerate.Sprite(p)
+            for p in util.save_sprites(tmp_path, count, max_size=16)]
+
+
+def test_cache_keeps_the_budget(tmp_path):
+    sprites = _sprites_from_files(tmp_path)
+    budget = 3 * 16 * 16 * 4
+
+    with agglomerate.imagecache.budget(budget, sprites) as cache:
+        for s in sprites:
+            s.image
+            assert cache.size <= budget
+        # discarded images are decoded again
+        assert all(s.image.size == s.size.to_tuple() for s in sprites)
+
+    assert all(s.image_cache is None for s in sprites)
+    assert all(s._image is None for s in sprites)
+
+
+def test_no_budget():
+    sprites = util.random_sprites(2)
+    with agglomerate.imagecache.budget(None, sprites) as cache:
+        assert cache is None
+        assert sprites[0].image_cache is None
+
+
+def test_sprites_cant_be_in_two_budgets(tmp_path):
+    sprites = _sprites_from_files(tmp_path, 2)
+
+    with agglomerate.imagecache.budget(1000, sprites):
+        with pytest.raises(RuntimeError):
+            with agglomerate.imagecache.budget(1000, sprites[:1]):
+                pass
+
+
+def test_concurrent_packs_with_budgets(tmp_path):
+    paths = util.save_sprites(tmp_path, 30, max_size=16)
+    expected = util.decode(agglomerate.packer.pack_to_memory(
+            util.new_params([agglomerate.Sprite(p) for p in paths])).sheet)
+
+    def pack(__):
+        params = util.new_params([agglomerate.Sprite(p) for p in paths])
+        params.settings.memory_budget = 2000
+        return util.decode(agglomerate.packer.pack_to_memory(params).sheet)
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(pack, range(8)))
+
+    assert all(numpy.array_equal(r, expected) for r in results)
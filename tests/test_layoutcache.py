@@ -0,0 +1,155 @@
+import agglomerate
+import agglomerate.layoutcache
+import agglomerate.packer
+
+from tests import util
+
+import json
+
+import pytest
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """
+    List of the groups whose algorithm was run
+    """
+    groups = []
+    run_algorithm = agglomerate.packer._run_algorithm
+
+    def counting(algorithm, group, observer=None):
+        groups.append(group)
+        run_algorithm(algorithm, group, observer)
+
+    monkeypatch.setattr(agglomerate.packer, "_run_algorithm", counting)
+    return groups
+
+
+def _layout(params, cache=None):
+    """
+    Packs the parameters and returns the position of each sprite by name
+    """
+    result = agglomerate.packer.pack_to_memory(params, layout_cache=cache)
+    return {e["name"]: (e["x"], e["y"], e["rotated"]) for e in result.layout}
+
+
+def _new_params(seed=0, count=15, algorithm="binarytree"):
+    return util.new_params(util.random_sprites(count, seed=seed),
+                           algorithm=algorithm)
+
+
+# -----------------------------------------------------------------------------
+# Layout cache
+# -----------------------------------------------------------------------------
+
+
+def test_cached_layout_is_restored(runs):
+    cache = agglomerate.layoutcache.LayoutCache()
+    first = _layout(_new_params(), cache)
+    assert len(runs) == 1
+    assert _layout(_new_params(), cache) == first
+    assert len(runs) == 1
+    assert _layout(_new_params()) == first
+
+
+def test_pixels_dont_change_the_key(runs):
+    cache = agglomerate.layoutcache.LayoutCache()
+    _layout(_new_params(), cache)
+
+    # same sizes, different pixels
+    params = _new_params()
+    for n, s in enumerate(agglomerate.packer._find_sprites(params)):
+        s.image = util.random_image(s.size.x, s.size.y, 100 + n)
+    _layout(params, cache)
+    assert len(runs) == 1
+
+
+def test_sizes_and_settings_change_the_key(runs):
+    cache = agglomerate.layoutcache.LayoutCache()
+    _layout(_new_params(), cache)
+    _layout(_new_params(seed=1), cache)
+    _layout(_new_params(algorithm="shelf"), cache)
+    assert len(runs) == 3
+
+
+def test_cache_file_round_trip(tmp_path, runs):
+    path = str(tmp_path / "cache.json")
+    cache = agglomerate.layoutcache.LayoutCache(path)
+    first = _layout(_new_params(), cache)
+    with open(path) as f:
+        assert len(json.load(f)) == 1
+
+    cache = agglomerate.layoutcache.LayoutCache(path)
+    assert _layout(_new_params(), cache) == first
+    assert len(runs) == 1
+
+
+def test_least_recently_used_layouts_are_discarded(runs):
+    cache = agglomerate.layoutcache.LayoutCache(max_entries=2)
+    for seed in (0, 1, 0, 2, 0, 1):
+        _layout(_new_params(seed=seed), cache)
+
+    # 0 is used again before 2 is added, so 1 is the one discarded
+    assert len(runs) == 4
+
+
+
+# -----------------------------------------------------------------------------
+# Groups
+# -----------------------------------------------------------------------------
+
+
+def _tree(sizes, child_algorithm="binarytree"):
+    """
+    Returns parameters with a group for each list of sprite sizes, named
+    g<group>s<sprite>
+    """
+    groups = []
+    for g, group_sizes in enumerate(sizes):
+        sprites = [agglomerate.Sprite.from_image(
+                       util.random_image(w, h, 10 * g + s),
+                       "g{}s{}".format(g, s))
+                   for s, (w, h) in enumerate(group_sizes)]
+        groups.append(agglomerate.Group(
+                sprites, agglomerate.Settings(child_algorithm)))
+    return util.new_params(groups)
+
+
+_SIZES = [[(5, 7), (9, 3), (4, 4)], [(12, 2), (3, 8)], [(6, 6), (2, 9)]]
+
+
+def test_only_changed_groups_are_packed_again(runs):
+    cache = agglomerate.layoutcache.LayoutCache()
+    _layout(_tree(_SIZES), cache)
+    assert len(runs) == 4
+
+    sizes = [list(s) for s in _SIZES]
+    sizes[1][0] = (11, 2)
+    del runs[:]
+    changed = _layout(_tree(sizes), cache)
+
+    # only the changed group and the root
+    assert len(runs) == 2
+    assert {i.name for i in runs[0].items} == {"g1s0", "g1s1"}
+    assert runs[1].type == "parameters"
+    assert changed == _layout(_tree(sizes))
+
+
+def test_tree_keys_change_only_in_ancestors():
+    first = _tree(_SIZES)
+    keys = agglomerate.layoutcache.LayoutCache.get_tree_keys(first)
+
+    sizes = [list(s) for s in _SIZES]
+    sizes[2][1] = (2, 10)
+    second = _tree(sizes)
+    changed = agglomerate.layoutcache.LayoutCache.get_tree_keys(second)
+
+    for a, b, same in zip(first.items, second.items, (True, True, False)):
+        assert (keys[id(a)] == changed[id(b)]) == same
+    assert keys[id(first)] != changed[id(second)]
+
+
+def test_groups_using_pixels_arent_cached():
+    params = _tree(_SIZES, "mask")
+    keys = agglomerate.layoutcache.LayoutCache.get_tree_keys(params)
+    assert all(k is None for k in keys.values())
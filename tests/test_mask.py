@@ -0,0 +1,76 @@
+import agglomerate
+import agglomerate.packer
+
+from tests import util
+
+import json
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _triangle(size, lower, alpha=128):
+    """
+    Returns a right triangle sprite image, the lower-left half of the
+    square or the upper-right one
+    """
+    y, x = numpy.mgrid[:size, :size]
+    inside = x <= y if lower else x >= y
+    pixels = numpy.zeros((size, size, 4), numpy.uint8)
+    pixels[inside] = (0, 0, 255, alpha)
+    return PIL.Image.fromarray(pixels, "RGBA")
+
+
+def _triangles():
+    return [agglomerate.Sprite.from_image(_triangle(40, k % 2 == 0),
+                                          "t{}".format(k))
+            for k in range(4)]
+
+
+def test_sprites_interlock():
+    params = util.new_params(_triangles(), "mask")
+    result = agglomerate.packer.pack_to_memory(params)
+
+    assert agglomerate.packer._has_overlaps(result.sprites)
+
+
+def test_semi_transparent_pixels_keep_alpha():
+    params = util.new_params(_triangles(), "mask")
+    result = agglomerate.packer.pack_to_memory(params)
+
+    alpha = util.decode(result.sheet)[:, :, 3]
+    assert set(numpy.unique(alpha)) == {0, 128}
+
+
+def test_masks_dont_cover_other_sprites():
+    params = util.new_params(_triangles(), "mask")
+    result = agglomerate.packer.pack_to_memory(params)
+    sheet = util.decode(result.sheet)
+
+    for s in result.sprites:
+        expected = numpy.asarray(s.image)
+        pixels = util.crop_sprite(sheet, s)
+        visible = expected[:, :, 3] > 0
+        assert numpy.array_equal(pixels[visible], expected[visible])
+
+
+def test_block_formats_are_rejected():
+    params = util.new_params(_triangles(), "mask", sheet_format="bc3")
+    with pytest.raises(ValueError):
+        agglomerate.packer.pack_to_memory(params)
+
+
+@pytest.mark.parametrize("algorithm", ["binarytree", "shelf"])
+def test_masks_arent_kept_by_other_algorithms(algorithm):
+    sprites = _triangles()
+    agglomerate.packer.pack_to_memory(util.new_params(sprites, "mask"))
+    assert all(s.mask is not None for s in sprites)
+
+    result = agglomerate.packer.pack_to_memory(
+            util.new_params(sprites, algorithm))
+
+    assert all(s.mask is None for s in result.sprites)
+    assert all("mask" not in c for c in json.loads(
+            result.coordinates["simplejson"]))
+    assert not agglomerate.packer._has_overlaps(result.sprites)
@@ -0,0 +1,164 @@
+import agglomerate
+import agglomerate.algorithm
+import agglomerate.algorithms.inline
+import agglomerate.events
+import agglomerate.optimize
+import agglomerate.packer
+
+from tests import util
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+import types
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _params(directory, rotation=True, optimize_time=0.5):
+    # long sprites, so rotating them changes the layout
+    sprites = [agglomerate.Sprite.from_image(
+                   util.random_image(40, 7 + k % 3, k), "s{}".format(k))
+               for k in range(12)]
+    params = util.new_params(sprites, directory=directory)
+    params.settings.allow["rotation"] = rotation
+    params.settings.optimize_time = optimize_time
+    return params
+
+
+def _check_sheet(directory, params):
+    sheet = numpy.asarray(
+            PIL.Image.open(str(directory / "sheet.png")).convert("RGBA"))
+    for s in agglomerate.packer.flatten(params):
+        assert numpy.array_equal(util.crop_sprite(sheet, s),
+                                 numpy.asarray(s.image))
+
+
+def test_optimized_layout_isnt_worse(tmp_path):
+    plain = _params(tmp_path, optimize_time=0)
+    agglomerate.packer.pack(plain, layout_only=True)
+    optimized = _params(tmp_path)
+    agglomerate.packer.pack(optimized, layout_only=True)
+
+    def area(params):
+        sprites = agglomerate.packer.flatten(params)
+        return max(s.position.x + s.size.x for s in sprites) * \
+            max(s.position.y + s.size.y for s in sprites)
+
+    assert area(optimized) <= area(plain)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_rotated_sprites_are_drawn_rotated(tmp_path, pipelined):
+    params = _params(tmp_path)
+    agglomerate.packer.pack(params, pipelined=pipelined)
+
+    _check_sheet(tmp_path, params)
+
+
+def test_sprites_arent_rotated_without_permission(tmp_path):
+    params = _params(tmp_path, rotation=False)
+    agglomerate.packer.pack(params, layout_only=True)
+
+    assert not any(s.rotated for s in params.items)
+
+
+# -----------------------------------------------------------------------------
+# Search
+# -----------------------------------------------------------------------------
+
+
+def _long_sprites(count=8):
+    # half lying and half standing, so rotating some of them helps
+    return [agglomerate.Sprite.from_image(
+                util.random_image(*((40, 6) if k % 2 else (6, 40)), seed=k),
+                "s{}".format(k))
+            for k in range(count)]
+
+
+def _search(algorithm, items, time_budget=1, observer=None, workers=2):
+    """
+    Runs the search and returns the scores given to the callback and the
+    settings with the size
+    """
+    settings = agglomerate.Settings(algorithm)
+    settings.allow["rotation"] = True
+    scores = []
+    agglomerate.optimize.optimize(
+            agglomerate.algorithm.get_algorithm(algorithm), items, settings,
+            time_budget, workers, scores.append, observer)
+    return scores, settings
+
+
+@pytest.mark.parametrize("algorithm", ["binarytree", "shelf", "inline"])
+def test_search_improves_layouts(algorithm):
+    scores, settings = _search(algorithm, _long_sprites())
+
+    assert scores[-1] < scores[0]
+    assert settings.size.x * settings.size.y == scores[-1][0]
+
+
+def test_second_search_applies_its_best_layout():
+    sprites = _long_sprites()
+    _search("binarytree", sprites)
+    assert any(s.rotated for s in sprites)
+
+    scores, settings = _search("binarytree", sprites)
+    assert settings.size.x * settings.size.y == min(scores)[0]
+    for s in sprites:
+        w, h = s.image.size
+        assert s.size.to_tuple() == ((h, w) if s.rotated else (w, h))
+
+
+def test_sorted_items_are_only_rotated():
+    rng = random.Random(0)
+    sizes = [("sprite", 4, 5)] * 6
+    candidate = agglomerate.optimize.Candidate(list(range(6)), [False] * 6)
+    for __ in range(50):
+        candidate = candidate.mutate(rng, False, True, sizes)
+        assert candidate.order == list(range(6))
+
+    candidate = candidate.mutate(rng, False, False, sizes)
+    assert candidate.order == list(range(6))
+
+
+def test_search_keeps_its_best_layout_when_cancelled():
+    observer = agglomerate.events.Observer()
+    observer.cancel()
+    sprites = _long_sprites()
+    scores, settings = _search("binarytree", sprites, 10, observer)
+
+    assert settings.size.x * settings.size.y == scores[0][0]
+    assert all(s.position is not None for s in sprites)
+
+
+class _SlowInWorkers(agglomerate.algorithm.Algorithm):
+    """
+    Inline algorithm that takes long in the worker processes
+    """
+    supports = agglomerate.algorithms.inline.InlineAlgorithm.supports
+    parent = os.getpid()
+
+    def pack(self, items, settings):
+        if os.getpid() != self.parent:
+            time.sleep(2)
+        agglomerate.algorithms.inline.InlineAlgorithm().pack(items, settings)
+
+
+def test_time_budget_is_honored(monkeypatch):
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("the algorithm module must be inherited by the workers")
+
+    module = types.ModuleType("agglomerate.algorithms.slow")
+    module.algorithm_class = _SlowInWorkers
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+
+    start = time.monotonic()
+    scores, settings = _search("slow", _long_sprites(), 0.3)
+
+    assert time.monotonic() - start < 1.5
+    assert settings.size.x * settings.size.y == scores[0][0]
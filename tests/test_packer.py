@@ -0,0 +1,162 @@
+import agglomerate
+import agglomerate.math
+import agglomerate.packer
+
+from tests import util
+
+import io
+import json
+
+import numpy
+import PIL.Image
+import pytest
+
+
+# -----------------------------------------------------------------------------
+# In memory packing
+# -----------------------------------------------------------------------------
+
+
+def test_pack_to_memory_equals_pack(tmp_path):
+    paths = util.save_sprites(tmp_path, 10)
+
+    params = util.new_params([agglomerate.Sprite(p) for p in paths],
+                             directory=tmp_path)
+    agglomerate.packer.pack(params)
+    result = agglomerate.packer.pack_to_memory(util.new_params(
+            [agglomerate.Sprite(p) for p in paths]))
+
+    with PIL.Image.open(str(tmp_path / "sheet.png")) as image:
+        assert numpy.array_equal(util.decode(result.sheet),
+                                 numpy.asarray(image.convert("RGBA")))
+    with open(str(tmp_path / "sheet.json")) as f:
+        assert result.coordinates["simplejson"] == f.read()
+
+
+def test_pack_to_memory_from_bytes_and_images():
+    images = [util.random_image(5 + k, 9 - k, k) for k in range(4)]
+    sprites = []
+    for k, image in enumerate(images):
+        if k % 2:
+            sprites.append(agglomerate.Sprite.from_image(image, str(k)))
+        else:
+            data = io.BytesIO()
+            image.save(data, "png")
+            sprites.append(agglomerate.Sprite.from_bytes(data.getvalue(),
+                                                         str(k)))
+
+    result = agglomerate.packer.pack_to_memory(util.new_params(sprites))
+    sheet = util.decode(result.sheet)
+
+    assert result.sheet_format == "png"
+    assert sheet.shape[:2] == (result.size.y, result.size.x)
+    for s in result.sprites:
+        assert numpy.array_equal(util.crop_sprite(sheet, s),
+                                 numpy.asarray(images[int(s.name)]))
+
+    layout = {e["name"]: e for e in result.layout}
+    coordinates = json.loads(result.coordinates["simplejson"])
+    assert {c["name"] for c in coordinates} == set(layout)
+    for c in coordinates:
+        assert (c["x"], c["y"], c["w"], c["h"]) == \
+            tuple(layout[c["name"]][k] for k in ("x", "y", "width", "height"))
+
+
+def test_pack_to_memory_keeps_sizes():
+    params = util.new_params(util.random_sprites(5))
+    agglomerate.packer.pack_to_memory(params)
+
+    assert params.settings.size.to_tuple() == ("auto", "auto")
+
+
+def test_packing_doesnt_print(capsys, tmp_path):
+    params = util.new_params(util.random_sprites(10), directory=tmp_path)
+    agglomerate.packer.pack_to_memory(params)
+    agglomerate.packer.pack(params)
+    agglomerate.packer.pack(params, pipelined=True)
+
+    assert capsys.readouterr().out == ""
+
+
+# -----------------------------------------------------------------------------
+# Layout only
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_layout_only_saves_only_the_coordinates(tmp_path, pipelined):
+    paths = util.save_sprites(tmp_path, 10)
+    full = tmp_path / "full"
+    full.mkdir()
+    agglomerate.packer.pack(util.new_params(
+            [agglomerate.Sprite(p) for p in paths], directory=full))
+
+    sprites = [agglomerate.Sprite(p) for p in paths]
+    params = util.new_params(sprites, directory=tmp_path)
+    agglomerate.packer.pack(params, pipelined=pipelined, layout_only=True)
+
+    assert not (tmp_path / "sheet.png").exists()
+    with open(str(tmp_path / "sheet.json")) as a, \
+            open(str(full / "sheet.json")) as b:
+        assert a.read() == b.read()
+    # the images were never decoded
+    assert all(s._image is None for s in sprites)
+
+
+# -----------------------------------------------------------------------------
+# Flattening
+# -----------------------------------------------------------------------------
+
+
+def _sprite(name, x, y):
+    sprite = agglomerate.Sprite.from_image(util.solid_image(2, 2), name)
+    sprite.position = agglomerate.math.Vector2(x, y)
+    return sprite
+
+
+def _group(items, x, y):
+    group = agglomerate.Group(items, agglomerate.Settings("binarytree"))
+    group.position = agglomerate.math.Vector2(x, y)
+    return group
+
+
+def test_flatten_places_sprites_absolutely():
+    inner = _group([_sprite("c", 1, 2)], 10, 20)
+    outer = _group([_sprite("b", 3, 4), inner], 100, 200)
+    params = util.new_params([_sprite("a", 5, 6), outer])
+
+    placed = agglomerate.packer.flatten(params)
+
+    assert [(p.name, p.position.to_tuple()) for p in placed] == \
+        [("a", (5, 6)), ("b", (103, 204)), ("c", (111, 222))]
+    # the tree isn't modified
+    assert inner.items[0].position.to_tuple() == (1, 2)
+    assert outer.items[0].position.to_tuple() == (3, 4)
+    assert placed[2].sprite is inner.items[0]
+
+
+def test_flatten_deep_trees():
+    group = _group([_sprite("s", 0, 0)], 1, 1)
+    for __ in range(5000):
+        group = _group([group], 1, 1)
+
+    placed = agglomerate.packer.flatten(util.new_params([group]))
+    assert [p.position.to_tuple() for p in placed] == [(5001, 5001)]
+
+
+def test_flatten_empty_groups():
+    params = util.new_params([_group([], 0, 0), _sprite("a", 0, 0)])
+    assert [p.name for p in agglomerate.packer.flatten(params)] == ["a"]
+
+
+def test_packing_twice_gives_the_same_result():
+    params = util.new_params([
+            agglomerate.Group(util.random_sprites(5, seed=1),
+                              agglomerate.Settings("binarytree")),
+            agglomerate.Group(util.random_sprites(5, seed=2),
+                              agglomerate.Settings("shelf"))])
+    first = agglomerate.packer.pack_to_memory(params)
+    second = agglomerate.packer.pack_to_memory(params)
+
+    assert first.layout == second.layout
+    assert first.sheet == second.sheet
@@ -0,0 +1,65 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.palette
+
+from tests import util
+
+import io
+
+import numpy
+import PIL.Image
+
+
+# -----------------------------------------------------------------------------
+# Palettes
+# -----------------------------------------------------------------------------
+
+
+def test_exact_palette_with_few_colors():
+    images = [util.solid_image(3, 3, (255, 0, 0, 255)),
+              util.solid_image(2, 5, (0, 255, 0, 128))]
+    palette = agglomerate.palette.build_palette(images, [(0, 0, 0, 0)])
+
+    assert {tuple(c) for c in palette} == \
+        {(255, 0, 0, 255), (0, 255, 0, 128), (0, 0, 0, 0)}
+
+
+def test_palette_is_reduced_to_the_maximum():
+    image = util.random_image(64, 64)
+    palette = agglomerate.palette.build_palette([image], max_colors=16)
+    assert len(palette) <= 16
+
+    quantized = agglomerate.palette.quantize(image, palette)
+    assert quantized.mode == "P"
+    used = numpy.unique(numpy.asarray(quantized))
+    assert used.max() < len(palette)
+
+
+def test_quantize_keeps_palette_colors_exactly():
+    pixels = numpy.zeros((4, 4, 4), numpy.uint8)
+    pixels[:2] = (10, 20, 30, 255)
+    pixels[2:] = (200, 100, 0, 0)
+    image = PIL.Image.fromarray(pixels, "RGBA")
+
+    palette = agglomerate.palette.build_palette([image])
+    quantized = agglomerate.palette.quantize(image, palette)
+    assert numpy.array_equal(numpy.asarray(quantized.convert("RGBA")),
+                             pixels)
+
+
+def test_indexed_sheet_round_trip():
+    colors = [(255, 0, 0, 255), (0, 0, 255, 255), (0, 255, 0, 100)]
+    images = [util.solid_image(4 + k, 7 - k, c) for k, c in enumerate(colors)]
+    sprites = [agglomerate.Sprite.from_image(i, str(k))
+               for k, i in enumerate(images)]
+
+    params = util.new_params(sprites)
+    params.settings.output_sheet_color_mode = "P"
+    result = agglomerate.packer.pack_to_memory(params)
+
+    with PIL.Image.open(io.BytesIO(result.sheet)) as image:
+        assert image.mode == "P"
+    sheet = util.decode(result.sheet)
+    for s in result.sprites:
+        assert numpy.array_equal(util.crop_sprite(sheet, s),
+                                 numpy.asarray(images[int(s.name)]))
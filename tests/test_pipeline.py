@@ -0,0 +1,104 @@
+import agglomerate
+import agglomerate.packer
+
+from tests import util
+
+import time
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _pack(directory, pipelined, **settings):
+    """
+    Packs the same sprites in a subdirectory and returns the sheet pixels
+    and the coordinates file
+    """
+    output = directory / ("pipelined" if pipelined else "normal")
+    output.mkdir()
+    params = util.new_params(util.random_sprites(40, 48), directory=output)
+    for key, value in settings.items():
+        setattr(params.settings, key, value)
+    if params.settings.output_sheet_format is not None:
+        params.settings.output_sheet_path = str(
+                output / ("sheet." + params.settings.output_sheet_format))
+
+    agglomerate.packer.pack(params, pipelined=pipelined)
+
+    with PIL.Image.open(params.settings.output_sheet_path) as image:
+        pixels = numpy.asarray(image)
+    with open(params.settings.output_coordinates_path) as f:
+        return pixels, f.read()
+
+
+# -----------------------------------------------------------------------------
+# Pipelined packing
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("settings", [
+    {},
+    {"output_sheet_color_mode": "RGB"},
+    {"output_sheet_color_mode": "L"},
+    {"memory_budget": 1},
+    {"output_sheet_format": "bmp", "output_sheet_color_mode": "RGB"},
+    {"output_sheet_color_mode": "P"},
+])
+def test_pipelined_equals_normal(tmp_path, settings):
+    normal = _pack(tmp_path, False, **settings)
+    pipelined = _pack(tmp_path, True, **settings)
+
+    assert normal[1] == pipelined[1]
+    assert numpy.array_equal(normal[0], pipelined[0])
+
+
+def test_pipelined_sheet_is_a_valid_png(tmp_path):
+    pixels, __ = _pack(tmp_path, True)
+    # taller than a band, so several bands are written
+    assert pixels.shape[0] > 64
+    assert pixels.shape[2] == 4
+
+
+def test_sprites_are_decoded_while_the_items_are_read(tmp_path):
+    paths = util.save_sprites(tmp_path, 5)
+    first = agglomerate.Sprite(paths[0])
+    waited = []
+
+    def read():
+        yield first
+        for p in paths[1:]:
+            # the first sprite is decoded before the generator is exhausted
+            deadline = time.monotonic() + 5
+            while first._image is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            waited.append(first._image is not None)
+            yield agglomerate.Sprite(p)
+
+    params = util.new_params(read(), directory=tmp_path)
+    agglomerate.packer.pack(params, pipelined=True)
+
+    assert waited and all(waited)
+    assert len(params.items) == 5
+    with PIL.Image.open(str(tmp_path / "sheet.png")) as image:
+        sheet = numpy.asarray(image)
+    for s in agglomerate.packer.flatten(params):
+        assert numpy.array_equal(util.crop_sprite(sheet, s),
+                                 numpy.asarray(s.image))
+
+
+@pytest.mark.parametrize("pack", [
+    lambda params: agglomerate.packer.pack(params),
+    lambda params: agglomerate.packer.pack(params, layout_only=True),
+    lambda params: agglomerate.packer.pack_to_memory(params),
+])
+def test_items_can_be_iterables(tmp_path, pack):
+    group = agglomerate.Group(iter(util.random_sprites(4, seed=1)),
+                              agglomerate.Settings("binarytree"))
+    items = (i for i in util.random_sprites(3) + [group])
+    params = util.new_params(items, directory=tmp_path)
+    pack(params)
+
+    assert len(params.items) == 4
+    assert len(group.items) == 4
+    assert len(agglomerate.packer.flatten(params)) == 7
@@ -0,0 +1,105 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.regions
+
+from tests import util
+
+import json
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _pack_sheet(directory, sprites, algorithm="binarytree"):
+    params = util.new_params(sprites, algorithm, directory=directory)
+    agglomerate.packer.pack(params)
+    return str(directory / "sheet.png"), str(directory / "sheet.json")
+
+
+def _pixels(image):
+    return numpy.asarray(image.convert("RGBA"))
+
+
+def test_regions_equal_the_sprites(tmp_path):
+    sprites = util.random_sprites(8)
+    regions = agglomerate.regions.load_regions(*_pack_sheet(tmp_path,
+                                                            sprites))
+
+    expected = {s.name: _pixels(s.image) for s in sprites}
+    assert len(regions) == len(sprites)
+    for r in regions:
+        assert r.size.to_tuple() == expected[r.name].shape[1::-1]
+        assert numpy.array_equal(_pixels(r.image), expected[r.name])
+
+
+def test_regions_are_views_of_one_decoded_sheet(tmp_path):
+    regions = agglomerate.regions.load_regions(
+            *_pack_sheet(tmp_path, util.random_sprites(5)))
+
+    pixels = regions[0].sheet.pixels
+    for r in regions:
+        assert r.sheet is regions[0].sheet
+        prepared, __ = r.prepare("RGBA")
+        assert numpy.shares_memory(prepared, pixels)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_repack_regions(tmp_path, pipelined):
+    sprites = util.random_sprites(8)
+    first = tmp_path / "first"
+    first.mkdir()
+    regions = agglomerate.regions.load_regions(*_pack_sheet(first, sprites))
+
+    params = util.new_params(regions, "shelf", directory=tmp_path)
+    params.settings.memory_budget = 1000
+    agglomerate.packer.pack(params, pipelined=pipelined)
+
+    with PIL.Image.open(str(tmp_path / "sheet.png")) as image:
+        sheet = _pixels(image)
+    expected = {s.name: _pixels(s.image) for s in sprites}
+    for s in agglomerate.packer.flatten(params):
+        assert numpy.array_equal(util.crop_sprite(sheet, s),
+                                 expected[s.name])
+
+
+def test_rotated_regions(tmp_path):
+    image = util.random_image(9, 4)
+    sheet = PIL.Image.new("RGBA", (10, 12))
+    sheet.paste(image.transpose(PIL.Image.ROTATE_270), (3, 2))
+    sheet.save(str(tmp_path / "sheet.png"))
+    with open(str(tmp_path / "sheet.json"), "w") as f:
+        json.dump([{"name": "a", "x": 3, "y": 2, "w": 4, "h": 9,
+                    "rotated": True}], f)
+
+    region, = agglomerate.regions.load_regions(str(tmp_path / "sheet.png"),
+                                               str(tmp_path / "sheet.json"))
+
+    assert region.size.to_tuple() == (9, 4)
+    assert numpy.array_equal(_pixels(region.image), _pixels(image))
+    assert numpy.array_equal(region.prepare("RGBA")[0], _pixels(image))
+
+
+def test_masked_regions_dont_copy_other_sprites(tmp_path):
+    sheet = numpy.full((8, 8, 4), 255, numpy.uint8)
+    PIL.Image.fromarray(sheet, "RGBA").save(str(tmp_path / "sheet.png"))
+    with open(str(tmp_path / "sheet.json"), "w") as f:
+        json.dump([{"name": "a", "x": 0, "y": 0, "w": 8, "h": 8,
+                    "rotated": False, "mask": [[0, 0, 4, 8]]}], f)
+
+    region, = agglomerate.regions.load_regions(str(tmp_path / "sheet.png"),
+                                               str(tmp_path / "sheet.json"))
+    alpha = _pixels(region.image)[:, :, 3]
+
+    assert (alpha[:, :4] == 255).all() and (alpha[:, 4:] == 0).all()
+
+
+def test_regions_out_of_the_sheet(tmp_path):
+    PIL.Image.new("RGBA", (4, 4)).save(str(tmp_path / "sheet.png"))
+    with open(str(tmp_path / "sheet.json"), "w") as f:
+        json.dump([{"name": "a", "x": 2, "y": 0, "w": 4, "h": 4,
+                    "rotated": False}], f)
+
+    with pytest.raises(ValueError):
+        agglomerate.regions.load_regions(str(tmp_path / "sheet.png"),
+                                         str(tmp_path / "sheet.json"))
@@ -0,0 +1,94 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.scaling
+
+from tests import util
+
+import json
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _coordinates(path):
+    with open(path) as f:
+        return {c["name"]: c for c in json.load(f)}
+
+
+# -----------------------------------------------------------------------------
+# Scale variants
+# -----------------------------------------------------------------------------
+
+
+def test_variant_paths():
+    assert agglomerate.scaling.get_variant_path("a/sheet.png", 2) == \
+        "a/sheet@2x.png"
+    assert agglomerate.scaling.get_variant_path("sheet", 0.5) == \
+        "sheet@0.5x"
+
+
+def test_variants_are_saved(tmp_path):
+    params = util.new_params(util.random_sprites(12), directory=tmp_path)
+    params.settings.output_scales = [2, 0.5, 1]
+    agglomerate.packer.pack(params)
+
+    base = _coordinates(str(tmp_path / "sheet.json"))
+    double = _coordinates(str(tmp_path / "sheet@2x.json"))
+    assert not (tmp_path / "sheet@1x.png").exists()
+
+    with PIL.Image.open(str(tmp_path / "sheet.png")) as a, \
+            PIL.Image.open(str(tmp_path / "sheet@2x.png")) as b, \
+            PIL.Image.open(str(tmp_path / "sheet@0.5x.png")) as c:
+        assert b.size == (2 * a.size[0], 2 * a.size[1])
+        assert c.size == (a.size[0] // 2, a.size[1] // 2)
+
+    for name, c in base.items():
+        assert [double[name][k] for k in ("x", "y", "w", "h")] == \
+            [2 * c[k] for k in ("x", "y", "w", "h")]
+
+
+@pytest.mark.parametrize("scale", [0.37, 0.5, 1.5, 3])
+def test_scaled_sprites_dont_overlap(scale):
+    params = util.new_params(util.random_sprites(40, 20))
+    result = agglomerate.packer.pack_to_memory(params)
+    scaled = agglomerate.scaling.scale_sprites(result.sprites, scale)
+
+    assert not agglomerate.packer._has_overlaps(
+            [s for s in scaled if s.size.x > 0 and s.size.y > 0])
+    width, height = (int(result.size.x * scale), int(result.size.y * scale))
+    for s in scaled:
+        assert s.position.x + s.size.x <= width
+        assert s.position.y + s.size.y <= height
+
+
+def test_in_memory_variants():
+    images = [util.solid_image(4, 6, (255, 0, 0, 255)),
+              util.solid_image(8, 2, (0, 0, 255, 255))]
+    params = util.new_params([agglomerate.Sprite.from_image(i, str(k))
+                              for k, i in enumerate(images)])
+    params.settings.output_scales = [3]
+    result = agglomerate.packer.pack_to_memory(params)
+
+    variant = result.variants[3]
+    assert variant.size.to_tuple() == (3 * result.size.x, 3 * result.size.y)
+    sheet = util.decode(variant.sheet)
+    for s in variant.sprites:
+        # solid colors are kept when resampling
+        assert (util.crop_sprite(sheet, s) ==
+                numpy.asarray(images[int(s.name)])[0, 0]).all()
+
+
+@pytest.mark.parametrize("scales", [[0], [-2]])
+def test_invalid_scales(scales):
+    params = util.new_params(util.random_sprites(2))
+    params.settings.output_scales = scales
+    with pytest.raises(ValueError):
+        agglomerate.packer.pack_to_memory(params)
+
+
+def test_block_compressed_variants_use_integer_scales():
+    params = util.new_params(util.random_sprites(2), sheet_format="bc1")
+    params.settings.output_scales = [1.5]
+    with pytest.raises(ValueError):
+        agglomerate.packer.pack_to_memory(params)
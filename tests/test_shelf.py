@@ -0,0 +1,87 @@
+import agglomerate
+import agglomerate.algorithm
+import agglomerate.validation
+from agglomerate.algorithms import shelf
+from agglomerate.math import Vector2
+
+import random
+
+import pytest
+
+
+def _items(count, seed=0, max_size=30):
+    rng = random.Random(seed)
+    items = []
+    for __ in range(count):
+        item = agglomerate.Item()
+        item.type = "sprite"
+        item.size = Vector2(rng.randint(1, max_size), rng.randint(1, max_size))
+        items.append(item)
+    return items
+
+
+def _pack(items, policy="first_fit", size=("auto", "auto")):
+    settings = agglomerate.Settings("shelf")
+    settings.size = Vector2(*size)
+    settings.algorithm_options = {"policy": policy}
+    shelf.ShelfAlgorithm().pack(items, settings)
+    return settings
+
+
+def _best_fit_reference(items, width):
+    """
+    Best fit placement checking every shelf
+    """
+    shelves = []
+    positions = []
+    height = 0
+    for i in sorted(items, key=lambda i: (i.size.y, i.size.x), reverse=True):
+        fitting = [k for k, (__, used) in enumerate(shelves)
+                   if width - used >= i.size.x]
+        if fitting:
+            k = min(fitting, key=lambda k: (width - shelves[k][1], k))
+        else:
+            k = len(shelves)
+            shelves.append((height, 0))
+            height += i.size.y
+        y, used = shelves[k]
+        positions.append((used, y))
+        shelves[k] = (y, used + i.size.x)
+    return positions
+
+
+@pytest.mark.parametrize("policy", shelf.ShelfAlgorithm.policies)
+@pytest.mark.parametrize("size", [("auto", "auto"), (100, "auto"),
+                                  ("auto", 400)])
+def test_layouts_are_valid(policy, size):
+    items = _items(300)
+    settings = _pack(items, policy, size)
+
+    assert agglomerate.validation.find_problems(items, settings) == []
+    if size[0] != "auto":
+        assert settings.size.x == size[0]
+
+
+def test_best_fit_chooses_the_tightest_shelf():
+    items = _items(500, seed=3)
+    _pack(items, "best_fit", (120, "auto"))
+
+    assert [i.position.to_tuple() for i in items] == \
+        _best_fit_reference(items, 120)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        _pack(_items(3), "worst_fit")
+
+
+def test_out_of_space():
+    with pytest.raises(agglomerate.algorithm.AlgorithmOutOfSpaceException):
+        _pack(_items(3, max_size=30), size=(2, "auto"))
+    with pytest.raises(agglomerate.algorithm.AlgorithmOutOfSpaceException):
+        _pack(_items(50), size=(30, 30))
+
+
+def test_no_items():
+    settings = _pack([])
+    assert settings.size.to_tuple() == (0, 0)
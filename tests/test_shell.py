@@ -0,0 +1,118 @@
+import agglomerate.packer
+import agglomerate.ui.shell
+
+from tests import util
+
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+
+# the repository, so the shell runs without installing agglomerate
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _shell(*args):
+    """
+    Runs the shell with the given arguments and returns the finished process
+    """
+    return subprocess.run([
+            sys.executable, "-c",
+            "import sys; sys.argv = ['agglomerate'] + sys.argv[1:]; "
+            "import agglomerate.ui.shell; agglomerate.ui.shell.main()"] +
+            list(args), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, cwd=str(_ROOT))
+
+
+def _settings(directory):
+    return {
+        "algorithm": "binarytree",
+        "format": "simplejson",
+        "output_sheet_path": str(directory / "sheet"),
+        "output_coordinates_path": str(directory / "sheet"),
+        "output_sheet_format": None,
+        "output_sheet_color_mode": "RGBA",
+        "allow": {"rotation": False, "cropping": False},
+        "require": {"square_size": False, "power_of_two_size": False,
+                    "padding": False},
+        "size": {"x": "auto", "y": "auto"},
+        "background_color": "#00000000",
+    }
+
+
+# -----------------------------------------------------------------------------
+# Loading parameters
+# -----------------------------------------------------------------------------
+
+
+def test_parameters_file(tmp_path):
+    paths = util.save_sprites(tmp_path, 6)
+    group = {"items": paths[3:] + [paths[0]],
+             "settings": {"algorithm": "shelf",
+                          "allow": {"rotation": False, "cropping": False},
+                          "require": {"square_size": False,
+                                      "power_of_two_size": False,
+                                      "padding": False},
+                          "size": {"x": "auto", "y": "auto"}}}
+    path = str(tmp_path / "params.json")
+    with open(path, "w") as f:
+        json.dump({"settings": _settings(tmp_path),
+                   "items": paths[:3] + [group]}, f, indent=2)
+
+    params = agglomerate.ui.shell._load_parameters_from_file(path)
+
+    assert [i.path for i in params.items[:3]] == paths[:3]
+    # the first sprite was already loaded by the parameters group
+    assert [i.path for i in params.items[3].items] == paths[3:]
+    assert params.items[3].settings.algorithm == "shelf"
+    assert params.settings.output_sheet_path == str(tmp_path / "sheet.png")
+    assert params.settings.output_coordinates_path == \
+        str(tmp_path / "sheet.json")
+
+    agglomerate.packer.pack(params)
+    assert os.path.exists(str(tmp_path / "sheet.png"))
+
+
+def test_sprites_list(tmp_path):
+    paths = util.save_sprites(tmp_path, 4)
+    path = str(tmp_path / "list.txt")
+    with open(path, "w") as f:
+        f.write("\n".join([paths[0], "", paths[1], paths[0],
+                           paths[2] + "\r", paths[3]]) + "\n")
+
+    loaded = {os.path.normpath(paths[3])}
+    sprites = list(agglomerate.ui.shell._load_sprites_from_list(path,
+                                                                loaded))
+    assert [s.path for s in sprites] == paths[:3]
+    assert len(loaded) == 4
+
+
+def test_pack_from_a_list_of_images(tmp_path):
+    paths = util.save_sprites(tmp_path, 5)
+    images = str(tmp_path / "list.txt")
+    with open(images, "w") as f:
+        f.write("\n".join(paths[1:]) + "\n")
+
+    process = _shell("pack", "-p", "-i", paths[0], "-I", images, "-o",
+                     str(tmp_path / "sheet.png"), str(tmp_path / "sheet.json"))
+    assert process.returncode == 0
+
+    with open(str(tmp_path / "sheet.json")) as f:
+        assert len(json.load(f)) == 5
+
+
+def test_validate_needs_the_sheet_or_its_size(tmp_path):
+    paths = util.save_sprites(tmp_path, 3)
+    coordinates = str(tmp_path / "sheet.json")
+    assert _shell("pack", "-i", *paths, "-o", str(tmp_path / "sheet.png"),
+                  coordinates).returncode == 0
+
+    process = _shell("validate", coordinates)
+    assert process.returncode == 2
+    assert "usage:" in process.stderr
+    assert "the sheet or its size must be given" in process.stderr
+
+    assert _shell("validate", coordinates, "-S",
+                  str(tmp_path / "sheet.png")).returncode == 0
@@ -0,0 +1,110 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.tiles
+
+from tests import util
+
+import json
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _tiled_image(pattern, tile_size, seed=0):
+    """
+    Returns an image made of tiles, each number of the pattern (a list of
+    rows) is a different tile, 0 is transparent
+    """
+    rows, columns = len(pattern), len(pattern[0])
+    pixels = numpy.zeros((rows * tile_size, columns * tile_size, 4),
+                         numpy.uint8)
+    for r, row in enumerate(pattern):
+        for c, n in enumerate(row):
+            if n:
+                pixels[r * tile_size:(r + 1) * tile_size,
+                       c * tile_size:(c + 1) * tile_size] = numpy.asarray(
+                    util.random_image(tile_size, tile_size, seed + n))
+    return PIL.Image.fromarray(pixels, "RGBA")
+
+
+def _rebuild(tile_map, tiles, size):
+    """
+    Rebuilds a source image from its map and the tile pixels by name
+    """
+    t = tile_map.tile_size
+    rows, columns = tile_map.indices.shape
+    pixels = numpy.zeros((rows * t, columns * t, 4), numpy.uint8)
+    for r in range(rows):
+        for c in range(columns):
+            index = tile_map.indices[r, c]
+            if index >= 0:
+                pixels[r * t:(r + 1) * t, c * t:(c + 1) * t] = \
+                    tiles["tile_" + str(index)]
+    return pixels[:size[1], :size[0]]
+
+
+# -----------------------------------------------------------------------------
+# Tiles
+# -----------------------------------------------------------------------------
+
+
+def test_sources_are_rebuilt_from_the_sheet():
+    images = [_tiled_image([[1, 2, 1], [0, 3, 1]], 8),
+              _tiled_image([[3, 4], [1, 0]], 8)]
+    sources = [agglomerate.Sprite.from_image(i, str(k))
+               for k, i in enumerate(images)]
+
+    tiles, maps = agglomerate.tiles.make_tiles(sources, 8)
+    # 1, 2, 3 and 4, empty tiles aren't packed
+    assert len(tiles) == 4
+
+    result = agglomerate.packer.pack_to_memory(util.new_params(tiles))
+    sheet = util.decode(result.sheet)
+    pixels = {s.name: util.crop_sprite(sheet, s) for s in result.sprites}
+
+    for image, tile_map in zip(images, maps):
+        assert numpy.array_equal(_rebuild(tile_map, pixels, image.size),
+                                 numpy.asarray(image))
+
+
+def test_images_are_padded():
+    image = util.random_image(13, 5)
+    tiles, maps = agglomerate.tiles.make_tiles(
+            [agglomerate.Sprite.from_image(image, "a")], 4)
+
+    assert maps[0].indices.shape == (2, 4)
+    pixels = {t.name: numpy.asarray(t.image) for t in tiles}
+    assert numpy.array_equal(_rebuild(maps[0], pixels, image.size),
+                             numpy.asarray(image))
+
+
+def test_empty_tiles_can_be_packed():
+    image = _tiled_image([[1, 0], [0, 0]], 4)
+    tiles, maps = agglomerate.tiles.make_tiles(
+            [agglomerate.Sprite.from_image(image, "a")], 4, skip_empty=False)
+
+    assert len(tiles) == 2
+    assert (maps[0].indices >= 0).all()
+
+
+def test_invalid_tile_size():
+    with pytest.raises(ValueError):
+        agglomerate.tiles.make_tiles([], 0)
+
+
+def test_saved_maps(tmp_path):
+    image = _tiled_image([[1, 1], [2, 0]], 4)
+    tiles, maps = agglomerate.tiles.make_tiles(
+            [agglomerate.Sprite.from_image(image, "a")], 4)
+    path = str(tmp_path / "maps.json")
+    agglomerate.tiles.save_maps(maps, tiles, path)
+
+    with open(path) as f:
+        data = json.load(f)
+    assert data["tiles"] == ["tile_0", "tile_1"]
+    assert data["images"] == [maps[0].to_dict()]
+    (a, b), (c, d) = data["images"][0]["indices"]
+    assert a == b != c
+    assert {a, c} == {0, 1}
+    assert d == -1
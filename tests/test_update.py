@@ -0,0 +1,188 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.update
+
+from tests import util
+
+import json
+import os
+
+import numpy
+import PIL.Image
+import pytest
+
+
+def _params(directory, paths):
+    return util.new_params([agglomerate.Sprite(p) for p in paths],
+                           directory=directory)
+
+
+def _coordinates(directory):
+    with open(str(directory / "sheet.json")) as f:
+        return {c["name"]: (c["x"], c["y"], c["w"], c["h"])
+                for c in json.load(f)}
+
+
+def _check_sheet(directory, paths):
+    """
+    Checks that every sprite is drawn where the coordinates say
+    """
+    with PIL.Image.open(str(directory / "sheet.png")) as image:
+        sheet = numpy.asarray(image.convert("RGBA"))
+    coordinates = _coordinates(directory)
+    for p in paths:
+        x, y, w, h = coordinates[os.path.basename(p)]
+        with PIL.Image.open(p) as image:
+            assert numpy.array_equal(sheet[y:y + h, x:x + w],
+                                     numpy.asarray(image.convert("RGBA")))
+    return sheet, coordinates
+
+
+def _overlapping(rectangles):
+    """
+    Returns True if any two (x, y, width, height) rectangles overlap
+    """
+    return any(a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and
+               a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+               for n, a in enumerate(rectangles) for b in rectangles[:n])
+
+
+@pytest.fixture
+def packed(tmp_path):
+    """
+    Paths of sprites already packed in tmp_path, with the files older than
+    the sheet
+    """
+    paths = util.save_sprites(tmp_path, 12)
+    agglomerate.packer.pack(_params(tmp_path, paths))
+    past = os.path.getmtime(str(tmp_path / "sheet.png")) - 100
+    for p in paths:
+        os.utime(p, (past, past))
+    return paths
+
+
+# -----------------------------------------------------------------------------
+# Updates
+# -----------------------------------------------------------------------------
+
+
+def test_new_sprites_keep_the_others_in_place(tmp_path, packed):
+    before = _coordinates(tmp_path)
+    new = []
+    for k in range(3):
+        new.append(str(tmp_path / "new{}.png".format(k)))
+        util.random_image(10 + 5 * k, 20 - 5 * k, 100 + k).save(new[-1])
+
+    regions = agglomerate.update.update(_params(tmp_path, packed + new))
+
+    __, after = _check_sheet(tmp_path, packed + new)
+    for name, placement in before.items():
+        assert after[name] == placement
+    # only the new sprites were drawn
+    assert sorted(regions) == sorted(after[os.path.basename(p)]
+                                     for p in new)
+    assert not _overlapping(list(after.values()))
+
+
+def test_removed_sprites_are_cleared(tmp_path, packed):
+    before = _coordinates(tmp_path)
+    removed = os.path.basename(packed[0])
+
+    regions = agglomerate.update.update(_params(tmp_path, packed[1:]))
+
+    sheet, after = _check_sheet(tmp_path, packed[1:])
+    assert removed not in after
+    assert regions == [before[removed]]
+    x, y, w, h = before[removed]
+    assert not sheet[y:y + h, x:x + w].any()
+
+
+def test_modified_sprites_are_drawn_again(tmp_path, packed):
+    before = _coordinates(tmp_path)
+    name = os.path.basename(packed[3])
+    x, y, w, h = before[name]
+    util.random_image(w, h, 1000).save(packed[3])
+
+    regions = agglomerate.update.update(_params(tmp_path, packed))
+
+    __, after = _check_sheet(tmp_path, packed)
+    assert after == before
+    assert regions == [before[name]]
+
+
+def test_resized_sprites_are_placed_again(tmp_path, packed):
+    before = _coordinates(tmp_path)
+    util.random_image(70, 3, 1000).save(packed[5])
+
+    agglomerate.update.update(_params(tmp_path, packed))
+
+    __, after = _check_sheet(tmp_path, packed)
+    assert after[os.path.basename(packed[5])][2:] == (70, 3)
+    for p in packed[:5] + packed[6:]:
+        name = os.path.basename(p)
+        assert after[name] == before[name]
+
+
+def test_groups_cant_be_updated(tmp_path, packed):
+    params = util.new_params(
+            [agglomerate.Group([agglomerate.Sprite(p) for p in packed],
+                               agglomerate.Settings("binarytree"))],
+            directory=tmp_path)
+    with pytest.raises(ValueError):
+        agglomerate.update.update(params)
+
+
+@pytest.mark.parametrize("missing", ["sheet.png", "sheet.json"])
+def test_missing_previous_files_pack_the_sheet(tmp_path, missing):
+    paths = util.save_sprites(tmp_path, 6)
+    agglomerate.packer.pack(_params(tmp_path, paths))
+    os.remove(str(tmp_path / missing))
+
+    regions = agglomerate.update.update(_params(tmp_path, paths))
+
+    sheet, after = _check_sheet(tmp_path, paths)
+    assert regions == [(0, 0, sheet.shape[1], sheet.shape[0])]
+    assert not _overlapping(list(after.values()))
+
+
+def test_unreadable_previous_coordinates_pack_the_sheet(tmp_path, packed):
+    with open(str(tmp_path / "sheet.json"), "w") as f:
+        f.write("not json")
+
+    agglomerate.update.update(_params(tmp_path, packed))
+
+    _check_sheet(tmp_path, packed)
+
+
+def test_first_update_packs_the_sheet(tmp_path):
+    paths = util.save_sprites(tmp_path, 6)
+    agglomerate.update.update(_params(tmp_path, paths))
+
+    _check_sheet(tmp_path, paths)
+
+
+# -----------------------------------------------------------------------------
+# Free space
+# -----------------------------------------------------------------------------
+
+
+def test_narrow_free_space_grows():
+    free = agglomerate.update._FreeRectangles(10, 10)
+    free.occupy(0, 0, 8, 10)
+    free.grow(15, 10)
+
+    # the strip left at the right joins the grown space
+    assert free.find(7, 10) == (8, 0)
+    assert free.find(8, 10) is None
+
+
+def test_contained_rectangles_are_pruned():
+    free = agglomerate.update._FreeRectangles(10, 10)
+    free.occupy(4, 4, 2, 2)
+
+    assert sorted(free.rectangles) == [(0, 0, 4, 10), (0, 0, 10, 4),
+                                       (0, 6, 10, 10), (6, 0, 10, 10)]
+    for a in free.rectangles:
+        for b in free.rectangles:
+            assert a == b or not (b[0] <= a[0] and b[1] <= a[1] and
+                                  a[2] <= b[2] and a[3] <= b[3])
@@ -0,0 +1,155 @@
+import agglomerate.util
+import agglomerate.ui.shell
+
+from tests import util
+
+import io
+import json
+import os
+
+import pytest
+
+
+def _touch(directory, *paths):
+    for p in paths:
+        path = directory / p
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+
+
+def _relative(paths, directory):
+    return [os.path.relpath(p, str(directory)).replace(os.sep, "/")
+            for p in paths]
+
+
+# -----------------------------------------------------------------------------
+# Path matching
+# -----------------------------------------------------------------------------
+
+
+def test_double_star_matches_any_depth(tmp_path):
+    _touch(tmp_path, "s/a.png", "s/b.txt", "s/x/c.png", "s/x/y/d.png",
+           "e.png")
+    found = agglomerate.util.get_matching_paths(str(tmp_path / "s/**/*.png"))
+    assert _relative(found, tmp_path) == ["s/a.png", "s/x/c.png",
+                                          "s/x/y/d.png"]
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="needs symlinks")
+def test_double_star_doesnt_follow_links(tmp_path):
+    _touch(tmp_path, "s/a.png", "s/x/b.png", "other/c.png")
+    try:
+        # a link back to a parent directory and one to another directory
+        os.symlink(str(tmp_path / "s"), str(tmp_path / "s/x/loop"))
+        os.symlink(str(tmp_path / "other"), str(tmp_path / "s/other"))
+    except OSError:
+        pytest.skip("symlinks can't be created")
+
+    found = agglomerate.util.get_matching_paths(str(tmp_path / "s/**/*.png"))
+    assert _relative(found, tmp_path) == ["s/a.png", "s/x/b.png"]
+
+    # links given explicitly are followed
+    found = agglomerate.util.get_matching_paths(str(tmp_path / "s/other/*"))
+    assert _relative(found, tmp_path) == ["s/other/c.png"]
+
+
+def test_wildcards_in_directories(tmp_path):
+    _touch(tmp_path, "a1/f.png", "a2/f.png", "b1/f.png", "a3")
+    found = agglomerate.util.get_matching_paths(str(tmp_path / "a*/f.png"))
+    assert _relative(found, tmp_path) == ["a1/f.png", "a2/f.png"]
+
+
+def test_plain_and_missing_paths(tmp_path):
+    _touch(tmp_path, "s/a.png")
+    assert agglomerate.util.get_matching_paths(str(tmp_path / "s/a.png")) \
+        == [str(tmp_path / "s/a.png")]
+    assert agglomerate.util.get_matching_paths(str(tmp_path / "s/z.png")) \
+        == []
+    assert agglomerate.util.get_matching_paths(str(tmp_path / "t/*")) == []
+    # directories aren't returned
+    assert agglomerate.util.get_matching_paths(str(tmp_path / "*")) == []
+
+
+def test_relative_paths(tmp_path, monkeypatch):
+    _touch(tmp_path, "a.png", "d/b.png")
+    monkeypatch.chdir(tmp_path)
+    assert agglomerate.util.get_matching_paths("*.png") == ["./a.png"]
+    assert agglomerate.util.get_matching_paths("**/*.png") == \
+        ["./a.png", "./d/b.png"]
+
+
+def test_directories_are_listed_once(tmp_path):
+    class CountingCache(agglomerate.util.DirectoryCache):
+        def __init__(self):
+            super().__init__()
+            self.scanned = []
+
+        def list(self, directory):
+            key = os.path.normpath(directory)
+            if key not in self._listings:
+                self.scanned.append(key)
+            return super().list(directory)
+
+    _touch(tmp_path, "s/a.png", "s/b.png", "s/x/c.png")
+    cache = CountingCache()
+    for pattern in ("s/*.png", "s/**/*.png", "s/a.png", "s/x/*"):
+        agglomerate.util.get_matching_paths(str(tmp_path / pattern), cache)
+
+    assert len(cache.scanned) == len(set(cache.scanned))
+
+
+def test_files_matched_twice_are_loaded_once(tmp_path):
+    (tmp_path / "s").mkdir()
+    for name in ("a", "b"):
+        util.solid_image(2, 2).save(str(tmp_path / "s" / (name + ".png")))
+    sprites = list(agglomerate.ui.shell._load_sprites(
+            [str(tmp_path / "s/*.png"), str(tmp_path / "s/a.png"),
+             str(tmp_path / "s/./b.png")],
+            agglomerate.util.DirectoryCache(), set()))
+    assert [os.path.basename(s.path) for s in sprites] == ["a.png", "b.png"]
+
+
+# -----------------------------------------------------------------------------
+# JSON reader
+# -----------------------------------------------------------------------------
+
+
+_DOCUMENT = {
+    "items": ["a", {"items": [1, 2.5e10, -3], "settings": {}}, "bé\"c"],
+    "settings": {"x": None, "y": True, "z": [[], {}], "w": 12345678901234},
+}
+
+
+def _read_any(reader):
+    """
+    Reads the next value walking objects and arrays with the reader
+    """
+    if reader.peek() == "{":
+        return {k: _read_any(reader) for k in reader.object()}
+    if reader.peek() == "[":
+        return [_read_any(reader) for __ in reader.array()]
+    return reader.value()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 65536])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_json_reader_round_trip(chunk_size, indent):
+    f = io.StringIO(json.dumps(_DOCUMENT, indent=indent))
+    reader = agglomerate.util.JSONReader(f, chunk_size)
+    assert _read_any(reader) == _DOCUMENT
+    assert reader.peek() == ""
+
+
+def test_json_reader_reads_values_whole():
+    reader = agglomerate.util.JSONReader(io.StringIO(json.dumps(_DOCUMENT)),
+                                         3)
+    values = {k: reader.value() for k in reader.object()}
+    assert values == _DOCUMENT
+
+
+@pytest.mark.parametrize("document", ["[1 2]", "{1: 2}", "{\"a\" 1}", "[1,",
+                                      "{\"a\": }"])
+def test_json_reader_errors(document):
+    reader = agglomerate.util.JSONReader(io.StringIO(document), 2)
+    with pytest.raises(ValueError):
+        _read_any(reader)
@@ -0,0 +1,125 @@
+import agglomerate
+import agglomerate.packer
+import agglomerate.validation
+from agglomerate.math import Vector2
+
+from tests import util
+
+import sys
+import types
+
+import numpy
+import pytest
+
+
+def _brute_force(rectangles, owners=None):
+    """
+    Returns True if any two rectangles with area and different owners
+    overlap
+    """
+    for a, (ax, ay, ar, ab) in enumerate(rectangles):
+        for b, (bx, by, br, bb) in enumerate(rectangles[:a]):
+            if owners is not None and owners[a] == owners[b]:
+                continue
+            if ax < ar and ay < ab and bx < br and by < bb and \
+                    ax < br and bx < ar and ay < bb and by < ab:
+                return True
+    return False
+
+
+def _random_rectangles(count, seed):
+    """
+    Returns small rectangles in a small area, so many touch or overlap and
+    some have no area
+    """
+    rng = numpy.random.default_rng(seed)
+    rectangles = []
+    for __ in range(count):
+        x, y = (int(v) for v in rng.integers(0, 30, 2))
+        w, h = (int(v) for v in rng.integers(0, 6, 2))
+        rectangles.append((x, y, x + w, y + h))
+    return rectangles
+
+
+def _sprite(name, x, y, w, h):
+    sprite = agglomerate.Sprite.from_image(util.solid_image(w, h), name)
+    sprite.position = Vector2(x, y) if x is not None else None
+    return sprite
+
+
+# -----------------------------------------------------------------------------
+# Overlaps
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_overlaps_equal_brute_force(seed):
+    rectangles = _random_rectangles(int(seed % 20) + 1, seed)
+    owners = [k % 3 for k in range(len(rectangles))] if seed % 2 else None
+
+    found = agglomerate.validation.find_overlap(rectangles, owners)
+    assert (found is not None) == _brute_force(rectangles, owners)
+    if found is not None:
+        a, b = found
+        assert _brute_force([rectangles[a], rectangles[b]])
+
+
+def test_touching_rectangles_dont_overlap():
+    rectangles = [(0, 0, 5, 5), (5, 0, 10, 5), (0, 5, 5, 10), (5, 5, 10, 10)]
+    assert agglomerate.validation.find_overlap(rectangles) is None
+    assert agglomerate.validation.find_overlap([]) is None
+
+
+# -----------------------------------------------------------------------------
+# Layouts
+# -----------------------------------------------------------------------------
+
+
+def test_layout_problems():
+    settings = agglomerate.Settings("binarytree")
+    settings.size = Vector2(10, 10)
+    items = [_sprite("a", 0, 0, 4, 4), _sprite("b", 8, 8, 4, 4),
+             _sprite("c", None, None, 2, 2), _sprite("d", 2, 2, 4, 4)]
+
+    problems = agglomerate.validation.find_problems(items, settings)
+    assert len(problems) == 3
+    assert "b" in problems[0] and "out of the sheet" in problems[0]
+    assert "c has no position" == problems[1]
+    assert "a and d overlap" == problems[2]
+
+
+def test_size_must_be_set():
+    settings = agglomerate.Settings("binarytree")
+    with pytest.raises(agglomerate.validation.InvalidLayoutException) as e:
+        agglomerate.validation.validate([_sprite("a", 0, 0, 1, 1)], settings)
+    assert len(e.value.problems) == 1
+
+
+def test_masks_can_interlock():
+    settings = agglomerate.Settings("mask")
+    settings.size = Vector2(4, 4)
+    a = _sprite("a", 0, 0, 4, 4)
+    a.mask = [(0, 0, 2, 4)]
+    b = _sprite("b", 0, 0, 4, 4)
+    b.mask = [(2, 0, 2, 4)]
+
+    assert agglomerate.validation.find_problems([a, b], settings, True) == []
+    assert agglomerate.validation.find_problems([a, b], settings) != []
+
+
+def test_bad_algorithms_are_rejected(monkeypatch):
+    class Stacking(agglomerate.Algorithm):
+        supports = dict(agglomerate.Algorithm.supports, auto_size=True)
+
+        def pack(self, items, settings):
+            for i in items:
+                i.position = Vector2(0, 0)
+            settings.size = Vector2(100, 100)
+
+    module = types.ModuleType("agglomerate.algorithms.stacking")
+    module.algorithm_class = Stacking
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+
+    params = util.new_params(util.random_sprites(3), algorithm="stacking")
+    with pytest.raises(agglomerate.validation.InvalidLayoutException):
+        agglomerate.packer.pack_to_memory(params)
@@ -0,0 +1,90 @@
+import agglomerate
+
+import io
+
+import numpy
+import PIL.Image
+
+
+"""
+Helpers shared by the tests.
+"""
+
+
+def solid_image(width, height, color=(255, 0, 0, 255)):
+    """
+    Returns an RGBA image filled with a color
+    """
+    return PIL.Image.new("RGBA", (width, height), color)
+
+
+def random_image(width, height, seed=0):
+    """
+    Returns an RGBA image of opaque noise, so every sprite is different
+    """
+    rng = numpy.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 4), numpy.uint8)
+    pixels[:, :, 3] = 255
+    return PIL.Image.fromarray(pixels, "RGBA")
+
+
+def random_sprites(count, max_size=32, seed=0):
+    """
+    Returns sprites of random sizes and pixels created in memory, named
+    s0, s1, ...
+    """
+    rng = numpy.random.default_rng(seed)
+    return [agglomerate.Sprite.from_image(
+                random_image(int(rng.integers(1, max_size + 1)),
+                             int(rng.integers(1, max_size + 1)), seed + i),
+                "s{}".format(i))
+            for i in range(count)]
+
+
+def save_sprites(directory, count, max_size=32, seed=0):
+    """
+    Saves random sprites as PNG files in the directory
+
+    :return: list of paths
+    """
+    paths = []
+    for s in random_sprites(count, max_size, seed):
+        path = str(directory / (s.name + ".png"))
+        s.image.save(path)
+        paths.append(path)
+    return paths
+
+
+def new_params(items, algorithm="binarytree", formats="simplejson",
+               directory=None, sheet_format=None):
+    """
+    Returns parameters with default settings, saving the output in the
+    directory if given
+    """
+    settings = agglomerate.SheetSettings(algorithm, formats)
+    settings.output_sheet_format = sheet_format
+    if directory is not None:
+        settings.output_sheet_path = str(directory / "sheet.png")
+        settings.output_coordinates_path = str(directory / "sheet.json")
+    return agglomerate.Parameters(items, settings)
+
+
+def decode(data):
+    """
+    Returns the RGBA pixels of an encoded image as an array
+    """
+    with PIL.Image.open(io.BytesIO(data)) as image:
+        return numpy.asarray(image.convert("RGBA"))
+
+
+def crop_sprite(sheet, sprite):
+    """
+    Returns the pixels of a placed sprite in a sheet array, rotated back if
+    it was rotated
+    """
+    x, y = sprite.position.to_tuple()
+    w, h = sprite.size.to_tuple()
+    pixels = sheet[y:y + h, x:x + w]
+    if sprite.rotated:
+        pixels = numpy.rot90(pixels, 1)
+    return pixels